@@ -1,7 +1,8 @@
 import os
 import librosa
 import soundfile as sf
-import numpy as np
+
+from effects.adjust_speed import time_stretch_multi
 
 # --- 配置 ---
 # 要扫描的根目录
@@ -10,22 +11,21 @@ TARGET_DIR = "data_output_grid"
 SPEEDS_TO_APPLY = [0.5, 1.25, 2.0]
 
 
-def adjust_speed(y, sr, rate):
+def adjust_speeds(y, sr, rates):
     """
-    以指定的速率改变音频的播放速度。
+    以多个指定速率改变音频的播放速度。STFT 只计算一次，所有速率共用 (见 effects.adjust_speed.time_stretch_multi)。
 
     参数:
     y (np.ndarray): 输入的音频数据 NumPy 数组。
     sr (int): 音频的采样率 (Hz)。
-    rate (float): 目标速度倍率。
+    rates (list[float]): 目标速度倍率列表。
 
     返回:
-    np.ndarray: 改变速度后的音频数据。
+    list[np.ndarray] | None: 与 rates 一一对应的改变速度后的音频数据；出错时返回 None。
     """
     try:
-        # 使用 librosa 进行时间拉伸，不改变音高
-        y_stretched = librosa.effects.time_stretch(y, rate=rate)
-        return y_stretched.astype(np.float32)
+        # 相位声码器实现的时间拉伸，不改变音高
+        return time_stretch_multi(y, rates)
     except Exception as e:
         print(f"    ❌ 调整速度时出错: {e}")
         return None
@@ -68,25 +68,24 @@ def main():
         directory, filename = os.path.split(filepath)
         base_name, ext = os.path.splitext(filename)
 
-        # 为每个指定的倍速创建一个版本
-        for speed in SPEEDS_TO_APPLY:
-            print(f"  - 正在生成 {speed:.2f}x 倍速版本...")
-
-            # 调整速度
-            y_new = adjust_speed(y_original, sr, rate=speed)
-
-            if y_new is not None:
-                # 构建新的输出文件名，例如: "original_name_speed_0.50x.wav"
-                new_filename = f"{base_name}_speed_{speed:.2f}x{ext}"
-                output_path = os.path.join(directory, new_filename)
-
-                # 保存新的音频文件
-                try:
-                    sf.write(output_path, y_new, sr)
-                    print(f"    ✅ 已保存至: {output_path}")
-                    total_files_created += 1
-                except Exception as e:
-                    print(f"    ❌ 保存文件失败: {e}")
+        # 一次生成所有指定倍速的版本
+        print(f"  - 正在生成 {', '.join(f'{speed:.2f}x' for speed in SPEEDS_TO_APPLY)} 倍速版本...")
+        variants = adjust_speeds(y_original, sr, SPEEDS_TO_APPLY)
+        if variants is None:
+            continue
+
+        for speed, y_new in zip(SPEEDS_TO_APPLY, variants):
+            # 构建新的输出文件名，例如: "original_name_speed_0.50x.wav"
+            new_filename = f"{base_name}_speed_{speed:.2f}x{ext}"
+            output_path = os.path.join(directory, new_filename)
+
+            # 保存新的音频文件
+            try:
+                sf.write(output_path, y_new, sr)
+                print(f"    ✅ 已保存至: {output_path}")
+                total_files_created += 1
+            except Exception as e:
+                print(f"    ❌ 保存文件失败: {e}")
 
     print(f"\n--- 所有任务完成 ---")
     print(f"总共创建了 {total_files_created} 个新的倍速音频文件。")
@@ -0,0 +1,261 @@
+import os
+import sys
+import json
+import queue
+import threading
+import itertools
+
+from batch_process_grid import CONFIGS_DIR, EFFECT_RESOURCES, INPUT_DIR, OUTPUT_DIR, load_configs
+from evaluation.asr_backends import create_backend
+from evaluation.asr_cache import parse_cache_args
+from evaluation.run_eval import (DEFAULT_TRUTH, WERAggregator, load_done_paths, load_truth_index, open_for_append,
+                                 print_summary)
+from evaluation.truth_eval import normalize_text
+from pipeline.chain import get_compiled_chain
+from pipeline.input_cache import DEFAULT_MAX_BYTES, configure_input_cache, parse_cache_mb_arg
+from pipeline.parallel import derive_seed, seed_everything
+from pipeline.prefix_tree import combination_params, combination_suffix, core_dims
+from pipeline.render import render_audio, write_output_now
+from pipeline.sinks import encode_audio
+
+# 渲染结果在送入识别后端前最多积压的条数 (以识别批大小的倍数计)，限制内存占用
+QUEUE_BATCHES = 2
+
+
+def build_jobs(scene_configs, input_files, truth_index):
+    """
+    按 batch_process_grid.py 的方式展开每个场景的核心参数组合，任务的种子与输出路径与其相同，
+    因此渲染出的音频与网格批处理写出的文件一致。没有参考文本的输入不渲染。
+    """
+    jobs = []
+    skipped_inputs = set()
+    for config in scene_configs:
+        scene_name = config["scene_name"]
+        effect_chain = config["effects"]
+        try:
+            get_compiled_chain(effect_chain, None, EFFECT_RESOURCES)
+        except ImportError as e:
+            print(f"❌ 场景 '{scene_name}' 的效果链无法编译: {e}，已跳过。")
+            continue
+        dims = core_dims(effect_chain)
+        if not dims:
+            print(f"\n--- 场景 '{scene_name}' 未指定核心参数，已跳过 (此脚本仅处理带核心参数的场景) ---")
+            continue
+
+        for input_path in input_files:
+            original_filename = os.path.basename(input_path)
+            original_base_name, _ = os.path.splitext(original_filename)
+            if original_base_name not in truth_index:
+                skipped_inputs.add(original_filename)
+                continue
+            for combo in itertools.product(*dims):
+                suffix = combination_suffix(combo)
+                new_filename = f"{original_base_name}_{suffix}.wav"
+                jobs.append({
+                    "input_path": input_path,
+                    "output_path": os.path.join(OUTPUT_DIR, scene_name, original_base_name, new_filename),
+                    "effect_chain": effect_chain,
+                    "combination_params": combination_params(combo),
+                    "seed": derive_seed(scene_name, original_filename, suffix),
+                    "scene": scene_name,
+                    "original_key": original_base_name,
+                    "levels": [(param_name, level_name) for _, param_name, level_name, _ in combo],
+                    "label": f"{scene_name}/{original_base_name}/{new_filename}",
+                })
+    if skipped_inputs:
+        print(f"⚠️ 警告：以下输入没有参考文本，已跳过: {', '.join(sorted(skipped_inputs))}")
+    # 同一输入的任务连续执行，输入缓存只解码一次
+    jobs.sort(key=lambda job: job["input_path"])
+    return jobs
+
+
+def _render(job):
+    seed_everything(job["seed"])
+    chain = get_compiled_chain(job["effect_chain"], job["combination_params"], EFFECT_RESOURCES)
+    return render_audio(job["input_path"], chain)
+
+
+def run_streaming_eval(jobs, backend, truth_index, save_audio=False, eval_records=None):
+    """
+    渲染 → 识别 → 打分 的流式评测。主线程依次渲染各组合，结果经有界队列交给识别线程；
+    识别线程凑满 backend.batch_size 条后一起识别并立即累计错误数，渲染与识别 (模型推理或等待 API) 同时进行。
+    渲染结果先编码为与 batch_process_grid.py 输出相同的 16 位 WAV (超出 [-1, 1] 的样本被截断)，
+    两种识别引擎听到的都是写盘后的音频。音频只在 save_audio=True 时写出。
+
+    参数:
+    eval_records (list, optional): 传入时追加每条识别结果的 eval.jsonl 记录 (与 whisper_batch 的格式相同)。
+
+    返回:
+    WERAggregator: 累计的错误数，missing 为渲染或识别失败的条数。
+    """
+    aggregator = WERAggregator()
+    pending = queue.Queue(maxsize=max(1, QUEUE_BATCHES * backend.batch_size))
+
+    def score(batch):
+        try:
+            texts = backend.transcribe([data for _, data in batch])
+        except Exception as e:
+            print(f"  ❌ 识别失败: {', '.join(job['label'] for job, _ in batch)} -> {e}")
+            texts = [None] * len(batch)
+        by_scene = {}
+        for (job, _), text in zip(batch, texts):
+            response = normalize_text(text) if text is not None else ""
+            if not response:
+                aggregator.missing += 1
+                continue
+            truths, responses, keys = by_scene.setdefault(job["scene"], ([], [], []))
+            truths.append(truth_index[job["original_key"]])
+            responses.append(response)
+            keys.append((job["levels"], None))
+            if eval_records is not None:
+                eval_records.append((job["scene"], {"audio_path": job["output_path"], "response": text,
+                                                    "original_key": job["original_key"]}))
+        for scene, (truths, responses, keys) in by_scene.items():
+            aggregator.add(scene, truths, responses, keys)
+
+    def consume():
+        batch = []
+        while True:
+            item = pending.get()
+            if item is not None:
+                batch.append(item)
+            if batch and (item is None or len(batch) >= backend.batch_size):
+                try:
+                    score(batch)
+                except Exception as e:
+                    # 识别线程不能退出，否则渲染线程会在队列满时永远阻塞
+                    print(f"  ❌ 打分失败: {e}")
+                    aggregator.missing += len(batch)
+                batch = []
+            if item is None:
+                return
+
+    consumer = threading.Thread(target=consume, daemon=True)
+    consumer.start()
+    try:
+        for done, job in enumerate(jobs, 1):
+            rendered = _render(job)
+            if rendered is None:
+                aggregator.missing += 1
+                print(f"  [{done}/{len(jobs)}] ❌ {job['label']}")
+                continue
+            y, sr = rendered
+            data = encode_audio(y, sr)
+            if save_audio:
+                # 同一数组按相同编码写出，文件与 data 逐字节相同
+                write_output_now(job["output_path"], y, sr)
+            pending.put((job, data))
+            print(f"  [{done}/{len(jobs)}] ✅ {job['label']}")
+    finally:
+        pending.put(None)
+        consumer.join()
+    return aggregator
+
+
+def write_eval_files(eval_records):
+    """
+    把识别结果按场景追加到 OUTPUT_DIR/场景/eval.jsonl (可再用 evaluation/run_eval.py 打分)。
+    与 qwen_client.transcribe_to_eval 相同，已有文件 (例如 whisper_batch 或 qwen_batch 写出的) 不会被覆盖，
+    其中已经记录过的 audio_path 不再重复写入。
+    """
+    by_scene = {}
+    for scene, record in eval_records:
+        by_scene.setdefault(scene, []).append(record)
+    for scene, records in by_scene.items():
+        eval_file_path = os.path.join(OUTPUT_DIR, scene, 'eval.jsonl')
+        os.makedirs(os.path.dirname(eval_file_path), exist_ok=True)
+        done_paths = load_done_paths(eval_file_path)
+        new_records = [record for record in records if record["audio_path"] not in done_paths]
+        with open_for_append(eval_file_path) as eval_file:
+            for record in new_records:
+                eval_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        print(f"识别结果已追加至: {eval_file_path} (新增 {len(new_records)} 条，已存在而跳过 {len(records) - len(new_records)} 条)")
+
+
+def main():
+    """
+    用法: python batch_eval_grid.py [场景名 ...] [--engine=whisper|qwen] [--batch-size=N] [--rate=每秒请求数]
+          [--asr-workers=N] [--truth=truth.jsonl] [--summary=summary.json] [--save-audio] [--save-eval]
+          [--cache-mb=N] [--asr-cache=路径] [--asr-cache-mb=N] [--no-asr-cache]
+    """
+    print("--- 开始流式场景评测 (渲染 → 识别 → 打分) ---")
+
+    cache, argv = parse_cache_args(sys.argv[1:])
+    specific_configs_to_run = []
+    engine = "whisper"
+    batch_size = None
+    rate = None
+    asr_workers = None
+    truth_file_path = DEFAULT_TRUTH
+    summary_path = None
+    save_audio = False
+    save_eval = False
+    cache_bytes = DEFAULT_MAX_BYTES
+    for arg in argv:
+        if arg.startswith('--engine='):
+            engine = arg.split('=', 1)[1]
+        elif arg.startswith('--batch-size='):
+            batch_size = max(1, int(arg.split('=', 1)[1]))
+        elif arg.startswith('--rate='):
+            rate = float(arg.split('=', 1)[1])
+        elif arg.startswith('--asr-workers='):
+            asr_workers = max(1, int(arg.split('=', 1)[1]))
+        elif arg.startswith('--truth='):
+            truth_file_path = arg.split('=', 1)[1]
+        elif arg.startswith('--summary='):
+            summary_path = arg.split('=', 1)[1]
+        elif arg == '--save-audio':
+            save_audio = True
+        elif arg == '--save-eval':
+            save_eval = True
+        elif arg.startswith('--cache-mb='):
+            cache_bytes = parse_cache_mb_arg(arg)
+        else:
+            specific_configs_to_run.append(arg)
+    if engine not in ("whisper", "qwen"):
+        print(f"错误：未知的识别引擎 '{engine}'，可选 whisper 或 qwen。")
+        return
+    if save_audio:
+        print(f"命令行指定：渲染结果同时写入 '{OUTPUT_DIR}'。")
+    if save_eval and not save_audio:
+        print("⚠️ 警告：未指定 --save-audio，eval.jsonl 中的 audio_path 只用于标识组合 (解析核心参数档位)，对应的音频文件不会被写出。")
+
+    scene_configs = load_configs(CONFIGS_DIR, specific_configs_to_run or None)
+    if not scene_configs: return
+    input_files = [os.path.join(INPUT_DIR, f) for f in os.listdir(INPUT_DIR) if f.lower().endswith('.wav')]
+    if not input_files:
+        print(f"错误：在 '{INPUT_DIR}' 目录中未找到任何 .wav 文件。")
+        return
+
+    truth_index = load_truth_index(truth_file_path)
+    jobs = build_jobs(scene_configs, input_files, truth_index)
+    if not jobs:
+        print("没有需要评测的组合。")
+        return
+    print(f"\n共 {len(jobs)} 个组合，识别引擎: {engine}。")
+
+    configure_input_cache(cache_bytes)
+    backend = create_backend(engine, batch_size=batch_size, rate=rate, workers=asr_workers, cache=cache)
+    eval_records = [] if save_eval else None
+    try:
+        aggregator = run_streaming_eval(jobs, backend, truth_index, save_audio, eval_records)
+    finally:
+        backend.close()
+        print(cache.summary())
+        cache.close()
+
+    print(f"[INFO] 渲染或识别失败的条数: {aggregator.missing}")
+    summary = aggregator.summary()
+    print_summary(summary)
+    if eval_records:
+        write_eval_files(eval_records)
+    if summary_path:
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"\n汇总结果已保存至: {summary_path}")
+
+    print("\n--- 所有任务完成 ---")
+
+
+if __name__ == "__main__":
+    main()
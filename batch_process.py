@@ -1,45 +1,25 @@
 import os
 import sys
 import importlib
-import librosa
-import soundfile as sf
-import copy
-import random
+
+from pipeline.parallel import derive_seed, seed_everything, parse_workers_arg, run_jobs
+from pipeline.chain import get_compiled_chain
+from pipeline.input_cache import DEFAULT_MAX_BYTES, parse_cache_mb_arg
+from pipeline.manifest import MANIFEST_NAME, Manifest, attach_keys, make_row, pending_jobs, scene_hash
+from pipeline.pipelined import parse_pipelined_arg
+from pipeline.render import configure_worker, process_audio_file, process_audio_file_batch
+from pipeline.sinks import (DEFAULT_ENCODING, configure_output_sink, get_output_sink, output_extension,
+                            parse_encoding_arg, parse_shards_arg)
+from pipeline.streaming import process_audio_file_streaming
 
 # --- 固定目录路径 ---
 INPUT_DIR = "data_input"
 OUTPUT_DIR = "data_output"
 CONFIGS_DIR = "configs"
 NOISES_DIR = "noises"
-EFFECTS_PACKAGE = "effects"
-
 
-def _resolve_random_params(params_dict):
-    """
-    解析参数字典，将定义为范围的参数随机化为具体值。
-    这个函数会直接修改传入的字典。
-    """
-    for key, value in params_dict.items():
-        if isinstance(value, dict) and "random_type" in value:
-            rand_type = value.get("random_type")
-            try:
-                if rand_type == "uniform":
-                    min_val = value["min"]
-                    max_val = value["max"]
-                    params_dict[key] = random.uniform(min_val, max_val)
-                elif rand_type == "randint":
-                    min_val = value["min"]
-                    max_val = value["max"]
-                    params_dict[key] = random.randint(min_val, max_val)
-                elif rand_type == "choice":
-                    options = value["options"]
-                    params_dict[key] = random.choice(options)
-                else:
-                    print(f"  ⚠️ 未知的随机类型 '{rand_type}'，参数 '{key}' 将保持原样。")
-            except KeyError as e:
-                print(f"  ⚠️ 随机参数 '{key}' 缺少必要的键: {e}，将保持原样。")
-            except Exception as e:
-                print(f"  ⚠️ 处理随机参数 '{key}' 时出错: {e}，将保持原样。")
+# 编译效果链时注入的资源参数
+EFFECT_RESOURCES = {"add_noise": {"noise_dir": NOISES_DIR}}
 
 
 def load_configs(config_dir, specific_configs=None):
@@ -88,37 +68,27 @@ def load_configs(config_dir, specific_configs=None):
     return configs
 
 
-def process_audio_file(filepath, output_path, effect_chain):
-    """对单个音频文件应用效果链。"""
-    try:
-        y, sr = librosa.load(filepath, sr=None)
-    except Exception as e:
-        print(f"  ❌ 读取文件 {filepath} 失败: {e}")
-        return
-
-    processed_y = y
-    for effect_config in effect_chain:
-        effect_name = effect_config.get("name")
-        params = copy.deepcopy(effect_config.get("params", {}))
-
-        _resolve_random_params(params)
-
-        try:
-            module_path = f"{EFFECTS_PACKAGE}.{effect_name}"
-            effect_module = importlib.import_module(module_path)
-            process_func = getattr(effect_module, "process")
-
-            if effect_name == "add_noise":
-                params['noise_dir'] = NOISES_DIR
-
-            processed_y = process_func(processed_y, sr, **params)
-
-        except Exception as e:
-            print(f"  ❌ 应用效果 '{effect_name}' 时出错: {e}")
-            return
-
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    sf.write(output_path, processed_y, sr)
+def _render_job(job):
+    """
+    执行单个渲染任务。先用任务自带的种子重置随机状态，保证串行与并行结果一致。
+    成功时返回写入清单的行 (含实际采样的参数)，失败时返回 None。
+    """
+    seed_everything(job["seed"])
+    chain = get_compiled_chain(job["effect_chain"], None, EFFECT_RESOURCES)
+    if "output_paths" in job:
+        row_steps = [chain.sample_steps() for _ in job["output_paths"]]
+        if process_audio_file_batch(job["input_path"], job["output_paths"], chain, row_steps) is None:
+            return None
+        return [make_row(job, path, steps) for path, steps in zip(job["output_paths"], row_steps)]
+
+    steps = chain.sample_steps()
+    if job.get("streaming"):
+        result = process_audio_file_streaming(job["input_path"], job["output_path"], chain, steps=steps)
+    else:
+        result = process_audio_file(job["input_path"], job["output_path"], chain, steps=steps)
+    if result is None:
+        return None
+    return [make_row(job, job["output_path"], steps)]
 
 
 def main():
@@ -128,9 +98,33 @@ def main():
     args = sys.argv[1:]
     specific_configs_to_run = []
     num_variants_cmd = None
+    workers = 1
+    cache_bytes = DEFAULT_MAX_BYTES
+    batched = False
+    streaming = False
+    pipeline = None
+    encoding = DEFAULT_ENCODING
+    shard_bytes = None
+    force = False
 
     for arg in args:
-        if arg.startswith('--num-variants='):
+        if arg == '--batched':
+            batched = True
+        elif arg == '--force':
+            force = True
+        elif arg == '--streaming':
+            streaming = True
+        elif arg == '--pipelined' or arg.startswith('--pipelined='):
+            pipeline = parse_pipelined_arg(arg)
+        elif arg.startswith('--encoding='):
+            encoding = parse_encoding_arg(arg)
+        elif arg == '--shards' or arg.startswith('--shards='):
+            shard_bytes = parse_shards_arg(arg)
+        elif arg.startswith('--workers='):
+            workers = parse_workers_arg(arg)
+        elif arg.startswith('--cache-mb='):
+            cache_bytes = parse_cache_mb_arg(arg)
+        elif arg.startswith('--num-variants='):
             try:
                 num_variants_cmd = int(arg.split('=')[1])
                 if num_variants_cmd < 1:
@@ -151,6 +145,23 @@ def main():
 
     if num_variants_cmd is not None:
         print(f"命令行指定：将为每个输入音频生成 {num_variants_cmd} 个副本。")
+    if workers > 1:
+        print(f"命令行指定：将使用 {workers} 个进程并行渲染。")
+    if pipeline is not None:
+        print(f"命令行指定：将以流水线模式运行，输入预读、效果链与输出写出并发进行 ({pipeline.writers} 个写线程)。")
+    if streaming:
+        print("命令行指定：将以流式分块模式处理输入，内存占用与音频长度无关。")
+        if batched:
+            print("⚠️ 警告：--streaming 模式下逐个副本处理，--batched 将被忽略。")
+            batched = False
+    if batched:
+        print("命令行指定：同一输入的所有副本将作为一个二维数组批量渲染。")
+    if force:
+        print("命令行指定：忽略清单，重新生成全部输出。")
+    if encoding != DEFAULT_ENCODING:
+        print(f"命令行指定：输出编码为 {encoding}。")
+    if shard_bytes is not None:
+        print(f"命令行指定：输出将写入 tar 分片 (每片约 {shard_bytes // (1024 * 1024)} MB)。")
 
     scene_configs = load_configs(CONFIGS_DIR, specific_configs_to_run)
     if not scene_configs:
@@ -164,39 +175,93 @@ def main():
 
     print(f"\n找到 {len(scene_configs)} 个待处理场景和 {len(input_files)} 个输入文件。")
 
+    ext = output_extension(encoding)
+    jobs = []
     for config in scene_configs:
         scene_name = config["scene_name"]
         effect_chain = config["effects"]
 
+        # 在主进程中先编译一次，尽早发现无法导入的效果模块
+        try:
+            get_compiled_chain(effect_chain, None, EFFECT_RESOURCES)
+        except ImportError as e:
+            print(f"❌ 场景 '{scene_name}' 的效果链无法编译: {e}，已跳过。")
+            continue
+
         if num_variants_cmd is not None:
             num_variants = num_variants_cmd
         else:
             num_variants = config.get("num_variants", 1)
 
-        print(f"\n--- 正在处理场景: {scene_name} (每个输入将生成 {num_variants} 个副本) ---")
+        print(f"\n--- 正在准备场景: {scene_name} (每个输入将生成 {num_variants} 个副本) ---")
+        # 渲染模式会影响输出 (批量模式的随机流、流式模式的分块)，因此计入场景哈希
+        mode = "batched" if batched and num_variants > 1 else ("streaming" if streaming else None)
+        scene_digest = scene_hash(effect_chain, None, EFFECT_RESOURCES, mode, encoding)
 
         for input_path in input_files:
             original_filename = os.path.basename(input_path)
             original_base_name, _ = os.path.splitext(original_filename)
-            print(f"处理文件: {original_filename}")
 
             # --- 核心改动：构建以原始文件名命名的子文件夹路径 ---
             variant_output_dir = os.path.join(OUTPUT_DIR, scene_name, original_base_name)
             # ----------------------------------------------------
 
+            output_paths = []
             for i in range(1, num_variants + 1):
                 if num_variants > 1:
-                    new_filename = f"{original_base_name}_variant_{i}.wav"
-                    print(f"  - 生成副本 {i}/{num_variants}...")
+                    new_filename = f"{original_base_name}_variant_{i}{ext}"
                 else:
-                    new_filename = original_filename
+                    new_filename = f"{original_base_name}{ext}"
 
                 # --- 核心改动：使用新的子文件夹路径来构建最终输出路径 ---
-                output_path = os.path.join(variant_output_dir, new_filename)
+                output_paths.append(os.path.join(variant_output_dir, new_filename))
                 # ----------------------------------------------------
 
-                process_audio_file(input_path, output_path, effect_chain)
-                print(f"    ✅ 已保存至: {output_path}")
+            if batched and num_variants > 1:
+                # 批量模式：一个任务渲染该输入的全部副本，种子取决于 (场景, 输入)
+                jobs.append(attach_keys({
+                    "input_path": input_path,
+                    "output_paths": output_paths,
+                    "effect_chain": effect_chain,
+                    "seed": derive_seed(scene_name, original_filename, "batched"),
+                    "label": f"{scene_name}/{original_base_name} ({num_variants} 个副本)",
+                }, output_paths, scene_digest))
+                continue
+
+            for i, output_path in enumerate(output_paths, 1):
+                jobs.append(attach_keys({
+                    "input_path": input_path,
+                    "output_path": output_path,
+                    "effect_chain": effect_chain,
+                    # 每个任务的种子只取决于 (场景, 输入, 副本)，与执行顺序和进程无关
+                    "seed": derive_seed(scene_name, original_filename, i),
+                    "streaming": streaming,
+                    "label": f"{scene_name}/{original_base_name}/{os.path.basename(output_path)}",
+                }, [output_path], scene_digest))
+
+    # 输入、场景和种子都未变化且输出仍存在的任务直接跳过
+    output_config = {"encoding": encoding}
+    if shard_bytes is not None:
+        output_config.update(shard_root=OUTPUT_DIR, shard_bytes=shard_bytes)
+    sink = configure_output_sink(**output_config)
+    manifest = Manifest(os.path.join(OUTPUT_DIR, MANIFEST_NAME), exists=sink.exists)
+    jobs, skipped = pending_jobs(jobs, manifest, force)
+    if skipped:
+        print(f"\n清单中有 {skipped} 个输出未发生变化，已跳过。")
+
+    print(f"\n共 {len(jobs)} 个渲染任务。")
+    # 按输入文件排序，使同一输入的所有任务连续执行，LRU 缓存在预算较小时也不会反复解码。
+    # 种子与执行顺序无关，排序不影响输出。
+    jobs.sort(key=lambda job: job["input_path"])
+    manifest.open()
+    try:
+        succeeded = run_jobs(_render_job, jobs, workers,
+                             initializer=configure_worker, initargs=(cache_bytes, output_config),
+                             on_result=lambda job, rows: manifest.record(rows), pipeline=pipeline)
+    finally:
+        manifest.close()
+        get_output_sink().close()
+    print(f"成功 {succeeded}/{len(jobs)}。")
 
     print("\n--- 所有任务完成 ---")
 
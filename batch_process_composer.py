@@ -3,16 +3,25 @@ import sys
 import importlib
 import copy
 import itertools
-import librosa
-import soundfile as sf
-import random
+
+from pipeline.parallel import derive_seed, seed_everything, parse_workers_arg, run_jobs
+from pipeline.chain import get_compiled_chain
+from pipeline.input_cache import DEFAULT_MAX_BYTES, parse_cache_mb_arg
+from pipeline.manifest import MANIFEST_NAME, Manifest, attach_keys, make_row, pending_jobs, scene_hash
+from pipeline.pipelined import parse_pipelined_arg
+from pipeline.render import configure_worker, process_audio_file
+from pipeline.sinks import (DEFAULT_ENCODING, configure_output_sink, get_output_sink, output_extension,
+                            parse_encoding_arg, parse_shards_arg)
+from pipeline.streaming import process_audio_file_streaming
 
 # --- 固定目录路径 ---
 INPUT_DIR = "data_input"
 OUTPUT_DIR = "data_output_composer"
 CONFIGS_DIR = "configs"
 NOISES_DIR = "noises"
-EFFECTS_PACKAGE = "effects"
+
+# 编译效果链时注入的资源参数
+EFFECT_RESOURCES = {"add_noise": {"noise_dir": NOISES_DIR}}
 
 
 def load_all_configs(config_dir):
@@ -56,56 +65,21 @@ def combine_effect_chains(overlay_effects, base_effects):
     return combined_effects
 
 
-def _resolve_random_params(params_dict):
-    """
-    解析参数字典，将定义为范围的参数随机化为具体值。
-    """
-    for key, value in list(params_dict.items()):
-        if isinstance(value, dict) and "random_type" in value:
-            rand_type = value.get("random_type")
-            try:
-                if rand_type == "uniform":
-                    params_dict[key] = random.uniform(value["min"], value["max"])
-                elif rand_type == "randint":
-                    params_dict[key] = random.randint(value["min"], value["max"])
-                elif rand_type == "choice":
-                    params_dict[key] = random.choice(value["options"])
-            except KeyError as e:
-                print(f"  ⚠️ 随机参数 '{key}' 缺少键: {e}，将保持原样。")
-
-
-def process_audio_file(filepath, output_path, effect_chain):
+def _render_job(job):
     """
-    对单个音频文件应用一个完整的、已合并的效果链。
+    执行单个组合场景渲染任务。先用任务自带的种子重置随机状态，保证串行与并行结果一致。
+    成功时返回写入清单的行，失败时返回 None。
     """
-    try:
-        y, sr = librosa.load(filepath, sr=None)
-    except Exception as e:
-        print(f"  ❌ 读取文件 {filepath} 失败: {e}")
-        return
-
-    processed_y = y
-    for effect_config in effect_chain:
-        effect_name = effect_config.get("name")
-        params = copy.deepcopy(effect_config.get("params", {}))
-
-        _resolve_random_params(params)
-
-        try:
-            module_path = f"{EFFECTS_PACKAGE}.{effect_name}"
-            effect_module = importlib.import_module(module_path)
-            process_func = getattr(effect_module, "process")
-
-            if effect_name == "add_noise":
-                params['noise_dir'] = NOISES_DIR
-
-            processed_y = process_func(processed_y, sr, **params)
-        except Exception as e:
-            print(f"  ❌ 应用效果 '{effect_name}' 时出错: {e}")
-            return
-
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    sf.write(output_path, processed_y, sr)
+    seed_everything(job["seed"])
+    chain = get_compiled_chain(job["effect_chain"], None, EFFECT_RESOURCES)
+    steps = chain.sample_steps()
+    if job.get("streaming"):
+        result = process_audio_file_streaming(job["input_path"], job["output_path"], chain, steps=steps)
+    else:
+        result = process_audio_file(job["input_path"], job["output_path"], chain, steps=steps)
+    if result is None:
+        return None
+    return [make_row(job, job["output_path"], steps)]
 
 
 def main():
@@ -118,10 +92,31 @@ def main():
     num_variants = 1
     target_bases = None
     target_overlays = None
+    workers = 1
+    cache_bytes = DEFAULT_MAX_BYTES
+    streaming = False
+    pipeline = None
+    encoding = DEFAULT_ENCODING
+    shard_bytes = None
+    force = False
     args = sys.argv[1:]
 
     for arg in args:
-        if arg.startswith('--num-variants='):
+        if arg == '--streaming':
+            streaming = True
+        elif arg == '--force':
+            force = True
+        elif arg == '--pipelined' or arg.startswith('--pipelined='):
+            pipeline = parse_pipelined_arg(arg)
+        elif arg.startswith('--encoding='):
+            encoding = parse_encoding_arg(arg)
+        elif arg == '--shards' or arg.startswith('--shards='):
+            shard_bytes = parse_shards_arg(arg)
+        elif arg.startswith('--workers='):
+            workers = parse_workers_arg(arg)
+        elif arg.startswith('--cache-mb='):
+            cache_bytes = parse_cache_mb_arg(arg)
+        elif arg.startswith('--num-variants='):
             try:
                 num_variants = int(arg.split('=')[1])
                 if num_variants < 1: num_variants = 1
@@ -142,6 +137,12 @@ def main():
         print(f"命令行指定：将为每个输入音频在每个组合场景下生成 {num_variants} 个副本。")
     if target_bases: print(f"目标基底场景已指定: {target_bases}")
     if target_overlays: print(f"目标叠加特性已指定: {target_overlays}")
+    if workers > 1: print(f"命令行指定：将使用 {workers} 个进程并行渲染。")
+    if streaming: print("命令行指定：将以流式分块模式处理输入，内存占用与音频长度无关。")
+    if pipeline is not None: print(f"命令行指定：将以流水线模式运行，输入预读、效果链与输出写出并发进行 ({pipeline.writers} 个写线程)。")
+    if force: print("命令行指定：忽略清单，重新生成全部输出。")
+    if encoding != DEFAULT_ENCODING: print(f"命令行指定：输出编码为 {encoding}。")
+    if shard_bytes is not None: print(f"命令行指定：输出将写入 tar 分片 (每片约 {shard_bytes // (1024 * 1024)} MB)。")
 
     # 1. 加载并筛选配置
     all_configs = load_all_configs(CONFIGS_DIR)
@@ -168,7 +169,9 @@ def main():
         print(f"错误：在 '{INPUT_DIR}' 目录中未找到任何 .wav 文件。")
         return
 
-    # 3. 遍历并处理
+    # 3. 遍历并生成渲染任务
+    ext = output_extension(encoding)
+    jobs = []
     for overlay_config, base_config in all_combinations:
         combined_scene_name = f"{base_config['scene_name']}_with_{overlay_config['scene_name']}"
 
@@ -176,27 +179,65 @@ def main():
         combined_effect_chain = combine_effect_chains(overlay_config['effects'], base_config['effects'])
         # ------------------------------------
 
-        print(f"\n--- 正在处理组合场景: {combined_scene_name} ---")
+        # 在主进程中先编译一次，尽早发现无法导入的效果模块
+        try:
+            get_compiled_chain(combined_effect_chain, None, EFFECT_RESOURCES)
+        except ImportError as e:
+            print(f"❌ 场景 '{combined_scene_name}' 的效果链无法编译: {e}，已跳过。")
+            continue
+
+        print(f"\n--- 正在准备组合场景: {combined_scene_name} ---")
         print(f"  合并后的效果链: {[e['name'] for e in combined_effect_chain]}")
+        scene_digest = scene_hash(combined_effect_chain, None, EFFECT_RESOURCES, "streaming" if streaming else None, encoding)
 
         for input_path in input_files:
             original_filename = os.path.basename(input_path)
-            base_name, ext = os.path.splitext(original_filename)
-            print(f"    处理文件: {original_filename}")
+            base_name, _ = os.path.splitext(original_filename)
 
             output_dir_for_audio = os.path.join(OUTPUT_DIR, combined_scene_name, base_name)
 
             for i in range(1, num_variants + 1):
                 if num_variants > 1:
                     new_filename = f"{base_name}_variant_{i}{ext}"
-                    print(f"      - 生成副本 {i}/{num_variants}...")
                 else:
-                    new_filename = original_filename
+                    new_filename = f"{base_name}{ext}"
 
                 output_path = os.path.join(output_dir_for_audio, new_filename)
 
-                process_audio_file(input_path, output_path, combined_effect_chain)
-                print(f"        ✅ 已保存至: {output_path}")
+                jobs.append(attach_keys({
+                    "input_path": input_path,
+                    "output_path": output_path,
+                    "effect_chain": combined_effect_chain,
+                    # 每个任务的种子只取决于 (组合场景, 输入, 副本)，与执行顺序和进程无关
+                    "seed": derive_seed(combined_scene_name, original_filename, i),
+                    "streaming": streaming,
+                    "label": f"{combined_scene_name}/{base_name}/{new_filename}",
+                }, [output_path], scene_digest))
+
+    # 4. 跳过输入、场景和种子都未变化且输出仍存在的任务
+    output_config = {"encoding": encoding}
+    if shard_bytes is not None:
+        output_config.update(shard_root=OUTPUT_DIR, shard_bytes=shard_bytes)
+    sink = configure_output_sink(**output_config)
+    manifest = Manifest(os.path.join(OUTPUT_DIR, MANIFEST_NAME), exists=sink.exists)
+    jobs, skipped = pending_jobs(jobs, manifest, force)
+    if skipped:
+        print(f"\n清单中有 {skipped} 个输出未发生变化，已跳过。")
+
+    # 5. 执行
+    print(f"\n共 {len(jobs)} 个渲染任务。")
+    # 按输入文件排序，使同一输入的所有任务连续执行，LRU 缓存在预算较小时也不会反复解码。
+    # 种子与执行顺序无关，排序不影响输出。
+    jobs.sort(key=lambda job: job["input_path"])
+    manifest.open()
+    try:
+        succeeded = run_jobs(_render_job, jobs, workers,
+                             initializer=configure_worker, initargs=(cache_bytes, output_config),
+                             on_result=lambda job, rows: manifest.record(rows), pipeline=pipeline)
+    finally:
+        manifest.close()
+        get_output_sink().close()
+    print(f"成功 {succeeded}/{len(jobs)}。")
 
     print("\n--- 所有组合场景处理完成 ---")
 
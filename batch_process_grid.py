@@ -1,37 +1,30 @@
 import os
 import sys
 import importlib
-import librosa
-import soundfile as sf
-import copy
-import random
 import itertools
 
+from pipeline.parallel import derive_seed, seed_everything, parse_workers_arg, run_jobs
+from pipeline.chain import get_compiled_chain
+from pipeline.input_cache import DEFAULT_MAX_BYTES, parse_cache_mb_arg
+from pipeline.manifest import MANIFEST_NAME, Manifest, attach_keys, make_row, pending_jobs, scene_hash
+from pipeline.pipelined import parse_pipelined_arg
+from pipeline.prefix_tree import combination_params, combination_suffix, core_dims, render_prefix_tree
+from pipeline.render import configure_worker, parse_speeds_arg, process_audio_file, speed_output_path, speed_steps
+from pipeline.sinks import (DEFAULT_ENCODING, configure_output_sink, get_output_sink, output_extension,
+                            parse_encoding_arg, parse_shards_arg)
+from pipeline.streaming import process_audio_file_streaming
+
 # --- 固定目录路径 (与原脚本一致) ---
 INPUT_DIR = "data_input_grid"
 OUTPUT_DIR = "data_output_grid"
 CONFIGS_DIR = "configs"
 NOISES_DIR = "noises"
-EFFECTS_PACKAGE = "effects"
-
 
-# --- 辅助函数 (与原脚本一致) ---
-def _resolve_random_params(params_dict):
-    """解析非核心的随机参数。"""
-    for key, value in params_dict.items():
-        if isinstance(value, dict) and "random_type" in value:
-            rand_type = value.get("random_type")
-            try:
-                if rand_type == "uniform":
-                    params_dict[key] = random.uniform(value["min"], value["max"])
-                elif rand_type == "randint":
-                    params_dict[key] = random.randint(value["min"], value["max"])
-                elif rand_type == "choice":
-                    params_dict[key] = random.choice(value["options"])
-            except KeyError as e:
-                print(f"  ⚠️ 随机参数 '{key}' 缺少键: {e}，将保持原样。")
+# 编译效果链时注入的资源参数
+EFFECT_RESOURCES = {"add_noise": {"noise_dir": NOISES_DIR}}
 
 
+# --- 辅助函数 (与原脚本一致) ---
 def load_configs(config_dir, specific_configs=None):
     """动态加载配置文件 (与原脚本一致)。"""
     # ... (此处代码与原 batch_process.py 完全相同，为简洁省略)
@@ -68,57 +61,110 @@ def load_configs(config_dir, specific_configs=None):
     return configs
 
 
-def process_audio_file(filepath, output_path, effect_chain, combination_params):
+def _render_job(job):
     """
-    对单个音频文件应用效果链。
-    新增 `combination_params` 参数来注入核心参数的特定组合值。
+    执行单个组合渲染任务。先用任务自带的种子重置随机状态，保证串行与并行结果一致。
+    成功时返回写入清单的行，失败时返回 None。
     """
-    try:
-        y, sr = librosa.load(filepath, sr=None)
-    except Exception as e:
-        print(f"  ❌ 读取文件 {filepath} 失败: {e}")
-        return
-
-    processed_y = y
-    for effect_config in effect_chain:
-        effect_name = effect_config.get("name")
-        params = copy.deepcopy(effect_config.get("params", {}))
-
-        # 1. 注入当前组合的核心参数值
-        if effect_name in combination_params:
-            for param_name, param_value in combination_params[effect_name].items():
-                params[param_name] = param_value
-
-        # 2. 随机化处理非核心的参数
-        _resolve_random_params(params)
+    seed_everything(job["seed"])
+    chain = get_compiled_chain(job["effect_chain"], job["combination_params"], EFFECT_RESOURCES)
+    steps = chain.sample_steps()
+    if job.get("streaming"):
+        result = process_audio_file_streaming(job["input_path"], job["output_path"], chain, steps=steps)
+    else:
+        result = process_audio_file(job["input_path"], job["output_path"], chain, steps=steps, speeds=job["speeds"])
+    if result is None:
+        return None
+    rows = [make_row(job, job["output_path"], steps)]
+    for speed in job["speeds"] or ():
+        rows.append(make_row(job, speed_output_path(job["output_path"], speed), speed_steps(steps, speed)))
+    return rows
 
-        try:
-            module_path = f"{EFFECTS_PACKAGE}.{effect_name}"
-            effect_module = importlib.import_module(module_path)
-            process_func = getattr(effect_module, "process")
 
-            if effect_name == "add_noise":
-                params['noise_dir'] = NOISES_DIR
+def _render_tree_job(job):
+    """以前缀树方式渲染一个输入的全部组合 (见 pipeline.prefix_tree)，返回每个组合的清单行。"""
+    chain = get_compiled_chain(job["effect_chain"], None, EFFECT_RESOURCES)
+    written = render_prefix_tree(job["input_path"], chain, job["dims"],
+                                 lambda suffix: _combination_path(job["output_dir"], job["base_name"], suffix, job["output_ext"]),
+                                 job["seed_parts"], freeze_random=job["freeze_random"], speeds=job["speeds"])
+    if written is None:
+        return None
+    return [make_row(job, path, steps) for path, steps in written]
 
-            processed_y = process_func(processed_y, sr, **params)
-        except Exception as e:
-            print(f"  ❌ 应用效果 '{effect_name}' 时出错: {e}")
-            return
 
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    sf.write(output_path, processed_y, sr)
+def _combination_path(output_dir, base_name, suffix, ext):
+    return os.path.join(output_dir, f"{base_name}_{suffix}{ext}")
 
 
 def main():
     """主函数，执行基于网格搜索的批量处理流程。"""
     print("--- 开始批量制造场景模拟数据 (网格搜索模式) ---")
 
-    specific_configs_to_run = sys.argv[1:] if len(sys.argv) > 1 else None
+    specific_configs_to_run = []
+    workers = 1
+    cache_bytes = DEFAULT_MAX_BYTES
+    streaming = False
+    prefix_tree = False
+    freeze_random = False
+    pipeline = None
+    encoding = DEFAULT_ENCODING
+    shard_bytes = None
+    speeds = None
+    force = False
+    for arg in sys.argv[1:]:
+        if arg == '--streaming':
+            streaming = True
+        elif arg == '--force':
+            force = True
+        elif arg == '--prefix-tree':
+            prefix_tree = True
+        elif arg == '--freeze-random':
+            freeze_random = True
+        elif arg == '--pipelined' or arg.startswith('--pipelined='):
+            pipeline = parse_pipelined_arg(arg)
+        elif arg.startswith('--encoding='):
+            encoding = parse_encoding_arg(arg)
+        elif arg == '--shards' or arg.startswith('--shards='):
+            shard_bytes = parse_shards_arg(arg)
+        elif arg.startswith('--speeds='):
+            speeds = parse_speeds_arg(arg)
+        elif arg.startswith('--workers='):
+            workers = parse_workers_arg(arg)
+        elif arg.startswith('--cache-mb='):
+            cache_bytes = parse_cache_mb_arg(arg)
+        else:
+            specific_configs_to_run.append(arg)
+    if not specific_configs_to_run:
+        specific_configs_to_run = None
 
     if specific_configs_to_run:
         print(f"指定模式：将只运行以下场景 -> {', '.join(specific_configs_to_run)}")
     else:
         print("自动模式：将运行 'configs' 目录下的所有场景。")
+    if workers > 1:
+        print(f"命令行指定：将使用 {workers} 个进程并行渲染。")
+    if freeze_random and not prefix_tree:
+        print("⚠️ 警告：--freeze-random 只在 --prefix-tree 模式下生效，已忽略。")
+        freeze_random = False
+    if prefix_tree:
+        print("命令行指定：组合将按前缀树渲染，共享核心参数前缀的组合只处理一次该前缀。")
+        if freeze_random:
+            print("命令行指定：每个输入的非核心随机参数只采样一次。")
+        if streaming:
+            print("⚠️ 警告：--prefix-tree 需要在内存中保留中间结果，--streaming 将被忽略。")
+            streaming = False
+    if streaming:
+        print("命令行指定：将以流式分块模式处理输入，内存占用与音频长度无关。")
+    if pipeline is not None:
+        print(f"命令行指定：将以流水线模式运行，输入预读、效果链与输出写出并发进行 ({pipeline.writers} 个写线程)。")
+    if force:
+        print("命令行指定：忽略清单，重新生成全部输出。")
+    if encoding != DEFAULT_ENCODING:
+        print(f"命令行指定：输出编码为 {encoding}。")
+    if shard_bytes is not None:
+        print(f"命令行指定：输出将写入 tar 分片 (每片约 {shard_bytes // (1024 * 1024)} MB)。")
+    if speeds:
+        print(f"命令行指定：每个输出额外生成 {', '.join(f'{speed:.2f}x' for speed in speeds)} 倍速版本 (场景配置中的 \"speeds\" 优先)。")
 
     scene_configs = load_configs(CONFIGS_DIR, specific_configs_to_run)
     if not scene_configs: return
@@ -130,69 +176,110 @@ def main():
 
     print(f"\n找到 {len(scene_configs)} 个待处理场景和 {len(input_files)} 个输入文件。")
 
+    ext = output_extension(encoding)
+    jobs = []
     for config in scene_configs:
         scene_name = config["scene_name"]
         effect_chain = config["effects"]
 
+        # 在主进程中先编译一次，尽早发现无法导入的效果模块
+        try:
+            get_compiled_chain(effect_chain, None, EFFECT_RESOURCES)
+        except ImportError as e:
+            print(f"❌ 场景 '{scene_name}' 的效果链无法编译: {e}，已跳过。")
+            continue
+
         # --- 核心逻辑：识别核心参数并生成组合 ---
-        core_params_map = {}
-        for effect in effect_chain:
-            effect_name = effect["name"]
-            for param_name, param_config in effect.get("params", {}).items():
-                if isinstance(param_config, dict) and param_config.get("is_core"):
-                    if effect_name not in core_params_map:
-                        core_params_map[effect_name] = {}
-
-                    min_val, max_val = param_config["min"], param_config["max"]
-                    core_params_map[effect_name][param_name] = {
-                        'low': min_val,
-                        'mid': (min_val + max_val) / 2,
-                        'high': max_val
-                    }
-
-        if not core_params_map:
+        param_names_with_levels = core_dims(effect_chain)
+        if not param_names_with_levels:
             print(f"\n--- 场景 '{scene_name}' 未指定核心参数，已跳过 (此脚本仅处理带核心参数的场景) ---")
             continue
+        num_core_params = len(param_names_with_levels)
 
         # 构建所有可能的组合
-        param_names_with_levels = []
-        for effect_name, params in core_params_map.items():
-            for param_name, levels in params.items():
-                param_names_with_levels.append(
-                    [(effect_name, param_name, level_name, level_value) for level_name, level_value in levels.items()])
-
         all_combinations = list(itertools.product(*param_names_with_levels))
         num_combinations = len(all_combinations)
 
         print(
-            f"\n--- 正在处理场景: {scene_name} (发现 {len(core_params_map)} 个核心参数, 将生成 {num_combinations} 种组合) ---")
+            f"\n--- 正在准备场景: {scene_name} (发现 {num_core_params} 个核心参数, 将生成 {num_combinations} 种组合) ---")
+        # 渲染模式决定了随机参数的采样方式，因此计入场景哈希
+        if prefix_tree:
+            mode = "prefix-tree-frozen" if freeze_random else "prefix-tree"
+        else:
+            mode = "streaming" if streaming else None
+        # 倍速版本：场景配置中的 "speeds" 优先于 --speeds
+        scene_speeds = config.get("speeds", speeds) or None
+        if scene_speeds and streaming:
+            print(f"⚠️ 警告：倍速版本需要完整的内存结果，流式模式下场景 '{scene_name}' 不生成倍速版本。")
+            scene_speeds = None
+        scene_digest = scene_hash(effect_chain, None, EFFECT_RESOURCES, mode, encoding, scene_speeds)
 
         for input_path in input_files:
             original_filename = os.path.basename(input_path)
             original_base_name, _ = os.path.splitext(original_filename)
-            print(f"处理文件: {original_filename}")
 
             variant_output_dir = os.path.join(OUTPUT_DIR, scene_name, original_base_name)
 
-            for i, combo in enumerate(all_combinations):
-                combination_params = {}
-                name_parts = []
-
-                for effect_name, param_name, level_name, level_value in combo:
-                    if effect_name not in combination_params:
-                        combination_params[effect_name] = {}
-                    combination_params[effect_name][param_name] = level_value
-                    # 简化命名，例如 "reverb-room_size-low" -> "room_size-low"
-                    name_parts.append(f"{param_name}-{level_name}")
-
-                combo_name_suffix = "_".join(name_parts)
-                new_filename = f"{original_base_name}_{combo_name_suffix}.wav"
+            if prefix_tree:
+                # 前缀树模式：一个任务渲染该输入的全部组合
+                tree_paths = [_combination_path(variant_output_dir, original_base_name, combination_suffix(combo), ext)
+                              for combo in all_combinations]
+                tree_paths += [speed_output_path(path, speed) for path in tree_paths for speed in scene_speeds or ()]
+                jobs.append(attach_keys({
+                    "input_path": input_path,
+                    "effect_chain": effect_chain,
+                    "dims": param_names_with_levels,
+                    "output_dir": variant_output_dir,
+                    "base_name": original_base_name,
+                    "output_ext": ext,
+                    "seed_parts": (scene_name, original_filename),
+                    "freeze_random": freeze_random,
+                    "speeds": scene_speeds,
+                    "label": f"{scene_name}/{original_base_name} ({num_combinations} 种组合)",
+                }, tree_paths, scene_digest))
+                continue
+
+            for combo in all_combinations:
+                # 简化命名，例如 "reverb-room_size-low" -> "room_size-low"
+                combo_name_suffix = combination_suffix(combo)
+                new_filename = f"{original_base_name}_{combo_name_suffix}{ext}"
                 output_path = os.path.join(variant_output_dir, new_filename)
 
-                print(f"  - 生成组合 {i + 1}/{num_combinations} ({combo_name_suffix})...")
-
-                process_audio_file(input_path, output_path, effect_chain, combination_params)
-                print(f"    ✅ 已保存至: {output_path}")
+                jobs.append(attach_keys({
+                    "input_path": input_path,
+                    "output_path": output_path,
+                    "effect_chain": effect_chain,
+                    "combination_params": combination_params(combo),
+                    # 每个任务的种子只取决于 (场景, 输入, 组合)，与执行顺序和进程无关
+                    "seed": derive_seed(scene_name, original_filename, combo_name_suffix),
+                    "streaming": streaming,
+                    "speeds": scene_speeds,
+                    "label": f"{scene_name}/{original_base_name}/{new_filename}",
+                }, [output_path] + [speed_output_path(output_path, speed) for speed in scene_speeds or ()], scene_digest))
+
+    # 输入、场景和种子都未变化且输出仍存在的任务直接跳过
+    output_config = {"encoding": encoding}
+    if shard_bytes is not None:
+        output_config.update(shard_root=OUTPUT_DIR, shard_bytes=shard_bytes)
+    sink = configure_output_sink(**output_config)
+    manifest = Manifest(os.path.join(OUTPUT_DIR, MANIFEST_NAME), exists=sink.exists)
+    jobs, skipped = pending_jobs(jobs, manifest, force)
+    if skipped:
+        print(f"\n清单中有 {skipped} 个输出未发生变化，已跳过。")
+
+    print(f"\n共 {len(jobs)} 个渲染任务。")
+    # 按输入文件排序，使同一输入的所有任务连续执行，LRU 缓存在预算较小时也不会反复解码。
+    # 种子与执行顺序无关，排序不影响输出。
+    jobs.sort(key=lambda job: job["input_path"])
+    manifest.open()
+    try:
+        succeeded = run_jobs(_render_tree_job if prefix_tree else _render_job, jobs, workers,
+                             initializer=configure_worker, initargs=(cache_bytes, output_config),
+                             on_result=lambda job, rows: manifest.record(rows), pipeline=pipeline)
+    finally:
+        manifest.close()
+        get_output_sink().close()
+    print(f"成功 {succeeded}/{len(jobs)}。")
 
     print("\n--- 所有任务完成 ---")
 
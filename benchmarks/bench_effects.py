@@ -0,0 +1,314 @@
+import io
+import os
+import sys
+import json
+import time
+import contextlib
+import shutil
+import tempfile
+import importlib
+import tracemalloc
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from batch_process_grid import CONFIGS_DIR, load_configs
+from pipeline.parallel import seed_everything
+
+# --- 默认测试矩阵 ---
+DEFAULT_DURATIONS = [1.0, 10.0, 60.0, 600.0]
+DEFAULT_SAMPLE_RATES = [16000, 44100, 48000]
+DEFAULT_REPEATS = 3
+# 不短于该时长 (秒) 的音频只计时一次
+LONG_CLIP_SECONDS = 60.0
+# 相对基线的允许退化比例: 吞吐量低于基线的 (1 - threshold) 或峰值内存高于基线的 (1 + threshold) 视为退化
+DEFAULT_THRESHOLD = 0.2
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# 不是效果的模块 (效果模块以下划线开头的为内部模块，另行排除)
+_NON_EFFECT_MODULES = {"noise_bank"}
+# 合成信号的基本片段长度 (秒)，更长的音频由它重复拼接而成
+_BASE_SECONDS = 10.0
+
+
+def discover_effects(effects_dir=None):
+    """effects/ 下所有提供 process(y, sr, ...) 的效果模块名，按名称排序。"""
+    effects_dir = effects_dir or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "effects")
+    names = []
+    for filename in sorted(os.listdir(effects_dir)):
+        name, ext = os.path.splitext(filename)
+        if ext != ".py" or name.startswith("_") or name in _NON_EFFECT_MODULES:
+            continue
+        if callable(getattr(importlib.import_module(f"effects.{name}"), "process", None)):
+            names.append(name)
+    return names
+
+
+def _representative(value):
+    """把配置中的随机参数取为代表值：uniform / randint 取区间中点，choice 取第一个选项；固定值原样返回。"""
+    if not (isinstance(value, dict) and "random_type" in value):
+        return value
+    rand_type = value.get("random_type")
+    if rand_type == "uniform":
+        return (value["min"] + value["max"]) / 2
+    if rand_type == "randint":
+        return (value["min"] + value["max"]) // 2
+    if rand_type == "choice":
+        return list(value["options"])[0]
+    return value
+
+
+def build_cases(scene_configs, effect_names):
+    """
+    为每个效果生成测试用例 [(效果名, 标签, 参数)]：参数取自 configs/ 中各场景对该效果的配置 (随机参数取代表值)，
+    参数相同的场景合并为一个用例，标签为场景名；没有任何场景使用的效果以默认参数测试，标签为 "default"。
+    """
+    cases = {}
+    for config in scene_configs:
+        for effect in config["effects"]:
+            name = effect.get("name")
+            if name not in effect_names:
+                continue
+            params = {key: _representative(value) for key, value in effect.get("params", {}).items()}
+            key = (name, json.dumps(params, sort_keys=True))
+            if key in cases:
+                cases[key][1].append(config["scene_name"])
+            else:
+                cases[key] = (name, [config["scene_name"]], params)
+
+    result = [(name, "+".join(scenes), params) for name, scenes, params in cases.values()]
+    used = {name for name, _, _ in result}
+    result += [(name, "default", {}) for name in effect_names if name not in used]
+    return sorted(result, key=lambda case: (case[0], case[1]))
+
+
+def synthetic_speech(sr, duration, seed=0):
+    """
+    确定性的合成类语音信号 (float32)：基频在 100~220 Hz 间缓慢变化的谐波，按约 4 Hz 的音节节奏调幅，
+    叠加 -40 dB 的白噪声。长音频由 10 秒的基本片段重复拼接，生成开销与时长基本无关。
+    """
+    rng = np.random.default_rng(seed)
+    n_base = int(round(min(duration, _BASE_SECONDS) * sr))
+    t = np.arange(n_base) / sr
+    f0 = 160.0 + 60.0 * np.sin(2 * np.pi * 0.3 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    base = np.zeros(n_base)
+    for k in range(1, 20):
+        if k * 220.0 >= sr / 2:
+            break
+        base += np.sin(k * phase) / k
+    envelope = 0.5 * (1.0 + np.sin(2 * np.pi * 4.0 * t)) ** 2
+    base = 0.1 * base * envelope + 0.001 * rng.standard_normal(n_base)
+    n = int(round(duration * sr))
+    return np.resize(base.astype(np.float32), n)
+
+
+def make_noise_dir(scene_configs, root):
+    """
+    在 root 下为配置中用到的每个 noise_category 写入两段合成噪音，供 add_noise 离线测试使用 (不依赖 noises/ 素材)。
+    """
+    categories = {effect["params"]["noise_category"]
+                  for config in scene_configs for effect in config["effects"]
+                  if effect.get("name") == "add_noise" and effect.get("params", {}).get("noise_category")}
+    rng = np.random.default_rng(1)
+    sr = 44100
+    for category in sorted(categories):
+        os.makedirs(os.path.join(root, category), exist_ok=True)
+        for k in range(2):
+            # 白噪声累加得到红噪声，再减去滑动平均削弱极低频，频谱大致向高频倾斜下降
+            noise = np.cumsum(rng.standard_normal(int(_BASE_SECONDS * sr)))
+            noise -= np.convolve(noise, np.ones(64) / 64, mode="same")
+            noise = (0.1 * noise / np.max(np.abs(noise))).astype(np.float32)
+            sf.write(os.path.join(root, category, f"synthetic_{k}.wav"), noise, sr)
+    return root
+
+
+def _run(module, y, sr, params):
+    seed_everything(0)
+    # 效果内部的提示信息 (例如 add_noise 选中的噪音文件) 不输出到测试报告中
+    with contextlib.redirect_stdout(io.StringIO()):
+        return module.process(y, sr, **params)
+
+
+def measure(module, y, sr, params, repeats):
+    """
+    对一个效果计时并测量峰值内存。
+
+    返回:
+    dict: {"seconds": 最快一次的耗时, "throughput": 每秒处理的音频秒数, "peak_mb": 处理期间的峰值内存增量 (MB)}。
+    峰值内存由 tracemalloc 统计 Python 与 NumPy 分配的内存 (不含输入信号本身)，不包括 C++ 扩展内部的缓冲区。
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        _run(module, y, sr, params)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        _run(module, y, sr, params)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    seconds = min(timings)
+    return {
+        "seconds": seconds,
+        "throughput": (len(y) / sr) / seconds if seconds > 0 else float("inf"),
+        "peak_mb": (peak - base) / (1024 * 1024),
+    }
+
+
+def case_id(effect_name, label, sr, duration):
+    return f"{effect_name}[{label}]@{sr}Hz/{duration:g}s"
+
+
+def run_benchmarks(cases, sample_rates, durations, repeats=DEFAULT_REPEATS, noise_dir=None):
+    """
+    对每个 (用例, 采样率, 时长) 计时，返回 {用例标识: 测量结果}。出错的组合打印错误并记录 {"error": 信息}。
+    """
+    results = {}
+    for sr in sample_rates:
+        for duration in durations:
+            y = synthetic_speech(sr, duration)
+            n_repeats = 1 if duration >= LONG_CLIP_SECONDS else repeats
+            for effect_name, label, params in cases:
+                module = importlib.import_module(f"effects.{effect_name}")
+                run_params = dict(params)
+                if effect_name == "add_noise" and noise_dir is not None:
+                    run_params.update(noise_dir=noise_dir, noise_cache_dir=os.path.join(noise_dir, ".noise_cache"))
+                key = case_id(effect_name, label, sr, duration)
+                try:
+                    # 预热一次 (滤波器设计、插件与噪音库等缓存)，不计入结果
+                    _run(module, y[:sr], sr, run_params)
+                    results[key] = measure(module, y, sr, run_params, n_repeats)
+                except Exception as e:
+                    print(f"  ❌ {key}: {e}")
+                    results[key] = {"error": str(e)}
+                    continue
+                result = results[key]
+                print(f"  {key:<60} {result['throughput']:>10.1f} x实时  {result['peak_mb']:>8.1f} MB")
+    return results
+
+
+def errors_in(results):
+    """出错用例的说明列表。效果出错总是视为退化，无论基线中是否有该用例。"""
+    return [f"{key}: 出错 ({result['error']})" for key, result in results.items() if "error" in result]
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    与基线比较，返回退化项的说明列表：出错的用例 (见 errors_in)，以及吞吐量或峰值内存超出阈值的用例。
+    基线中没有的用例只检查是否出错。
+    """
+    regressions = errors_in(results)
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if reference is None or "error" in result or "error" in reference:
+            continue
+        if result["throughput"] < reference["throughput"] * (1.0 - threshold):
+            regressions.append(f"{key}: 吞吐量 {result['throughput']:.1f} x实时，基线 {reference['throughput']:.1f}")
+        if result["peak_mb"] > reference["peak_mb"] * (1.0 + threshold) and result["peak_mb"] - reference["peak_mb"] > 1.0:
+            regressions.append(f"{key}: 峰值内存 {result['peak_mb']:.1f} MB，基线 {reference['peak_mb']:.1f} MB")
+    return regressions
+
+
+def _parse_list(arg, cast):
+    return [cast(value) for value in arg.split('=', 1)[1].split(',') if value]
+
+
+def main():
+    """
+    用法: python benchmarks/bench_effects.py [效果名 ...] [--durations=1,10,60,600] [--rates=16000,44100,48000]
+          [--repeats=N] [--quick] [--baseline=baseline.json] [--threshold=0.2] [--save-baseline] [--output=results.json]
+
+    退出码: 有用例出错、与基线相比有退化，或显式指定的 --baseline 文件不存在时为 1，否则为 0。
+    """
+    effect_filter = []
+    durations = DEFAULT_DURATIONS
+    sample_rates = DEFAULT_SAMPLE_RATES
+    repeats = DEFAULT_REPEATS
+    baseline_path = DEFAULT_BASELINE
+    baseline_given = False
+    threshold = DEFAULT_THRESHOLD
+    save_baseline = False
+    output_path = None
+    for arg in sys.argv[1:]:
+        if arg.startswith('--durations='):
+            durations = _parse_list(arg, float)
+        elif arg.startswith('--rates='):
+            sample_rates = _parse_list(arg, int)
+        elif arg.startswith('--repeats='):
+            repeats = max(1, int(arg.split('=', 1)[1]))
+        elif arg == '--quick':
+            durations = [1.0, 10.0]
+        elif arg.startswith('--baseline='):
+            baseline_path = arg.split('=', 1)[1]
+            baseline_given = True
+        elif arg.startswith('--threshold='):
+            threshold = float(arg.split('=', 1)[1])
+        elif arg == '--save-baseline':
+            save_baseline = True
+        elif arg.startswith('--output='):
+            output_path = arg.split('=', 1)[1]
+        else:
+            effect_filter.append(arg)
+
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    scene_configs = load_configs(os.path.join(repo_root, CONFIGS_DIR))
+    effect_names = discover_effects()
+    if effect_filter:
+        effect_names = [name for name in effect_names if name in effect_filter]
+    cases = build_cases(scene_configs, effect_names)
+    print(f"\n共 {len(cases)} 个用例 × {len(sample_rates)} 种采样率 × {len(durations)} 种时长。")
+
+    noise_dir = make_noise_dir(scene_configs, tempfile.mkdtemp(prefix="bench_noises_"))
+    try:
+        results = run_benchmarks(cases, sample_rates, durations, repeats, noise_dir)
+    finally:
+        shutil.rmtree(noise_dir, ignore_errors=True)
+
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"\n测量结果已保存至: {output_path}")
+
+    if save_baseline:
+        # 只更新本次测量到的用例，保留基线中的其他条目
+        baseline = {}
+        if os.path.exists(baseline_path):
+            with open(baseline_path, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        baseline.update({key: result for key, result in results.items() if "error" not in result})
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"\n基线已保存至: {baseline_path}")
+        return _report(errors_in(results), threshold)
+
+    if not os.path.exists(baseline_path):
+        if baseline_given:
+            print(f"\n❌ 找不到指定的基线文件 '{baseline_path}'。")
+            return 1
+        print(f"\n⚠️ 警告：找不到基线文件 '{baseline_path}'，跳过比较。可使用 --save-baseline 生成。")
+        return _report(errors_in(results), threshold)
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    return _report(compare(results, baseline, threshold), threshold)
+
+
+def _report(regressions, threshold):
+    """打印退化项并返回退出码。"""
+    if regressions:
+        print(f"\n❌ 有 {len(regressions)} 项出错或退化 (阈值 {threshold:.0%}):")
+        for line in regressions:
+            print(f"  - {line}")
+        return 1
+    print(f"\n✅ 没有出错或退化的用例 (阈值 {threshold:.0%})。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
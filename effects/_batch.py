@@ -0,0 +1,13 @@
+def row_values(value, n_rows):
+    """
+    把批处理参数展开为每行一个值的列表。
+
+    process_batch 的参数既可以是对所有行相同的标量 (数字、字符串、None、布尔值)，
+    也可以是长度等于行数的列表/元组/数组。
+    """
+    if isinstance(value, (list, tuple)) or (hasattr(value, "shape") and getattr(value, "ndim", 0) > 0):
+        values = list(value)
+        if len(values) != n_rows:
+            raise ValueError(f"批处理参数长度 {len(values)} 与行数 {n_rows} 不一致")
+        return values
+    return [value] * n_rows
@@ -0,0 +1,26 @@
+import numpy as np
+
+# 数据约定 (供 pipeline.fusion 使用):
+#   - 所有效果接收并返回 float32 数组 (process 为一维，process_batch 为 (n_rows, samples) 二维)，
+#     入口处用 as_float32 转换，中间结果也保持 float32，不再悄悄升级为 float64 / complex128。
+#   - 不改变长度的逐样本效果可以接受可选的 out 参数：调用方提供一块与输出同形状的 float32 缓冲区，
+#     效果把结果写入其中并返回它，效果链因此可以在两块预分配的缓冲区之间来回写 (见 apply_effect_chain)。
+#     out 不能与输入重叠；效果也可以不使用 out 而返回新数组，调用方应始终使用返回值。
+
+DTYPE = np.float32
+
+
+def as_float32(y):
+    """返回 y 的 float32 数组；已是 float32 时不复制。"""
+    return np.asarray(y, dtype=DTYPE)
+
+
+def output_buffer(out, like):
+    """
+    返回用于写入结果的 float32 数组：调用方提供了 out 时校验后直接使用，否则新分配一个与 like 同形状的数组。
+    """
+    if out is None:
+        return np.empty(like.shape, dtype=DTYPE)
+    if out.shape != like.shape or out.dtype != DTYPE:
+        raise ValueError(f"out 的形状/类型 {out.shape}/{out.dtype} 与输出 {like.shape}/float32 不一致")
+    return out
@@ -0,0 +1,57 @@
+import numpy as np
+
+from ._stream import StftStream
+
+# 频谱阶段协议 (供 pipeline.fusion 使用):
+#   - 在频谱上工作的效果模块提供 to_spectral(sr, **params)，返回 SpectralTransform；
+#     当前参数无法只用频谱变换表达时 (例如需要与干信号混合) 返回 None，效果链改为调用 process。
+#   - 效果链把相邻且帧参数 (n_fft, hop_length) 相同的频谱效果合并为一个阶段：
+#     音频只做一次 float32 STFT 和一次 ISTFT，各效果的变换依次作用在同一份频谱上。
+
+# 整段处理时每次变换的帧数。长音频按块做 STFT/变换/ISTFT，峰值内存与音频长度无关。
+DEFAULT_CHUNK_FRAMES = 4096
+
+
+class SpectralTransform:
+    """
+    一个频谱变换：fn(D) 接收形状为 (1 + n_fft // 2, n_frames) 的 complex64 频谱并返回同形状的结果，
+    沿时间轴最多使用前后各 context 帧的邻域 (见 StftStream)。
+    """
+
+    __slots__ = ("n_fft", "hop_length", "context", "fn")
+
+    def __init__(self, n_fft, hop_length, context, fn):
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.context = context
+        self.fn = fn
+
+    def compatible(self, other):
+        """两个变换能否共用同一次 STFT。"""
+        return (self.n_fft, self.hop_length) == (other.n_fft, other.hop_length)
+
+    def stream(self):
+        """返回执行本变换的 StftStream (供流式模式使用)。"""
+        return StftStream(self.n_fft, self.hop_length, self.context, self.fn)
+
+
+def apply_spectral(y, transforms, chunk_frames=DEFAULT_CHUNK_FRAMES):
+    """
+    对一段音频执行一个频谱阶段：一次 STFT，依次应用 transforms 中的所有变换，再一次 ISTFT。
+    结果与 librosa.stft / librosa.istft (center=True, hann 窗, length=len(y)) 逐个效果处理一致 (除浮点舍入外)。
+
+    参数:
+    y (np.ndarray): 一维 float32 音频。
+    transforms (list[SpectralTransform]): 帧参数相同的频谱变换，按执行顺序排列。
+    chunk_frames (int): 每块的帧数，超过它的音频按块处理。
+
+    返回:
+    np.ndarray: 处理后的 float32 音频，长度与输入相同。
+    """
+    stream = transforms[0].stream()
+    for transform in transforms[1:]:
+        stream = stream.merged(transform.stream())
+    chunk = max(chunk_frames * stream.hop_length, 1)
+    parts = [stream.process(y[start:start + chunk]) for start in range(0, len(y), chunk)]
+    parts.append(stream.flush())
+    return np.concatenate(parts)
@@ -0,0 +1,196 @@
+import librosa
+import numpy as np
+import scipy.fft
+from numpy.lib.stride_tricks import sliding_window_view
+from pedalboard import Pedalboard
+
+# 流式处理协议 (供 pipeline.streaming 使用):
+#   - 效果模块提供 make_stream(sr, **params)，返回带 process(block) / flush() 方法的流对象。
+#     process 接收下一段非空的一维 float32 音频，返回目前已经可以确定的输出 (长度可以与输入不同，也可以为空)；
+#     flush 在输入结束后返回剩余的输出。
+#   - 依赖整段信号统计量的效果 (响度归一化、按信号 RMS 缩放的噪声) 另外提供 stream_stats(sr, **params)，
+#     返回带 update(block) / result() 方法的累加器，此时 make_stream 的签名为 make_stream(sr, stats, **params)。
+
+EMPTY = np.zeros(0, dtype=np.float32)
+
+
+class PassThroughStream:
+    """原样输出的流，用于被跳过的效果。"""
+
+    def process(self, block):
+        return block
+
+    def flush(self):
+        return EMPTY
+
+
+class GainStream:
+    """对每个块乘以固定增益的流。"""
+
+    def __init__(self, gain):
+        self.gain = gain
+
+    def process(self, block):
+        return block * self.gain
+
+    def flush(self):
+        return EMPTY
+
+
+class PluginStream:
+    """
+    用一个 Pedalboard 逐块处理音频，调用之间不重置插件状态 (reset=False)，
+    因此混响尾音、延迟线和滤波器状态会自然延续到下一块，结果与整段处理一致。
+    插件实例必须是本流独占的新实例，不能与效果链共用缓存的实例 (见 pipeline/fusion.py)。
+    """
+
+    def __init__(self, plugins, sr):
+        self.plugins = list(plugins)
+        self.sr = sr
+        self._board = Pedalboard(self.plugins)
+
+    def merged(self, other):
+        """返回依次执行本流与 other 全部插件的新流，用于合并相邻的 pedalboard 效果。"""
+        return PluginStream(self.plugins + other.plugins, self.sr)
+
+    def process(self, block):
+        if len(block) == 0:
+            return block
+        return self._board(block, self.sr, reset=False)
+
+    def flush(self):
+        return EMPTY
+
+
+class StftStream:
+    """
+    逐块执行 “STFT → 频谱变换 → ISTFT (重叠相加)” 的流，结果与 librosa.stft / librosa.istft
+    (center=True, 零填充, hann 窗) 对整段信号的处理一致。
+
+    transform(D) 接收形状为 (1 + n_fft // 2, n_frames) 的复数频谱块并返回同形状的结果。
+    变换可以沿时间轴使用前后各 context 帧的邻域 (例如高斯模糊)：每块频谱在两侧带上 context 帧上下文，
+    信号首尾按 reflect 方式补帧，因此除浮点舍入外与整段变换相同。内存占用只与块长、n_fft 和 context 有关。
+    """
+
+    def __init__(self, n_fft, hop_length, context, transform):
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.context = context
+        self.transform = transform
+        self.window = librosa.filters.get_window('hann', n_fft, fftbins=True).astype(np.float32)
+        self._samples = np.zeros(n_fft // 2, dtype=np.float32)  # 前端补零，对应 center=True
+        self._frames = np.zeros((1 + n_fft // 2, 0), dtype=np.complex64)
+        self._first_frame = 0          # self._frames 第一列的全局帧号
+        self._next_out = 0             # 下一个待合成的帧号
+        self._ola = np.zeros(n_fft, dtype=np.float32)     # 从 self._next_out * hop 开始的重叠相加缓冲
+        self._wss = np.zeros(n_fft, dtype=np.float32)     # 对应位置的窗函数平方和
+        self._to_skip = n_fft // 2    # 输出中尚未丢弃的前端补零样本数
+        self._n_input = 0
+        self._n_output = 0
+
+    def _extract_frames(self):
+        n_frames = (len(self._samples) - self.n_fft) // self.hop_length + 1
+        if n_frames <= 0:
+            return
+        frames = sliding_window_view(self._samples, self.n_fft)[::self.hop_length][:n_frames]
+        spectrum = scipy.fft.rfft(frames * self.window, axis=-1).T.astype(np.complex64, copy=False)
+        self._frames = np.concatenate([self._frames, spectrum], axis=1)
+        consumed = n_frames * self.hop_length
+        self._samples = self._samples[consumed:].copy()
+
+    def _transform_ready(self, final):
+        """对所有上下文已齐备的帧执行变换并返回变换后的帧；没有可以输出的帧时返回 None。"""
+        n_extracted = self._first_frame + self._frames.shape[1]
+        end = n_extracted if final else n_extracted - self.context
+        start = self._next_out
+        if end <= start:
+            return None
+        c = self.context
+        if final and start == 0:
+            # 整段频谱都还在内存中 (短音频)，直接整体变换
+            out = self.transform(self._frames)
+        else:
+            # 取帧号 [start - c, end + c) 作为变换窗口，越过信号首尾的帧号按 reflect 方式映射回信号内
+            index = np.arange(start - c, end + c)
+            index = np.where(index < 0, -index - 1, index)
+            if final:
+                index = np.where(index >= n_extracted, 2 * n_extracted - index - 1, index)
+            out = self.transform(self._frames[:, index - self._first_frame])[:, c:c + end - start]
+        # 只保留之后的帧仍需要的上下文
+        keep_from = max(end - c, 0)
+        self._frames = self._frames[:, keep_from - self._first_frame:]
+        self._first_frame = keep_from
+        self._next_out = end
+        return out
+
+    def merged(self, other):
+        """
+        返回依次执行本流与 other 两个频谱变换的新流 (共用一次 STFT/ISTFT)；帧参数不同时返回 None。
+        合并后的上下文为两者之和，只能在开始处理之前合并。
+        """
+        if (self.n_fft, self.hop_length) != (other.n_fft, other.hop_length):
+            return None
+        first, second = self.transform, other.transform
+        return StftStream(self.n_fft, self.hop_length, self.context + other.context,
+                          lambda D: second(first(D)))
+
+    def _synthesize(self, spectrum):
+        n_frames = spectrum.shape[1]
+        frames = scipy.fft.irfft(spectrum, n=self.n_fft, axis=0).T * self.window
+        span = (n_frames - 1) * self.hop_length + self.n_fft
+        ola = np.zeros(span, dtype=np.float32)
+        wss = np.zeros(span, dtype=np.float32)
+        ola[:self.n_fft] += self._ola
+        wss[:self.n_fft] += self._wss
+        # 把每帧切成若干段 hop 长的片段，第 j 段在所有帧之间首尾相接，每段一次向量化的重叠相加
+        hop = self.hop_length
+        n_parts = -(-self.n_fft // hop)
+        padded = np.zeros((n_frames, n_parts * hop), dtype=np.float32)
+        padded[:, :self.n_fft] = frames
+        window_sq = np.zeros(n_parts * hop, dtype=np.float32)
+        window_sq[:self.n_fft] = self.window ** 2
+        for j in range(n_parts):
+            stop = min((j + n_frames) * hop, span)
+            ola[j * hop:stop] += padded[:, j * hop:(j + 1) * hop].reshape(-1)[:stop - j * hop]
+            wss[j * hop:stop] += np.tile(window_sq[j * hop:(j + 1) * hop], n_frames)[:stop - j * hop]
+        done = n_frames * self.hop_length
+        self._ola = np.zeros(self.n_fft, dtype=np.float32)
+        self._wss = np.zeros(self.n_fft, dtype=np.float32)
+        self._ola[:span - done] = ola[done:]
+        self._wss[:span - done] = wss[done:]
+        return self._normalize(ola[:done], wss[:done])
+
+    def _normalize(self, ola, wss):
+        """按窗函数平方和归一化 (与 librosa.istft 相同)，并去掉前端补零对应的样本。"""
+        nonzero = wss > np.finfo(np.float32).tiny
+        ola[nonzero] /= wss[nonzero]
+        skip = min(self._to_skip, len(ola))
+        self._to_skip -= skip
+        out = ola[skip:]
+        self._n_output += len(out)
+        return out
+
+    def process(self, block):
+        self._n_input += len(block)
+        self._samples = np.concatenate([self._samples, np.asarray(block, dtype=np.float32)])
+        self._extract_frames()
+        ready = self._transform_ready(final=False)
+        if ready is None:
+            return EMPTY
+        return self._synthesize(ready)
+
+    def flush(self):
+        if self._n_input == 0:
+            return EMPTY
+        # 末端补零，对应 center=True
+        self._samples = np.concatenate([self._samples, np.zeros(self.n_fft // 2, dtype=np.float32)])
+        self._extract_frames()
+        ready = self._transform_ready(final=True)
+        parts = [self._synthesize(ready)] if ready is not None else []
+        # 最后几帧中尚未输出的部分，之后按 librosa.istft(length=...) 的方式截断或补零到输入长度
+        parts.append(self._normalize(self._ola.copy(), self._wss.copy()))
+        tail = np.concatenate(parts)
+        excess = self._n_output - self._n_input
+        if excess > 0:
+            return tail[:len(tail) - excess]
+        return np.concatenate([tail, np.zeros(-excess, dtype=np.float32)])
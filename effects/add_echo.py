@@ -1,5 +1,21 @@
 from pedalboard import Pedalboard, Delay
 
+from ._buffers import as_float32
+from ._stream import PluginStream
+
+
+def to_plugins(sr, delay_seconds=0.2, feedback=0.5, mix=0.5):
+    """
+    返回与 process 等价的 pedalboard 插件列表 (新建的实例)，供效果链把相邻的 pedalboard 效果合并为一个 Pedalboard。
+    参数固定的步骤由效果链缓存复用 (见 pipeline/fusion.py)。
+    """
+    return [Delay(delay_seconds=float(delay_seconds), feedback=float(feedback), mix=float(mix))]
+
+
+def make_stream(sr, delay_seconds=0.2, feedback=0.5, mix=0.5):
+    """返回逐块添加回声的流，延迟线中的内容跨块延续。"""
+    return PluginStream(to_plugins(sr, delay_seconds, feedback, mix), sr)
+
 
 def process(y, sr, delay_seconds=0.2, feedback=0.5, mix=0.5):
     """
@@ -15,7 +31,5 @@ def process(y, sr, delay_seconds=0.2, feedback=0.5, mix=0.5):
     返回:
     np.ndarray: 添加回声后的音频数据。
     """
-    board = Pedalboard([
-        Delay(delay_seconds=delay_seconds, feedback=feedback, mix=mix)
-    ])
-    return board(y, sr)
\ No newline at end of file
+    board = Pedalboard(to_plugins(sr, delay_seconds, feedback, mix))
+    return board(as_float32(y), sr)
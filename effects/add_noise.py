@@ -1,11 +1,97 @@
 import numpy as np
-import librosa
-import soundfile as sf
 import os
 import random
 
+from ._batch import row_values
+from ._buffers import as_float32, output_buffer
+from ._stream import EMPTY, PassThroughStream
+from .noise_bank import get_noise_bank
 
-def process(y, sr, use_white_noise=False, noise_category=None, noise_file=None, noise_db=-20, wet=1.0, **kwargs):
+
+def _resolve_noise(use_white_noise, noise_category, noise_file, noise_dir, bank, verbose=True):
+    """
+    按参数确定噪音来源: 噪音文件路径、"white" (白噪音)，或 None (没有可用噪音，调用方应跳过此效果)。
+    verbose=False 时不打印警告与所选的噪音文件。
+    """
+    if noise_category:
+        category_path = os.path.join(noise_dir, noise_category)
+        # 类别目录只在第一次使用时递归扫描，之后复用内存索引
+        available_noises = bank.list_category(noise_category)
+        if available_noises is None:
+            if verbose:
+                print(f"⚠️ 警告 (add_noise): 找不到噪音类别目录 '{category_path}'，跳过此效果。")
+            return None
+
+        if not available_noises:
+            if verbose:
+                print(f"⚠️ 警告 (add_noise): 类别目录 '{category_path}' 及其子目录中没有找到 .wav 文件，跳过此效果。")
+            return None
+
+        # 从所有找到的文件中随机选择一个
+        noise_path = random.choice(available_noises)
+        # 打印相对路径，更清晰
+        if verbose:
+            relative_noise_path = os.path.relpath(noise_path, noise_dir)
+            print(f"  - 随机选择噪音: {relative_noise_path}")
+        return noise_path
+
+    elif noise_file:
+        return os.path.join(noise_dir, noise_file)
+
+    elif use_white_noise:
+        return "white"
+
+    return None
+
+
+def _load_noise_file(bank, noise_path, sr, verbose=True):
+    """读取 (内存映射的) 预处理噪音及整个文件的 RMS。文件不存在时打印警告 (verbose=True 时) 并返回 None。"""
+    try:
+        # 已混合为单声道、重采样到 sr 的 float32 数据 (内存映射)，以及整个文件的 RMS
+        return bank.load(noise_path, sr)
+    except FileNotFoundError:
+        if verbose:
+            print(f"⚠️ 警告 (add_noise): 找不到噪音文件 {noise_path}，跳过此效果。")
+        return None
+
+
+def _draw_seed():
+    """从全局 np.random 状态中抽取白噪音生成器的种子，主脚本用 np.random.seed 固定种子后结果仍可复现。"""
+    return int(np.random.randint(0, 2 ** 32, dtype=np.int64))
+
+
+def _select_noise(length, sr, use_white_noise, noise_category, noise_file, noise_dir, noise_cache_dir):
+    """
+    选择并准备一段长度为 length 的噪音。
+
+    返回:
+    tuple[np.ndarray, float] | None: (float32 噪音数据, 噪音的 RMS)。无可用噪音时返回 None，调用方应跳过此效果。
+    """
+    bank = get_noise_bank(noise_dir, noise_cache_dir)
+    source = _resolve_noise(use_white_noise, noise_category, noise_file, noise_dir, bank)
+    if source is None:
+        return None
+
+    if source == "white":
+        # 与流式模式使用同一个生成器，直接生成 float32 白噪音
+        noise = _WhiteNoiseSource(_draw_seed()).read(length)
+        return noise, np.sqrt(np.mean(noise ** 2)) + 1e-8
+
+    loaded = _load_noise_file(bank, source, sr)
+    if loaded is None:
+        return None
+    noise, rms_noise_file = loaded
+
+    if len(noise) < length:
+        # 循环平铺后的 RMS 与整个文件的 RMS 基本一致，直接使用预先计算的值
+        return np.resize(noise, length), rms_noise_file + 1e-8
+
+    noise = noise[:length]
+    return noise, np.sqrt(np.mean(noise ** 2)) + 1e-8
+
+
+def process(y, sr, use_white_noise=False, noise_category=None, noise_file=None, noise_db=-20, wet=1.0, out=None,
+            **kwargs):
     """
     给音频添加背景噪声，支持从特定类别中随机选择噪音文件。
 
@@ -18,71 +104,185 @@ def process(y, sr, use_white_noise=False, noise_category=None, noise_file=None,
     noise_file (str, optional): 单个噪音文件的名称。仅在 `noise_category` 未提供时使用。
     noise_db (float): 噪声相对于信号的响度（dB）。
     wet (float): 噪声的混合比例 (0 到 1)。
-    kwargs (dict): 用于接收来自主脚本的额外参数，如此处的 'noise_dir'。
+    out (np.ndarray, optional): 写入结果的 float32 缓冲区 (见 effects/_buffers.py)。
+    kwargs (dict): 用于接收来自主脚本的额外参数，如此处的 'noise_dir'，
+                   以及可选的 'noise_cache_dir' (预处理噪音缓存目录，默认为 noise_dir/.noise_cache)。
+
+    返回:
+    np.ndarray: 添加噪声后的 float32 音频数据。
+    """
+    y = as_float32(y)
+    selected = _select_noise(len(y), sr, use_white_noise, noise_category, noise_file,
+                             kwargs.get("noise_dir", "noises"), kwargs.get("noise_cache_dir"))
+    if selected is None:
+        return y
+    noise, rms_noise_current = selected
+
+    rms_signal = np.sqrt(np.mean(y ** 2)) + 1e-8
+    rms_noise_target = rms_signal * (10 ** (noise_db / 20.0))
+
+    # 缩放、混合与削波都在输出缓冲区中原地完成
+    y_noisy = np.multiply(noise, np.float32(rms_noise_target / rms_noise_current), out=output_buffer(out, y))
+    if wet != 1.0:
+        y_noisy *= np.float32(wet)
+    y_noisy += y
+    return np.clip(y_noisy, -1.0, 1.0, out=y_noisy)
+
+
+def process_batch(ys, sr, use_white_noise=False, noise_category=None, noise_file=None, noise_db=-20, wet=1.0,
+                  **kwargs):
+    """
+    为形状为 (n_rows, samples) 的一组音频 (通常是同一输入的多个副本) 同时添加噪声。
+
+    每一行独立选择噪音文件；除 noise_dir / noise_cache_dir 外，所有参数都可以是标量或长度为 n_rows 的序列。
+    噪声的缩放与混合对整个二维数组一次完成。
 
     返回:
-    np.ndarray: 添加噪声后的音频数据。
+    np.ndarray: 形状与输入相同的 float32 处理结果。
     """
-    noise_path = None
+    ys = as_float32(ys)
+    n_rows, length = ys.shape
     noise_dir = kwargs.get("noise_dir", "noises")
+    noise_cache_dir = kwargs.get("noise_cache_dir")
 
-    if noise_category:
-        category_path = os.path.join(noise_dir, noise_category)
-        if not os.path.isdir(category_path):
-            print(f"⚠️ 警告 (add_noise): 找不到噪音类别目录 '{category_path}'，跳过此效果。")
-            return y
-
-        # --- 关键改动开始 ---
-        # 使用 os.walk() 递归遍历所有子文件夹
-        available_noises = []
-        for dirpath, _, filenames in os.walk(category_path):
-            for filename in filenames:
-                if filename.lower().endswith('.wav'):
-                    # 保存文件的完整相对路径，以便后续拼接
-                    full_path = os.path.join(dirpath, filename)
-                    available_noises.append(full_path)
-        # --- 关键改动结束 ---
+    noises = np.zeros((n_rows, length), dtype=np.float32)
+    rms_noise = np.ones(n_rows)
+    mix_gain = np.zeros(n_rows)
+    skipped = np.zeros(n_rows, dtype=bool)
+    rows = zip(row_values(use_white_noise, n_rows), row_values(noise_category, n_rows),
+               row_values(noise_file, n_rows), row_values(noise_db, n_rows), row_values(wet, n_rows))
+    for i, (row_white, row_category, row_file, row_db, row_wet) in enumerate(rows):
+        selected = _select_noise(length, sr, row_white, row_category, row_file, noise_dir, noise_cache_dir)
+        if selected is None:
+            skipped[i] = True
+            continue
+        noises[i], rms_noise[i] = selected
+        mix_gain[i] = (10 ** (row_db / 20.0)) * row_wet
 
-        if not available_noises:
-            print(f"⚠️ 警告 (add_noise): 类别目录 '{category_path}' 及其子目录中没有找到 .wav 文件，跳过此效果。")
-            return y
+    rms_signal = np.sqrt(np.mean(ys ** 2, axis=1)) + 1e-8
+    scale = (rms_signal * mix_gain / rms_noise).astype(np.float32)
+    y_noisy = np.clip(ys + noises * scale[:, None], -1.0, 1.0)
+    # 没有可用噪音的行与 process 一样原样返回 (不做削波)
+    y_noisy[skipped] = ys[skipped]
+    return y_noisy
 
-        # 从所有找到的文件中随机选择一个
-        noise_path = random.choice(available_noises)
-        # 打印相对路径，更清晰
-        relative_noise_path = os.path.relpath(noise_path, noise_dir)
-        print(f"  - 随机选择噪音: {relative_noise_path}")
 
-    elif noise_file:
-        noise_path = os.path.join(noise_dir, noise_file)
+# 流式模式下计算 RMS 或生成白噪音时每次处理的样本数
+_CHUNK = 1 << 20
 
-    elif use_white_noise:
-        noise = np.random.randn(len(y))
-        noise_path = None
 
-    else:
-        return y
+class _PowerAccumulator:
+    """逐块累计信号的平方和与样本数，用于流式模式下计算整段信号的 RMS。"""
 
-    if noise_path:
-        try:
-            noise, sr_n = sf.read(noise_path)
-        except FileNotFoundError:
-            print(f"⚠️ 警告 (add_noise): 找不到噪音文件 {noise_path}，跳过此效果。")
-            return y
+    def __init__(self):
+        self.sum_squares = 0.0
+        self.n_samples = 0
 
-        if sr_n != sr:
-            noise = librosa.resample(noise.T, orig_sr=sr_n, target_sr=sr).T
-        if noise.ndim > 1:
-            noise = np.mean(noise, axis=1)
-        if len(noise) < len(y):
-            reps = int(np.ceil(len(y) / len(noise)))
-            noise = np.tile(noise, reps)
-        noise = noise[:len(y)]
+    def update(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        self.sum_squares += float(np.dot(block, block))
+        self.n_samples += len(block)
 
-    rms_signal = np.sqrt(np.mean(y ** 2)) + 1e-8
-    rms_noise_target = rms_signal * (10 ** (noise_db / 20.0))
-    rms_noise_current = np.sqrt(np.mean(noise ** 2)) + 1e-8
-    noise_scaled = noise * (rms_noise_target / rms_noise_current)
+    def result(self):
+        return self.sum_squares, self.n_samples
+
+
+class _FileNoiseSource:
+    """从内存映射的噪音中按顺序读取，读到末尾后从头循环 (与 np.resize 的平铺方式一致)。"""
+
+    def __init__(self, noise):
+        self.noise = noise
+        self._pos = 0
+
+    def read(self, n):
+        parts = []
+        while n > 0:
+            part = self.noise[self._pos:self._pos + n]
+            parts.append(part)
+            n -= len(part)
+            self._pos = (self._pos + len(part)) % len(self.noise)
+        return np.concatenate(parts) if len(parts) > 1 else np.array(parts[0])
+
+
+class _WhiteNoiseSource:
+    """按顺序生成白噪音。使用独立的随机数生成器，其他效果的随机抽样不会影响生成的序列。"""
+
+    def __init__(self, seed):
+        self.seed = seed
+        self._rng = np.random.default_rng(seed)
 
-    y_noisy = y + noise_scaled * wet
-    return np.clip(y_noisy, -1.0, 1.0)
\ No newline at end of file
+    def read(self, n):
+        return self._rng.standard_normal(n, dtype=np.float32)
+
+
+class _NoiseStream:
+    """逐块把按比例缩放后的噪音加到信号上。"""
+
+    def __init__(self, source, scale):
+        self.source = source
+        self.scale = scale
+
+    def process(self, block):
+        if len(block) == 0:
+            return block
+        noise = self.source.read(len(block)).astype(np.float32, copy=False)
+        return np.clip(block + noise * self.scale, -1.0, 1.0)
+
+    def flush(self):
+        return EMPTY
+
+
+def _chunked_rms(read, n):
+    """以固定大小的块读取 n 个样本并计算 RMS，内存占用与 n 无关。"""
+    sum_squares = 0.0
+    for start in range(0, n, _CHUNK):
+        chunk = np.asarray(read(min(_CHUNK, n - start)), dtype=np.float64)
+        sum_squares += float(np.dot(chunk, chunk))
+    return np.sqrt(sum_squares / n)
+
+
+def stream_stats(sr, **params):
+    """返回流式模式下测量本效果输入 RMS 与长度的累加器。"""
+    return _PowerAccumulator()
+
+
+def make_stream(sr, signal_power, use_white_noise=False, noise_category=None, noise_file=None, noise_db=-20, wet=1.0,
+                verbose=True, **kwargs):
+    """
+    返回流式模式下的加噪流，结果在统计意义上与 process 一致。
+
+    参数:
+    sr (int): 采样率 (Hz)。
+    signal_power (tuple[float, int]): stream_stats 测得的 (输入平方和, 输入样本数)。
+    verbose (bool): 是否打印警告与所选的噪音文件 (流式处理的测量遍中为 False)。
+    其余参数与 process 相同。
+
+    噪音不再平铺到整段长度：文件噪音从内存映射中循环读取，白噪音由与 process 相同的独立生成器逐块生成。
+    """
+    sum_squares, length = signal_power
+    noise_dir = kwargs.get("noise_dir", "noises")
+    bank = get_noise_bank(noise_dir, kwargs.get("noise_cache_dir"))
+    source = _resolve_noise(use_white_noise, noise_category, noise_file, noise_dir, bank, verbose)
+    if source is None or length == 0:
+        return PassThroughStream()
+
+    if source == "white":
+        seed = _draw_seed()
+        rms_noise_current = _chunked_rms(_WhiteNoiseSource(seed).read, length) + 1e-8
+        noise_source = _WhiteNoiseSource(seed)
+    else:
+        loaded = _load_noise_file(bank, source, sr, verbose)
+        if loaded is None:
+            return PassThroughStream()
+        noise, rms_noise_file = loaded
+        if len(noise) == 0:
+            return PassThroughStream()
+        if len(noise) < length:
+            rms_noise_current = rms_noise_file + 1e-8
+        else:
+            rms_noise_current = _chunked_rms(_FileNoiseSource(noise).read, length) + 1e-8
+        noise_source = _FileNoiseSource(noise)
+
+    rms_signal = np.sqrt(sum_squares / length) + 1e-8
+    rms_noise_target = rms_signal * (10 ** (noise_db / 20.0))
+    return _NoiseStream(noise_source, np.float32(rms_noise_target / rms_noise_current * wet))
@@ -1,5 +1,22 @@
 from pedalboard import Pedalboard, Reverb
 
+from ._buffers import as_float32
+from ._stream import PluginStream
+
+
+def to_plugins(sr, room_size=0.6, damping=0.5, wet_level=0.3, dry_level=0.7):
+    """
+    返回与 process 等价的 pedalboard 插件列表 (新建的实例)，供效果链把相邻的 pedalboard 效果合并为一个 Pedalboard。
+    参数固定的步骤由效果链缓存复用 (见 pipeline/fusion.py)。
+    """
+    return [Reverb(room_size=float(room_size), damping=float(damping),
+                   wet_level=float(wet_level), dry_level=float(dry_level))]
+
+
+def make_stream(sr, room_size=0.6, damping=0.5, wet_level=0.3, dry_level=0.7):
+    """返回逐块添加混响的流，混响尾音跨块延续。"""
+    return PluginStream(to_plugins(sr, room_size, damping, wet_level, dry_level), sr)
+
 
 def process(y, sr, room_size=0.6, damping=0.5, wet_level=0.3, dry_level=0.7):
     """
@@ -16,7 +33,5 @@ def process(y, sr, room_size=0.6, damping=0.5, wet_level=0.3, dry_level=0.7):
     返回:
     np.ndarray: 添加混响后的音频数据。
     """
-    board = Pedalboard([
-        Reverb(room_size=room_size, damping=damping, wet_level=wet_level, dry_level=dry_level)
-    ])
-    return board(y, sr)
\ No newline at end of file
+    board = Pedalboard(to_plugins(sr, room_size, damping, wet_level, dry_level))
+    return board(as_float32(y), sr)
@@ -1,34 +1,134 @@
+from functools import lru_cache
+
 import numpy as np
-import librosa
-from scipy.ndimage import gaussian_filter
-from . import change_volume  # 从同级目录导入
+from scipy.ndimage import correlate1d
+from ._buffers import as_float32, output_buffer
+from ._spectral import SpectralTransform, apply_spectral
+from ._stream import EMPTY
+
+# 高斯核截断在 4 个标准差处，与 scipy.ndimage.gaussian_filter 的默认值相同
+_TRUNCATE = 4.0
+
+
+@lru_cache(maxsize=64)
+def _gaussian_kernel(sigma):
+    """归一化的一维高斯核 (与 gaussian_filter 使用的核相同)；sigma 过小时返回 None 表示不模糊该轴。"""
+    if sigma <= 1e-15:
+        return None
+    radius = int(_TRUNCATE * sigma + 0.5)
+    x = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 / (sigma * sigma) * x ** 2)
+    return kernel / kernel.sum()
+
+
+def _sigmas(sigma):
+    """把 sigma 展开为 (频率轴, 时间轴) 两个标准差，与 gaussian_filter 的参数约定相同。"""
+    freq_sigma, time_sigma = np.broadcast_to(np.asarray(sigma, dtype=float), (2,))
+    return float(freq_sigma), float(time_sigma)
+
+
+def _blur_spectrum(D, sigma, gain=1.0):
+    """
+    对频谱幅度做可分离的高斯模糊 (两个方向各一次一维卷积，高斯核按 sigma 缓存) 并保留原相位。
+
+    相位不单独提取：D * (模糊后幅度 / 原幅度) 与 模糊后幅度 * exp(1j * 原相位) 相同，全程为单精度。
+    gain 是对模糊结果的线性增益。
+    """
+    magnitude = np.abs(D)
+    blurred = magnitude
+    for axis, axis_sigma in enumerate(_sigmas(sigma)):
+        kernel = _gaussian_kernel(axis_sigma)
+        if kernel is not None:
+            blurred = correlate1d(blurred, kernel, axis=axis, mode='reflect')
+    nonzero = magnitude > 0
+    scale = np.divide(blurred, magnitude, out=np.zeros_like(magnitude), where=nonzero)
+    if gain != 1.0:
+        scale *= np.float32(gain)
+    result = D * scale
+    # 幅度为零的频点相位为 0 (np.angle(0) == 0)，直接取模糊后的幅度
+    silent = ~nonzero
+    if silent.any():
+        result[silent] = blurred[silent] * np.float32(gain)
+    return result
+
 
+def _transform(sigma, n_fft, hop_length, db):
+    # 时间轴上高斯核的半径 (帧)，即分块处理时每块两侧需要的上下文
+    kernel = _gaussian_kernel(_sigmas(sigma)[1])
+    context = 0 if kernel is None else len(kernel) // 2
+    gain = 10.0 ** (db / 20.0)
+    return SpectralTransform(n_fft, hop_length, context, lambda D: _blur_spectrum(D, sigma, gain))
 
-def process(y, sr, sigma=1.5, wet=1.0, n_fft=1024, hop_length=512, db=0):
+
+def to_spectral(sr, sigma=1.5, wet=1.0, n_fft=1024, hop_length=512, db=0):
+    """
+    返回本效果的频谱变换，供效果链与相邻的频谱效果共用一次 STFT/ISTFT (见 effects/_spectral.py)。
+    wet != 1 时需要与干信号混合，返回 None。
+    """
+    if wet != 1.0:
+        return None
+    return _transform(sigma, n_fft, hop_length, db)
+
+
+def process(y, sr, sigma=1.5, wet=1.0, n_fft=1024, hop_length=512, db=0, out=None):
     """
     在音频的频谱图上应用高斯模糊，产生平滑的模糊感。
 
     参数:
     y (np.ndarray): 输入的音频数据 NumPy 数组。
     sr (int): 音频的采样率 (Hz)。
-    sigma (float): 高斯模糊的标准差。值越大，声音越模糊。
+    sigma (float | tuple[float, float]): 高斯模糊的标准差 (可以分别指定频率轴和时间轴)。值越大，声音越模糊。
     wet (float): 干/湿混合比例 (0 到 1)。
     n_fft (int): STFT的窗口大小。
     hop_length (int): STFT的帧移。
     db (float): 对模糊后的声音进行音量调整（分贝）。
+    out (np.ndarray, optional): wet != 1 时写入混合结果的 float32 缓冲区 (见 effects/_buffers.py)。
 
     返回:
-    np.ndarray: 处理后的音频数据。
+    np.ndarray: 处理后的 float32 音频数据。
     """
-    D = librosa.stft(y, n_fft=n_fft, hop_length=hop_length)
-    magnitude, phase = np.abs(D), np.angle(D)
+    y = as_float32(y)
+    # 单精度 STFT，长音频按块处理
+    y_blur = apply_spectral(y, [_transform(sigma, n_fft, hop_length, db)])
+
+    if wet == 1.0:
+        return y_blur
+    y_blur *= wet
+    mixed = np.multiply(y, 1 - wet, out=output_buffer(out, y))
+    mixed += y_blur
+    return mixed
 
-    blurred_magnitude = gaussian_filter(magnitude, sigma=sigma)
 
-    D_blurred = blurred_magnitude * np.exp(1j * phase)
-    y_blur = librosa.istft(D_blurred, hop_length=hop_length, length=len(y))
+class _BlurStream:
+    """逐块模糊的流：频谱模糊由 StftStream 完成，干信号按其延迟排队后再与湿信号混合。"""
 
-    if db != 0:
-        y_blur = change_volume.process(y_blur, sr, db=db)
+    def __init__(self, stft_stream, wet):
+        self.stft_stream = stft_stream
+        self.wet = wet
+        self._dry = EMPTY
 
-    return (1 - wet) * y + wet * y_blur
\ No newline at end of file
+    def _mix(self, y_blur):
+        if self.wet == 1.0 or len(y_blur) == 0:
+            return y_blur
+        dry, self._dry = self._dry[:len(y_blur)], self._dry[len(y_blur):]
+        return (1 - self.wet) * dry + self.wet * y_blur
+
+    def process(self, block):
+        if self.wet != 1.0:
+            self._dry = np.concatenate([self._dry, block])
+        return self._mix(self.stft_stream.process(block))
+
+    def flush(self):
+        return self._mix(self.stft_stream.flush())
+
+
+def make_stream(sr, sigma=1.5, wet=1.0, n_fft=1024, hop_length=512, db=0):
+    """
+    返回逐块模糊的流，参数与 process 相同。
+    高斯核沿时间轴的半径为 int(4 * sigma + 0.5) 帧 (scipy 的默认截断)，每块频谱两侧带上这么多帧的上下文，
+    因此结果与整段处理一致。wet == 1 时直接返回 StftStream，可与相邻的频谱效果合并。
+    """
+    stft_stream = _transform(sigma, n_fft, hop_length, db).stream()
+    if wet == 1.0:
+        return stft_stream
+    return _BlurStream(stft_stream, wet)
@@ -1,7 +1,102 @@
 import numpy as np
 
+from ._buffers import as_float32
+from ._stream import EMPTY
 
-def process(y, sr, frame_ms=15, stutter_prob=0.05, repeat_prob=0.75, max_repeats=3):
+# 来源索引中表示“上一段音频的最后一个正常帧”的标记 (流式处理时使用)，-1 仍表示静音
+CARRIED_FRAME = -2
+
+def _make_rng(seed):
+    """
+    创建本次处理使用的随机数生成器。
+    未指定 seed 时从全局 np.random 状态中抽取一个种子，因此主脚本用 np.random.seed 固定种子后结果仍可复现。
+    """
+    if seed is None:
+        seed = np.random.randint(0, 2 ** 32, dtype=np.int64)
+    return np.random.default_rng(seed)
+
+
+def _plan_frames(n_frames, rng, stutter_prob, repeat_prob, max_repeats, start=0, last_src=-1):
+    """
+    一次性抽取所有帧的卡顿、重复和丢弃决策，生成每一帧的来源帧索引。
+
+    逐帧扫描的原始逻辑等价于一个随机游走：在每个被访问到的帧上，以 stutter_prob 的概率触发
+    一次卡顿事件并向前跳过 1~max_repeats 帧，否则正常前进 1 帧。这里先为最多 n_frames 步同时抽取
+    步长，再用 cumsum 得到所有被访问的位置，因此不需要 Python 循环。
+
+    参数:
+    n_frames (int): 帧数。
+    rng (np.random.Generator): 随机数生成器。
+    start (int): 第一个被访问的帧 (此前的帧已被上一段的卡顿事件覆盖)。
+    last_src (int): 进入本段时“上一正常帧”的索引，-1 表示静音，CARRIED_FRAME 表示上一段的最后一个正常帧。
+
+    返回:
+    tuple[np.ndarray, int, int]:
+        - np.ndarray: 长度为 n_frames 的 int64 数组。第 j 帧的输出取自第 src[j] 帧，-1 表示静音。
+        - int: 最后一个卡顿事件超出末尾的帧数。
+        - int: 离开本段时“上一正常帧”的索引 (含义同 last_src)。
+    """
+    src = np.arange(n_frames, dtype=np.int64)
+    n_steps = n_frames - start
+    if n_steps <= 0:
+        return src, 0, last_src
+
+    triggered = rng.random(n_steps) < stutter_prob
+    counts = rng.integers(1, max_repeats + 1, size=n_steps)
+    steps = np.where(triggered, counts, 1)
+
+    positions = np.empty(n_steps, dtype=np.int64)
+    positions[0] = start
+    np.cumsum(steps[:-1], out=positions[1:])
+    positions[1:] += start
+    visited = positions < n_frames
+    positions, triggered, counts = positions[visited], triggered[visited], counts[visited]
+
+    # 每个被访问位置之前最近的一个正常帧 (卡顿事件期间 last_frame 不更新)
+    normal_positions = np.where(triggered, np.iinfo(np.int64).min, positions)
+    last_normal = np.maximum.accumulate(np.concatenate(([last_src], normal_positions)))
+    last_normal, final_normal = last_normal[:-1], int(last_normal[-1])
+
+    ev_pos = positions[triggered]
+    ev_cnt = counts[triggered]
+    ev_last = last_normal[triggered]
+    if len(ev_pos) == 0:
+        return src, 0, final_normal
+
+    # 展开每个事件覆盖的帧: ev_pos[k], ev_pos[k] + 1, ..., ev_pos[k] + ev_cnt[k] - 1
+    total = int(ev_cnt.sum())
+    offsets = np.arange(total) - np.repeat(np.cumsum(ev_cnt) - ev_cnt, ev_cnt)
+    frames = np.repeat(ev_pos, ev_cnt) + offsets
+    sources = np.repeat(ev_last, ev_cnt)
+
+    overflow = int(max(frames[-1] + 1 - n_frames, 0))
+    inside = frames < n_frames
+    frames, sources = frames[inside], sources[inside]
+
+    # 每个被替换的帧独立决定是重复上一帧还是替换为静音
+    repeat = rng.random(len(frames)) < repeat_prob
+    src[frames] = np.where(repeat, sources, -1)
+    return src, overflow, final_normal
+
+
+def _frame_view(y, frame_length):
+    """把 (..., samples) 数组补零到整帧并重塑为 (..., n_frames, frame_length)。"""
+    n_frames = -(-y.shape[-1] // frame_length)
+    pad = n_frames * frame_length - y.shape[-1]
+    if pad:
+        pad_width = [(0, 0)] * (y.ndim - 1) + [(0, pad)]
+        y = np.pad(y, pad_width, 'constant')
+    return y.reshape(y.shape[:-1] + (n_frames, frame_length)), n_frames
+
+
+def _render(frames, src):
+    """按来源索引进行一次 gather，并把静音帧置零。"""
+    out = frames[np.maximum(src, 0)]
+    out[src < 0] = 0
+    return out
+
+
+def process(y, sr, frame_ms=15, stutter_prob=0.05, repeat_prob=0.75, max_repeats=3, seed=None):
     """
     通过随机“替换”音频帧来模拟卡顿效果，保持音频总长度不变。
 
@@ -12,6 +107,7 @@ def process(y, sr, frame_ms=15, stutter_prob=0.05, repeat_prob=0.75, max_repeats
     stutter_prob (float): 任何一帧触发卡顿事件的概率 (0 到 1)。
     repeat_prob (float): 触发卡顿后，是“重复”上一帧（卡顿）还是“丢弃”当前帧（静音）的概率。
     max_repeats (int): 一次卡顿事件中，最多连续替换多少帧。
+    seed (int, optional): 随机种子。未指定时从全局 np.random 状态派生。
 
     返回:
     np.ndarray: 处理后的音频数据，长度与输入相同。
@@ -20,47 +116,114 @@ def process(y, sr, frame_ms=15, stutter_prob=0.05, repeat_prob=0.75, max_repeats
     if frame_length == 0:
         raise ValueError("frame_ms is too small, resulting in a frame_length of 0.")
 
-    # 创建一个输入的副本，我们将直接在它上面进行修改
-    y_processed = np.copy(y)
-
-    pos = 0
-    last_frame = np.zeros(frame_length, dtype=y.dtype)
-
-    while pos < len(y):
-        # 确定当前帧的边界
-        end = min(pos + frame_length, len(y))
-        current_frame = y[pos:end]
-
-        # 随机决定是否触发卡顿
-        if np.random.rand() < stutter_prob:
-            repeat_count = np.random.randint(1, max_repeats + 1)
-
-            for i in range(repeat_count):
-                # 计算将要被替换的帧的位置
-                replace_pos = pos + (i * frame_length)
-                replace_end = min(replace_pos + frame_length, len(y))
-
-                if replace_pos >= len(y):
-                    break  # 如果替换位置超出音频末尾，则停止
-
-                # 随机决定是重复上一帧还是用静音替换
-                if np.random.rand() < repeat_prob:
-                    # 用上一帧的内容替换掉当前位置的帧
-                    write_len = min(frame_length, replace_end - replace_pos)
-                    y_processed[replace_pos:replace_end] = last_frame[:write_len]
-                else:
-                    # 用静音替换掉当前位置的帧
-                    y_processed[replace_pos:replace_end] = 0
-
-            # 重要：指针需要跳过所有被替换的帧
-            pos += repeat_count * frame_length
-        else:
-            # 正常情况，更新 last_frame 并移动指针
-            if len(current_frame) < frame_length:
-                last_frame = np.pad(current_frame, (0, frame_length - len(current_frame)), 'constant')
-            else:
-                last_frame = current_frame
-
-            pos += frame_length
-
-    return y_processed
\ No newline at end of file
+    rng = _make_rng(seed)
+    frames, n_frames = _frame_view(as_float32(y), frame_length)
+    src, _, _ = _plan_frames(n_frames, rng, stutter_prob, repeat_prob, max_repeats)
+    return _render(frames, src).reshape(-1)[:len(y)]
+
+
+def process_batch(ys, sr, frame_ms=15, stutter_prob=0.05, repeat_prob=0.75, max_repeats=3, seed=None):
+    """
+    一次调用为多段音频 (或同一音频的多个副本) 添加卡顿效果。
+
+    参数:
+    ys (np.ndarray | list[np.ndarray]): 形状为 (n_clips, samples) 的二维数组，或长度不一的一维数组列表。
+    sr (int): 音频的采样率 (Hz)。
+    frame_ms, stutter_prob, repeat_prob, max_repeats: 与 process 相同。
+                 除 frame_ms 外均可传入与片段数等长的序列，为每段音频指定不同的参数。
+    seed (int, optional): 随机种子。每段音频使用由它派生出的独立随机流。
+
+    返回:
+    np.ndarray | list[np.ndarray]: 与输入形式相同的处理结果。
+    """
+    frame_length = int(sr * frame_ms / 1000)
+    if frame_length == 0:
+        raise ValueError("frame_ms is too small, resulting in a frame_length of 0.")
+
+    n_clips = len(ys)
+    if seed is None:
+        seed = np.random.randint(0, 2 ** 32, dtype=np.int64)
+    rngs = [np.random.default_rng(s) for s in np.random.SeedSequence(int(seed)).spawn(n_clips)]
+    stutter_probs = np.broadcast_to(stutter_prob, n_clips)
+    repeat_probs = np.broadcast_to(repeat_prob, n_clips)
+    max_repeats_list = np.broadcast_to(max_repeats, n_clips)
+
+    if isinstance(ys, np.ndarray) and ys.ndim == 2:
+        # 等长片段: 把所有片段的来源索引拼成一个全局索引，只做一次 gather
+        frames, n_frames = _frame_view(as_float32(ys), frame_length)
+        src = np.empty((n_clips, n_frames), dtype=np.int64)
+        for i in range(n_clips):
+            row_src, _, _ = _plan_frames(n_frames, rngs[i], stutter_probs[i], repeat_probs[i], int(max_repeats_list[i]))
+            src[i] = np.where(row_src < 0, -1, row_src + i * n_frames)
+        out = _render(frames.reshape(-1, frame_length), src.reshape(-1))
+        return out.reshape(n_clips, -1)[:, :ys.shape[-1]]
+
+    results = []
+    for i, y in enumerate(ys):
+        frames, n_frames = _frame_view(as_float32(y), frame_length)
+        src, _, _ = _plan_frames(n_frames, rngs[i], stutter_probs[i], repeat_probs[i], int(max_repeats_list[i]))
+        results.append(_render(frames, src).reshape(-1)[:len(y)])
+    return results
+
+
+class _StutterStream:
+    """
+    逐块添加卡顿效果的流。输入按整帧切分，不足一帧的样本留到下一块；
+    跨越块边界的卡顿事件、“上一正常帧”的内容都会带入下一块，因此与整段处理的统计特性一致。
+    """
+
+    def __init__(self, frame_length, rng, stutter_prob, repeat_prob, max_repeats):
+        self.frame_length = frame_length
+        self.rng = rng
+        self.stutter_prob = stutter_prob
+        self.repeat_prob = repeat_prob
+        self.max_repeats = max_repeats
+        self._buffer = EMPTY
+        self._pending = 0          # 上一块最后一个卡顿事件尚未覆盖的帧数
+        self._last_src = -1        # 上一正常帧: -1 表示静音，CARRIED_FRAME 表示 self._carried
+        self._carried = None
+
+    def _emit(self, frames):
+        n_frames = len(frames)
+        skip = min(self._pending, n_frames)
+        src, overflow, last_src = _plan_frames(n_frames, self.rng, self.stutter_prob, self.repeat_prob,
+                                               self.max_repeats, start=skip, last_src=self._last_src)
+        if skip:
+            # 上一块延续过来的事件帧，来源是事件发生时的上一正常帧
+            repeat = self.rng.random(skip) < self.repeat_prob
+            src[:skip] = np.where(repeat, self._last_src, -1)
+        self._pending = overflow if skip < n_frames else self._pending - n_frames
+
+        out = _render(frames, src)
+        if self._carried is not None:
+            out[src == CARRIED_FRAME] = self._carried
+        if last_src >= 0:
+            self._carried = frames[last_src].copy()
+            last_src = CARRIED_FRAME
+        self._last_src = last_src
+        return out.reshape(-1)
+
+    def process(self, block):
+        buffer = np.concatenate([self._buffer, block]) if len(self._buffer) else np.asarray(block)
+        n_frames = len(buffer) // self.frame_length
+        self._buffer = buffer[n_frames * self.frame_length:].copy()
+        if n_frames == 0:
+            return EMPTY
+        return self._emit(buffer[:n_frames * self.frame_length].reshape(n_frames, self.frame_length))
+
+    def flush(self):
+        # 末尾不足一帧的样本与 process 一样补零成一帧处理，再截回原长度
+        remainder = len(self._buffer)
+        if remainder == 0:
+            return EMPTY
+        frames, _ = _frame_view(self._buffer, self.frame_length)
+        self._buffer = EMPTY
+        return self._emit(frames)[:remainder]
+
+
+def make_stream(sr, frame_ms=15, stutter_prob=0.05, repeat_prob=0.75, max_repeats=3, seed=None):
+    """返回逐块添加卡顿效果的流，参数与 process 相同。"""
+    frame_length = int(sr * frame_ms / 1000)
+    if frame_length == 0:
+        raise ValueError("frame_ms is too small, resulting in a frame_length of 0.")
+    return _StutterStream(frame_length, _make_rng(seed), stutter_prob, repeat_prob, max_repeats)
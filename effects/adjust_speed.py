@@ -1,13 +1,100 @@
 import os
 import random
+from concurrent.futures import ThreadPoolExecutor
+
 import librosa
-import soundfile as sf
 import numpy as np
 
+from ._buffers import as_float32
+
+# 与 librosa.effects.time_stretch 的默认 STFT 参数相同
+_N_FFT = 2048
+# 相位声码器每次合成的输出帧数。长音频分块合成，中间结果的内存占用与音频长度无关。
+_CHUNK_FRAMES = 2048
+
+
+class _Analysis:
+    """一段音频的 STFT 幅度与相位 (末尾补两列零，与 librosa.phase_vocoder 的边界处理相同)，供所有速率共用。"""
+
+    def __init__(self, y, n_fft, hop_length):
+        D = librosa.stft(y, n_fft=n_fft, hop_length=hop_length)
+        self.n_frames = D.shape[-1]
+        self.magnitude = np.pad(np.abs(D), [(0, 0), (0, 2)])
+        self.phase = np.pad(np.angle(D), [(0, 0), (0, 2)])
+
+
+def _phase_vocoder(analysis, rate):
+    """
+    与 librosa.phase_vocoder 相同的相位声码器，但按块向量化：每块输出帧的插值幅度与相位增量一次算出，
+    相位累加用 float64 的 cumsum 完成，块之间只传递累加到的相位。
+
+    librosa 每帧累加的 phi_advance + wrap(dphase - phi_advance) 与相邻两帧的相位差 dphase 只差 2π 的整数倍，
+    因此这里直接累加 dphase 并按 2π 取模。float32 的 librosa 实现逐帧以单精度累加，长音频中相位误差会逐渐增大；
+    这里的结果与以 float64 运行 librosa.phase_vocoder 的结果一致。
+
+    返回:
+    np.ndarray: 拉伸后的 complex64 频谱。
+    """
+    steps = np.arange(0, analysis.n_frames, rate, dtype=np.float64)
+    magnitude, phase = analysis.magnitude, analysis.phase
+    stretched = np.empty((magnitude.shape[0], len(steps)), dtype=np.complex64)
+    phase_acc = phase[:, 0].astype(np.float64)
+    for start in range(0, len(steps), _CHUNK_FRAMES):
+        chunk = steps[start:start + _CHUNK_FRAMES]
+        index = chunk.astype(np.int64)
+        alpha = (chunk - index).astype(np.float32)
+        mag = magnitude[:, index] * (1.0 - alpha) + magnitude[:, index + 1] * alpha
+        dphase = phase[:, index + 1] - phase[:, index]
+        # 第 t 帧的相位 = 初始相位 + 之前各帧相位差之和
+        angles = np.cumsum(dphase, axis=1, dtype=np.float64)
+        angles -= dphase
+        angles += phase_acc[:, None]
+        phase_acc = np.mod(angles[:, -1] + dphase[:, -1], 2.0 * np.pi)
+        angles = np.mod(angles, 2.0 * np.pi).astype(np.float32)
+        out = stretched[:, start:start + len(chunk)]
+        out.real = mag * np.cos(angles)
+        out.imag = mag * np.sin(angles)
+    return stretched
+
+
+def time_stretch_multi(y, rates, n_fft=_N_FFT, hop_length=None, max_workers=None):
+    """
+    一次分析、多次合成的时间拉伸：对同一段音频只计算一次 STFT，然后为每个速率分别做相位声码与 ISTFT。
+    每个速率的结果与 librosa.effects.time_stretch(y, rate=rate) 相同 (除相位累加的浮点精度外)。
+
+    参数:
+    y (np.ndarray): 输入的一维音频数据。
+    rates (list[float]): 速度倍率列表，大于 1 加快，小于 1 减慢。
+    n_fft (int): STFT 的窗口大小。
+    hop_length (int, optional): STFT 的帧移，默认为 n_fft // 4。
+    max_workers (int, optional): 同时合成的速率数。各速率在线程中合成 (numpy / FFT 运算会释放 GIL)，默认取速率数与 CPU 核数中较小者。
+
+    返回:
+    list[np.ndarray]: 与 rates 一一对应的 float32 音频，长度为 round(len(y) / rate)。
+    """
+    for rate in rates:
+        if rate <= 0:
+            raise ValueError(f"速度倍率必须为正数，收到 {rate}")
+    y = as_float32(y)
+    hop_length = hop_length or n_fft // 4
+    analysis = _Analysis(y, n_fft, hop_length)
+
+    def synthesize(rate):
+        stretched = _phase_vocoder(analysis, rate)
+        return librosa.istft(stretched, hop_length=hop_length, n_fft=n_fft, dtype=np.float32,
+                             length=int(round(len(y) / rate)))
+
+    if len(rates) <= 1:
+        return [synthesize(rate) for rate in rates]
+    workers = min(max_workers or len(rates), len(rates), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(synthesize, rates))
+
+
 def process(y, sr, speed_min=0.5, speed_max=2.0):
     """
     以随机速率改变音频的播放速度。
-    采用 librosa 的 time-stretch 实现，不会改变音高。
+    采用相位声码器实现的 time-stretch (见 time_stretch_multi)，不会改变音高。
 
     参数:
     y (np.ndarray): 输入的音频数据 NumPy 数组。
@@ -16,11 +103,7 @@ def process(y, sr, speed_min=0.5, speed_max=2.0):
     speed_max (float): 随机速度的上限。
 
     返回:
-    tuple[np.ndarray, float]:
-        - np.ndarray: 改变速度后的音频数据。
-        - float: 本次随机采用的实际速度值。
+    np.ndarray: 改变速度后的 float32 音频数据。
     """
     speed = random.uniform(speed_min, speed_max)
-    # librosa.effects.time_stretch 需要短时傅里叶变换
-    y_stretched = librosa.effects.time_stretch(y, rate=speed)
-    return y_stretched.astype(np.float32)
\ No newline at end of file
+    return time_stretch_multi(y, [speed])[0]
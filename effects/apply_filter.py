@@ -1,42 +1,139 @@
+from functools import lru_cache
+
 import numpy as np
-from pydub import AudioSegment
+from scipy.signal import sosfilt
+
+from ._batch import row_values
+from ._buffers import as_float32, output_buffer
+from ._stream import EMPTY
+
+
+@lru_cache(maxsize=256)
+def design_sos(filter_type, cutoff_hz, sr, order):
+    """
+    设计 `order` 个一阶滤波器的级联，以二阶节 (SOS) 矩阵表示，每一行是一个一阶节 (二次项系数为 0)。
+
+    每个一阶节与 pydub 的 low_pass_filter / high_pass_filter 相同 (RC 近似, RC = 1 / (2π·cutoff)):
+    低通 y[n] = y[n-1] + α·(x[n] - y[n-1])，α = dt / (RC + dt)；
+    高通 y[n] = α·(y[n-1] + x[n] - x[n-1])，α = RC / (RC + dt)。
+    结果按 (类型, 截止频率, 采样率, 阶数) 缓存，调用方不应修改返回的数组。
+
+    返回:
+    np.ndarray: 形状为 (order, 6) 的 float32 SOS 系数矩阵。
+    """
+    if filter_type not in ('lowpass', 'highpass'):
+        raise ValueError("filter_type 必须是 'lowpass' 或 'highpass'")
+    if order < 1:
+        raise ValueError("repeat 必须大于等于 1")
+
+    rc = 1.0 / (float(cutoff_hz) * 2 * np.pi)
+    dt = 1.0 / sr
+    if filter_type == 'lowpass':
+        alpha = dt / (rc + dt)
+        section = [alpha, 0.0, 0.0, 1.0, alpha - 1.0, 0.0]
+    else:
+        alpha = rc / (rc + dt)
+        section = [alpha, -alpha, 0.0, 1.0, -alpha, 0.0]
+    return np.array([section] * order, dtype=np.float32)
+
+
+def initial_state(sos, x0):
+    """
+    返回使每一级的第一个输出样本等于输入第一个样本的滤波器状态 (与 pydub 相同，每一级都从 y[0] = x[0] 开始)。
+
+    参数:
+    sos (np.ndarray): design_sos 返回的系数矩阵。
+    x0 (np.ndarray): 输入的第一个样本；二维输入时为每行的第一个样本。
+
+    返回:
+    np.ndarray: 形状为 (n_sections, *x0.shape, 2) 的 float32 状态，作为 sosfilt 的 zi。
+    """
+    x0 = np.asarray(x0, dtype=np.float32)
+    zi = np.zeros((len(sos),) + x0.shape + (2,), dtype=np.float32)
+    # 直接 II 型转置结构中 y[0] = b0·x[0] + zi[0]
+    zi[..., 0] = (1 - sos[:, 0]).reshape((-1,) + (1,) * x0.ndim) * x0
+    return zi
+
+
+class _SosStream:
+    """逐块滤波的流，滤波器状态 zi 在块之间延续 (由第一块的第一个样本初始化)。"""
+
+    def __init__(self, sos, wet):
+        self.sos = sos
+        self.wet = wet
+        self._zi = None
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        if self._zi is None:
+            self._zi = initial_state(self.sos, block[0])
+        y_filtered, self._zi = sosfilt(self.sos, block, zi=self._zi)
+        y_filtered = y_filtered.astype(np.float32, copy=False)
+        if self.wet == 1.0:
+            return y_filtered
+        return (1 - self.wet) * block + self.wet * y_filtered
+
+    def flush(self):
+        return EMPTY
 
 
-def process(y, sr, filter_type='lowpass', cutoff_hz=1000, repeat=1, wet=1.0):
+def make_stream(sr, filter_type='lowpass', cutoff_hz=1000, repeat=1, wet=1.0):
+    """返回与 process 等价的逐块滤波流。"""
+    return _SosStream(design_sos(filter_type, float(cutoff_hz), int(sr), int(repeat)), wet)
+
+
+def process(y, sr, filter_type='lowpass', cutoff_hz=1000, repeat=1, wet=1.0, out=None):
     """
-    使用 pydub 应用一个或多个高通或低通滤波器。
+    应用一个或多个级联的一阶高通或低通滤波器 (6 dB/倍频程/级)，每一级的响应与 pydub 的滤波器相同 (见 design_sos)。
+    与原先经 pydub 处理的区别只在于不再量化为 16 位整数。
 
     参数:
-    y (np.ndarray): 输入的音频数据 NumPy 数组。
+    y (np.ndarray): 输入的音频数据 NumPy 数组。也可以是形状为 (n_clips, samples) 的二维数组，每行独立滤波。
     sr (int): 音频的采样率 (Hz)。
     filter_type (str): 滤波器类型。可选 'lowpass' 或 'highpass'。
     cutoff_hz (int): 滤波器的截止频率（Hz）。
                      对于 'lowpass'，高于此频率的声音将被衰减。
                      对于 'highpass'，低于此频率的声音将被衰减。
-    repeat (int): 应用滤波器的次数。次数越多，效果越强。
+    repeat (int): 级联的滤波器个数。次数越多，效果越强。所有级联在一次 sosfilt 中完成。
     wet (float): 干/湿混合比例 (0 到 1)。
+    out (np.ndarray, optional): wet != 1 时写入混合结果的 float32 缓冲区 (见 effects/_buffers.py)。
 
     返回:
-    np.ndarray: 处理后的音频数据。
+    np.ndarray: 处理后的 float32 音频数据，形状与输入相同。
     """
-    # 将 numpy 数组转换为 pydub 的 AudioSegment
-    audio = AudioSegment(
-        (y * 32767).astype(np.int16).tobytes(),
-        frame_rate=sr, sample_width=2, channels=1
-    )
+    sos = design_sos(filter_type, float(cutoff_hz), int(sr), int(repeat))
+    y = as_float32(y)
+    if y.shape[-1] == 0:
+        return y.copy()
+    y_filtered, _ = sosfilt(sos, y, axis=-1, zi=initial_state(sos, y[..., 0]))
+    y_filtered = y_filtered.astype(np.float32, copy=False)
 
-    for _ in range(repeat):
-        if filter_type == 'lowpass':
-            audio = audio.low_pass_filter(cutoff_hz)
-        elif filter_type == 'highpass':
-            audio = audio.high_pass_filter(cutoff_hz)
-        else:
-            # 如果提供了无效的 filter_type，则引发错误
-            raise ValueError("filter_type 必须是 'lowpass' 或 'highpass'")
+    if wet == 1.0:
+        return y_filtered
+    # (1 - wet) * y + wet * y_filtered，不再为两个乘积分别分配数组
+    y_filtered *= wet
+    mixed = np.multiply(y, 1 - wet, out=output_buffer(out, y))
+    mixed += y_filtered
+    return mixed
 
-    y_filtered = np.array(audio.get_array_of_samples()).astype(np.float32) / 32767.0
 
-    min_len = min(len(y), len(y_filtered))
-    y, y_filtered = y[:min_len], y_filtered[:min_len]
+def process_batch(ys, sr, filter_type='lowpass', cutoff_hz=1000, repeat=1, wet=1.0):
+    """
+    对形状为 (n_rows, samples) 的一组音频滤波。所有参数都可以是标量或长度为 n_rows 的序列。
+    滤波器参数相同的行合并为一个二维数组，一次滤波完成。
+
+    返回:
+    np.ndarray: 形状与输入相同的 float32 处理结果。
+    """
+    n_rows = len(ys)
+    ys = as_float32(ys)
+    designs = list(zip(row_values(filter_type, n_rows), row_values(cutoff_hz, n_rows), row_values(repeat, n_rows)))
+    wets = np.asarray(row_values(wet, n_rows), dtype=np.float32)
+
+    y_filtered = np.empty_like(ys)
+    for design in set(designs):
+        rows = [i for i, d in enumerate(designs) if d == design]
+        sos = design_sos(design[0], float(design[1]), int(sr), int(design[2]))
+        y_filtered[rows], _ = sosfilt(sos, ys[rows], axis=-1, zi=initial_state(sos, ys[rows, 0]))
 
-    return (1 - wet) * y + wet * y_filtered
+    return (1 - wets[:, None]) * ys + wets[:, None] * y_filtered
@@ -1,8 +1,159 @@
+from functools import lru_cache
+
 import numpy as np
 import pyloudnorm as pyln
+from scipy.signal import sosfilt
+
+from ._batch import row_values
+from ._buffers import as_float32, output_buffer
+from ._stream import GainStream, PassThroughStream
+
+# ITU-R BS.1770 门限块的长度 (秒) 与重叠比例，与 pyloudnorm.Meter 的默认值一致
+_GATE_BLOCK = 0.400
+_GATE_OVERLAP = 0.75
+# 测量长音频时每次滤波的样本数 (所有行合计)，K 计权后的 float64 中间结果只占用这么大的内存
+_CHUNK = 1 << 20
+
+
+@lru_cache(maxsize=16)
+def _meter(sr):
+    """按采样率缓存 pyloudnorm 响度计 (构造时会重新设计 K 计权滤波器)。"""
+    return pyln.Meter(sr)
+
+
+@lru_cache(maxsize=16)
+def _k_weighting(sr):
+    """
+    返回 pyloudnorm 在该采样率下使用的 K 计权滤波器，合并为二阶节形式。
+
+    返回:
+    tuple[np.ndarray, float]: (SOS 系数矩阵, 各级通带增益之积)。
+    """
+    filters = list(_meter(sr)._filters.values())
+    sos = np.array([np.concatenate([f.b / f.a[0], f.a / f.a[0]]) for f in filters])
+    return sos, float(np.prod([f.passband_gain for f in filters]))
+
+
+def _gated_loudness(z):
+    """
+    由每个门限块的均方能量计算综合响度，依次应用 -70 LUFS 绝对门限和相对门限，计算方式与 pyloudnorm 相同。
+
+    参数:
+    z (np.ndarray): 每个门限块 (400 ms，重叠 75%) 的 K 计权均方能量，形状为 (n_blocks,) 或 (n_rows, n_blocks)。
+
+    返回:
+    float | np.ndarray: 综合响度 (LUFS)，二维输入时每行一个。没有块通过门限时为 -inf。
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        block_loudness = -0.691 + 10.0 * np.log10(z)
+        above_abs = block_loudness >= -70.0
+        mean_abs = np.sum(z * above_abs, axis=-1) / np.sum(above_abs, axis=-1)
+        gamma_r = -0.691 + 10.0 * np.log10(mean_abs) - 10.0
+        # 没有块通过绝对门限时 gamma_r 为 nan，下面的比较全部为 False
+        gated = (block_loudness > gamma_r[..., None]) & above_abs & (block_loudness > -70.0)
+        n_gated = np.sum(gated, axis=-1)
+        mean_gated = np.where(n_gated > 0, np.sum(z * gated, axis=-1) / np.maximum(n_gated, 1), 0.0)
+        loudness = -0.691 + 10.0 * np.log10(mean_gated)
+    return float(loudness) if np.ndim(loudness) == 0 else loudness
+
+
+class _LoudnessAccumulator:
+    """
+    逐块测量综合响度，输入可以是一维音频或 (n_rows, samples) 的二维批量。
+
+    K 计权滤波器的状态在块之间延续，平方和只在各门限块的边界处记录累计值 (每小时音频约 36000 个门限块)，
+    因此内存占用与音频长度无关，也不需要逐个门限块的 Python 循环。
+    """
+
+    def __init__(self, sr, n_rows=None):
+        self.sr = sr
+        self.n_rows = n_rows
+        self._sos, gain = _k_weighting(sr)
+        self._energy_gain = gain * gain
+        rows = 1 if n_rows is None else n_rows
+        self._zi = np.zeros((len(self._sos), rows, 2))
+        self._n = 0
+        self._total = np.zeros(rows)
+        self._lower = []
+        self._upper = []
+
+    def _bounds(self, j, upper):
+        # 与 pyloudnorm 完全相同的边界计算方式: int(T_g * (j * step + {0, 1}) * rate)
+        return (_GATE_BLOCK * (j * (1.0 - _GATE_OVERLAP) + upper) * self.sr).astype(np.int64)
+
+    def _record(self, recorded, upper, cumsum, end):
+        """记录所有落在 (self._n, end] 内的边界处的累计平方和。"""
+        first = sum(values.shape[-1] for values in recorded)
+        last = int((end + 1) / (_GATE_BLOCK * (1.0 - _GATE_OVERLAP) * self.sr)) + 2
+        if last <= first:
+            return
+        bounds = self._bounds(np.arange(first, last), upper)
+        bounds = bounds[bounds <= end]
+        offsets = bounds - self._n
+        values = cumsum[:, np.maximum(offsets - 1, 0)]
+        values[:, offsets <= 0] = self._total[:, None]
+        recorded.append(values)
+
+    def update(self, block):
+        x = np.asarray(block, dtype=np.float64).reshape(len(self._total), -1)
+        if x.shape[-1] == 0:
+            return
+        x, self._zi = sosfilt(self._sos, x, axis=-1, zi=self._zi)
+        cumsum = np.cumsum(np.square(x, out=x), axis=-1)
+        cumsum *= self._energy_gain
+        cumsum += self._total[:, None]
+        end = self._n + x.shape[-1]
+        self._record(self._lower, 0, cumsum, end)
+        self._record(self._upper, 1, cumsum, end)
+        self._n = end
+        self._total = cumsum[:, -1].copy()
+
+    def result(self):
+        """返回综合响度 (LUFS，二维输入时每行一个)；音频短于一个门限块时返回 None。"""
+        if self._n < _GATE_BLOCK * self.sr:
+            return None
+        step = _GATE_BLOCK * (1.0 - _GATE_OVERLAP)
+        n_blocks = int(np.round((self._n / self.sr - _GATE_BLOCK) / step)) + 1
+
+        def cumulative(recorded):
+            # 超出末尾的边界按 pyloudnorm 的切片语义截断到信号末尾
+            values = np.repeat(self._total[:, None], n_blocks, axis=1)
+            known = np.concatenate(recorded, axis=1)[:, :n_blocks] if recorded else np.zeros((len(self._total), 0))
+            values[:, :known.shape[1]] = known
+            return values
+
+        z = (cumulative(self._upper) - cumulative(self._lower)) / (_GATE_BLOCK * self.sr)
+        loudness = _gated_loudness(z)
+        return loudness if self.n_rows is not None else float(loudness[0])
+
+
+def integrated_loudness(y, sr):
+    """
+    测量综合响度 (ITU-R BS.1770-4，与 pyloudnorm.Meter(sr).integrated_loudness 的结果一致)。
+
+    K 计权用一次二阶节滤波完成，门限块的能量由累计平方和一次求出，没有逐块的 Python 循环；
+    长音频按固定大小分段滤波，中间结果的内存占用与音频长度无关。
+
+    参数:
+    y (np.ndarray): 一维音频，或形状为 (n_rows, samples) 的二维批量。
+    sr (int): 采样率 (Hz)。
+
+    返回:
+    float | np.ndarray | None: 综合响度 (LUFS)，二维输入时每行一个；静音为 -inf；短于一个门限块 (400 ms) 时返回 None。
+    """
+    y = np.asarray(y)
+    accumulator = _LoudnessAccumulator(sr, n_rows=len(y) if y.ndim == 2 else None)
+    step = max(_CHUNK // (len(y) if y.ndim == 2 else 1), 1)
+    for start in range(0, y.shape[-1], step):
+        accumulator.update(y[..., start:start + step])
+    return accumulator.result()
 
 
-def process(y, sr, target_lufs=-23.0):
+def _is_measurable(loudness):
+    return loudness is not None and np.isfinite(loudness)
+
+
+def process(y, sr, target_lufs=-23.0, input_loudness=None, out=None):
     """
     【新版本】将音频的响度归一化到指定的目标 LUFS 值。
     LUFS (Loudness Units Full Scale) 是一个更符合人耳感知响度的标准。
@@ -16,24 +167,83 @@ def process(y, sr, target_lufs=-23.0):
                          - -23 LUFS: 广播电视响度标准 (EBU R128)。
                          - -28 LUFS: 较安静的背景音。
                          - 默认值为 -23.0。
+    input_loudness (float, optional): 已知的输入综合响度 (LUFS)，例如上游已经测得、之间只经过纯增益效果。
+                                      提供时不再测量。效果链会自动传入 (见 output_loudness)。
+    out (np.ndarray, optional): 写入结果的 float32 缓冲区 (见 effects/_buffers.py)。
 
     返回:
-    np.ndarray: 经过响度归一化处理后的音频数据。
+    np.ndarray: 经过响度归一化处理后的 float32 音频数据。
     """
-    # 1. 创建一个响度计，使用 EBU R128 标准
-    meter = pyln.Meter(sr)
-
-    # 2. 测量输入音频的综合响度 (Integrated Loudness)
-    try:
-        # pyloudnorm 要求输入是 float 类型
-        loudness = meter.integrated_loudness(y.astype(np.float32))
-    except ValueError:
-        # 如果音频太短或几乎为静音，测量可能会失败
+    y = as_float32(y)
+    # 测量输入音频的综合响度 (Integrated Loudness)
+    loudness = integrated_loudness(y, sr) if input_loudness is None else input_loudness
+    if not _is_measurable(loudness):
+        # 如果音频太短或几乎为静音，测量会失败
         # 在这种情况下，我们选择不改变音量，直接返回原音频
         print(f"⚠️ 警告 (change_volume): 无法测量音频响度 (可能音频过短或为静音)，跳过响度归一化。")
         return y
 
-    # 3. 使用 pyloudnorm 的归一化函数调整音频响度
-    y_normalized = pyln.normalize.loudness(y, loudness, target_lufs)
+    # 按响度差计算增益 (与 pyln.normalize.loudness 相同)，以 float32 相乘
+    gain = 10.0 ** ((target_lufs - float(loudness)) / 20.0)
+    return np.multiply(y, gain, out=output_buffer(out, y))
+
+
+def process_batch(ys, sr, target_lufs=-23.0, input_loudness=None):
+    """
+    对形状为 (n_rows, samples) 的一组音频逐行做响度归一化。所有行的响度在一次向量化测量中得到。
+
+    参数:
+    ys (np.ndarray): 二维音频数组，每行是一段独立的音频。
+    sr (int): 音频的采样率 (Hz)。
+    target_lufs (float | list[float]): 目标响度，可以为每行指定不同的值。
+    input_loudness (float | list[float], optional): 已知的每行输入响度，提供时不再测量。
+
+    返回:
+    np.ndarray: 形状与输入相同的 float32 处理结果。无法测量响度的行保持原样。
+    """
+    ys = as_float32(ys)
+    if input_loudness is None:
+        loudness = integrated_loudness(ys, sr)
+        if loudness is None:
+            loudness = [None] * len(ys)
+    else:
+        loudness = row_values(input_loudness, len(ys))
+    targets = row_values(target_lufs, len(ys))
+    gains = np.ones(len(ys), dtype=np.float32)
+    for i, row_loudness in enumerate(loudness):
+        if not _is_measurable(row_loudness):
+            print(f"⚠️ 警告 (change_volume): 无法测量第 {i} 行音频的响度 (可能音频过短或为静音)，跳过响度归一化。")
+            continue
+        gains[i] = 10.0 ** ((targets[i] - float(row_loudness)) / 20.0)
+    return ys * gains[:, None]
+
+
+def output_loudness(input_loudness, target_lufs=-23.0, **params):
+    """
+    供效果链跟踪响度：本效果是纯增益，归一化后输出的综合响度就是 target_lufs。
+    效果链据此把它作为下一个 change_volume 的 input_loudness，省去一次测量。
+    (增益不改变门限块之间的相对关系，只有在 -70 LUFS 绝对门限附近的块可能使重新测量的结果略有不同。)
+    """
+    return target_lufs
+
+
+def stream_stats(sr, target_lufs=-23.0):
+    """返回流式模式下测量本效果输入响度的累加器。"""
+    return _LoudnessAccumulator(sr)
+
+
+def make_stream(sr, loudness, target_lufs=-23.0, verbose=True):
+    """
+    返回流式模式下的响度归一化流。
 
-    return y_normalized
\ No newline at end of file
+    参数:
+    sr (int): 采样率 (Hz)。
+    loudness (float | None): stream_stats 测得的输入综合响度，None 表示无法测量。
+    target_lufs (float): 目标响度，单位为 LUFS。
+    verbose (bool): 无法测量响度时是否打印警告 (流式处理的测量遍中为 False)。
+    """
+    if not _is_measurable(loudness):
+        if verbose:
+            print(f"⚠️ 警告 (change_volume): 无法测量音频响度 (可能音频过短或为静音)，跳过响度归一化。")
+        return PassThroughStream()
+    return GainStream(10.0 ** ((target_lufs - loudness) / 20.0))
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import librosa
+import numpy as np
+import soundfile as sf
+
+# 预处理后的噪音缓存目录名，位于噪音库根目录下 (不属于任何类别目录，不会被索引)
+CACHE_DIRNAME = ".noise_cache"
+# 每个进程最多同时保持映射的噪音文件数，超过时关闭最久未使用的映射
+DEFAULT_MAX_OPEN = 64
+
+
+class NoiseBank:
+    """
+    噪音库索引与预处理缓存。
+
+    - 每个类别目录只用 os.walk 扫描一次，结果保存在内存索引中。
+    - 每个噪音文件只解码、混合为单声道并重采样到目标采样率一次，以 float32 `.npy` 形式
+      存入磁盘缓存，之后通过内存映射 (mmap) 读取，不再占用进程私有内存。
+    - 缓存键为 (文件路径, 修改时间, 目标采样率)，源文件被修改后会自动重新生成。
+    - 每个文件的 RMS 与缓存一起预先计算并保存。
+    - 已打开的映射按 LRU 最多保留 `max_open` 个，淘汰的映射随最后一个引用释放，
+      大型噪音库不会让映射与文件句柄无限增长。
+    """
+
+    def __init__(self, noise_dir, cache_dir=None, max_open=DEFAULT_MAX_OPEN):
+        self.noise_dir = noise_dir
+        self.cache_dir = cache_dir or os.path.join(noise_dir, CACHE_DIRNAME)
+        self.max_open = max_open
+        self._index = {}
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+
+    def list_category(self, category):
+        """
+        返回类别目录 (含子目录) 下所有 .wav 文件的路径列表。
+        类别目录不存在时返回 None。
+        """
+        if category in self._index:
+            return self._index[category]
+
+        category_path = os.path.join(self.noise_dir, category)
+        if not os.path.isdir(category_path):
+            return None
+
+        available_noises = []
+        for dirpath, _, filenames in os.walk(category_path):
+            for filename in filenames:
+                if filename.lower().endswith('.wav'):
+                    available_noises.append(os.path.join(dirpath, filename))
+
+        self._index[category] = available_noises
+        return available_noises
+
+    def load(self, noise_path, sr):
+        """
+        读取一个噪音文件的预处理结果。
+
+        参数:
+        noise_path (str): 噪音文件路径。
+        sr (int): 目标采样率 (Hz)。
+
+        返回:
+        tuple[np.ndarray, float]:
+            - np.ndarray: 只读、内存映射的单声道 float32 噪音数据。
+            - float: 整个文件的 RMS。
+        """
+        mtime_ns = os.stat(noise_path).st_mtime_ns  # 文件不存在时抛出 FileNotFoundError
+        key = (os.path.abspath(noise_path), mtime_ns, sr)
+        with self._lock:
+            entry = self._loaded.get(key)
+            if entry is not None:
+                self._loaded.move_to_end(key)
+                return entry
+
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        npy_path = os.path.join(self.cache_dir, f"{digest}.npy")
+        meta_path = os.path.join(self.cache_dir, f"{digest}.json")
+
+        if not (os.path.exists(npy_path) and os.path.exists(meta_path)):
+            self._build_entry(noise_path, sr, npy_path, meta_path)
+
+        noise = np.load(npy_path, mmap_mode="r")
+        with open(meta_path, "r", encoding="utf-8") as f:
+            rms = json.load(f)["rms"]
+
+        if self.max_open > 0:
+            with self._lock:
+                self._loaded[key] = (noise, rms)
+                while len(self._loaded) > self.max_open:
+                    self._loaded.popitem(last=False)
+        return noise, rms
+
+    def _build_entry(self, noise_path, sr, npy_path, meta_path):
+        """解码、混合为单声道、重采样并写入磁盘缓存。使用临时文件+重命名，多个进程同时生成也是安全的。"""
+        noise, sr_n = sf.read(noise_path)
+        if noise.ndim > 1:
+            noise = np.mean(noise, axis=1)
+        if sr_n != sr:
+            noise = librosa.resample(noise, orig_sr=sr_n, target_sr=sr)
+        noise = noise.astype(np.float32)
+        rms = float(np.sqrt(np.mean(noise.astype(np.float64) ** 2)))
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_suffix = f".{os.getpid()}.tmp"
+        with open(npy_path + tmp_suffix, "wb") as f:
+            np.save(f, noise)
+        with open(meta_path + tmp_suffix, "w", encoding="utf-8") as f:
+            json.dump({"path": noise_path, "sr": sr, "length": len(noise), "rms": rms}, f)
+        os.replace(npy_path + tmp_suffix, npy_path)
+        os.replace(meta_path + tmp_suffix, meta_path)
+
+
+_banks = {}
+
+
+def get_noise_bank(noise_dir, cache_dir=None):
+    """返回 noise_dir 对应的 NoiseBank，同一进程内只创建一次，索引与映射在多次调用间复用。"""
+    key = (os.path.abspath(noise_dir), cache_dir)
+    if key not in _banks:
+        _banks[key] = NoiseBank(noise_dir, cache_dir)
+    return _banks[key]
@@ -0,0 +1,101 @@
+import io
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from evaluation.asr_cache import cache_key, content_hash
+
+# 识别后端协议 (供 batch_eval_grid.py 的流式评测使用):
+#   - batch_size: 每次 transcribe 最多接收的音频数；
+#   - transcribe(clips): clips 为内存中已编码音频的字节 (与写盘的文件逐字节相同，见 pipeline.sinks.encode_audio) 列表，
+#     返回一一对应的文本，单条失败时为 None。后端按这些字节计算缓存键，与转录同一文件的批处理脚本共用缓存条目；
+#   - close(): 释放线程池等资源。
+# 引擎依赖 (whisper / torch、dashscope) 在创建对应后端时才导入，只用其中一种引擎时不需要安装另一种。
+
+
+class WhisperBackend:
+    """
+    在内存音频上运行 Whisper：与 whisper_batch 读取文件时一样解码并重采样到 16 kHz，再交给同一个
+    whisper_batch.transcribe_batch 成批解码，升温重解与静音判定与 model.transcribe 相同，两条路径的 WER 可以直接比较。
+    缓存键与 whisper_batch 相同 (文件内容哈希与 whisper_batch.cache_options)。
+    """
+
+    def __init__(self, model_name=None, batch_size=None, cache=None):
+        import torch
+        from evaluation import whisper_batch
+
+        self._whisper_batch = whisper_batch
+        self.model_name = model_name or whisper_batch.MODEL_NAME
+        self.batch_size = batch_size or whisper_batch.DEFAULT_BATCH_SIZE
+        self.cache = cache
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        print(f"Using device: {device}")
+        self.model = whisper_batch.whisper.load_model(self.model_name, device=device)
+        self._options = whisper_batch.cache_options(self.model)
+
+    def transcribe(self, clips):
+        texts = [None] * len(clips)
+        keys = [None] * len(clips)
+        todo = list(range(len(clips)))
+        if self.cache is not None:
+            todo = []
+            for k, data in enumerate(clips):
+                keys[k] = cache_key(content_hash(data), "whisper", self.model_name, self._options)
+                texts[k] = self.cache.get(keys[k])
+                if texts[k] is None:
+                    todo.append(k)
+        if todo:
+            audios = [self._whisper_batch.load_audio(io.BytesIO(clips[k])) for k in todo]
+            for k, text in zip(todo, self._whisper_batch.transcribe_batch(self.model, audios)):
+                texts[k] = text
+                if self.cache is not None:
+                    self.cache.put(keys[k], text)
+        return texts
+
+    def close(self):
+        pass
+
+
+class QwenBackend:
+    """
+    在内存音频上调用 Qwen3-ASR：API 只接受文件，因此每条音频的字节写入临时的 WAV 文件，识别后立即删除。
+    请求由线程池并发发出，速率与重试由 QwenASRClient 控制。
+    """
+
+    def __init__(self, rate=None, workers=None, max_retries=None, cache=None):
+        from evaluation import qwen_batch, qwen_client
+
+        self.client = qwen_client.QwenASRClient(qwen_batch.API_KEY,
+                                                rate=rate or qwen_client.DEFAULT_RATE,
+                                                max_retries=qwen_client.DEFAULT_MAX_RETRIES if max_retries is None else max_retries,
+                                                cache=cache)
+        workers = workers or qwen_client.DEFAULT_WORKERS
+        # 每次交给后端两倍于并发数的音频，线程池在等待响应时始终有请求可发
+        self.batch_size = 2 * workers
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+    def _recognize(self, data):
+        fd, tmp_path = tempfile.mkstemp(suffix=".wav")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            return self.client.recognize(tmp_path, digest=content_hash(data))
+        finally:
+            os.remove(tmp_path)
+
+    def transcribe(self, clips):
+        return list(self._pool.map(self._recognize, clips))
+
+    def close(self):
+        self._pool.shutdown()
+
+
+def create_backend(engine, batch_size=None, rate=None, workers=None, cache=None):
+    """按引擎名 ("whisper" 或 "qwen") 创建识别后端。"""
+    if engine == "whisper":
+        return WhisperBackend(batch_size=batch_size, cache=cache)
+    if engine == "qwen":
+        return QwenBackend(rate=rate, workers=workers, cache=cache)
+    raise ValueError(f"未知的识别引擎: {engine}")
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.manifest import input_hash
+
+# 默认缓存位置与容量，可用环境变量 ASR_CACHE_PATH / ASR_CACHE_MB 覆盖
+DEFAULT_PATH = os.getenv("ASR_CACHE_PATH",
+                         os.path.join(os.path.expanduser("~"), ".cache", "audio_process", "asr_cache.sqlite"))
+DEFAULT_MAX_BYTES = int(os.getenv("ASR_CACHE_MB", "256")) * 1024 * 1024
+
+
+def content_hash(source) -> str:
+    """音频内容的 sha256：source 为文件路径 (按路径、大小与修改时间在进程内缓存) 或已读入的字节。"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(source).hexdigest()
+    return input_hash(source)
+
+
+def cache_key(digest: str, engine: str, model: str, options: dict = None) -> str:
+    """由 (音频内容哈希, 引擎, 模型名, 解码选项) 生成缓存键。选项按键排序后序列化，顺序不影响结果。"""
+    payload = json.dumps([digest, engine, model, options or {}], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ASRCache:
+    """
+    持久化在 sqlite 中的识别结果缓存，多个转录脚本与多次运行共用。
+
+    条目按 cache_key 区分；只缓存成功的识别结果。所有条目 (键与文本) 的总字节数超过 max_bytes 时，
+    按最近使用时间淘汰最旧的条目，直到回到预算的 90% 以下。可以被多个线程同时使用。
+    max_bytes 为 0 时缓存被禁用：get 总是未命中，put 不写入。
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        if max_bytes > 0:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            # WAL 允许多个进程同时读写同一个缓存文件
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS entries ("
+                               "key TEXT PRIMARY KEY, text TEXT NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+            self._conn.commit()
+
+    def get(self, key: str):
+        """返回缓存的识别文本，未命中时返回 None。命中的条目会更新最近使用时间。"""
+        if self._conn is None:
+            self.misses += 1
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT text FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE entries SET used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, text: str) -> None:
+        """写入一条识别结果 (text 为 None 时忽略)，必要时淘汰最久未使用的条目。"""
+        if self._conn is None or text is None:
+            return
+        size = len(key) + len(text.encode("utf-8"))
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO entries (key, text, size, used) VALUES (?, ?, ?, ?)",
+                               (key, text, size, time.time()))
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = total - int(self.max_bytes * 0.9)
+        freed = 0
+        stale = []
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY used"):
+            if freed >= target:
+                break
+            stale.append((key,))
+            freed += size
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", stale)
+
+    def lookup(self, compute, digest: str, engine: str, model: str, options: dict = None):
+        """
+        先查缓存，未命中时调用 compute() 识别并写入缓存。
+
+        参数:
+        compute (callable): 无参数，返回识别文本，失败时返回 None (失败不缓存)。
+        digest (str): 音频内容哈希 (见 content_hash)。
+        engine, model, options: 与 cache_key 相同。
+        """
+        key = cache_key(digest, engine, model, options)
+        text = self.get(key)
+        if text is None:
+            text = compute()
+            self.put(key, text)
+        return text
+
+    def summary(self) -> str:
+        return f"ASR 缓存: 命中 {self.hits}, 未命中 {self.misses}"
+
+    def close(self):
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+                self._conn = None
+
+
+def parse_cache_args(argv):
+    """
+    从命令行参数中取出缓存相关参数，返回 (ASRCache, 其余参数)。
+    --asr-cache=路径 指定缓存文件，--asr-cache-mb=N 指定容量，--no-asr-cache 禁用缓存。
+    """
+    path, max_bytes, rest = DEFAULT_PATH, DEFAULT_MAX_BYTES, []
+    for arg in argv:
+        if arg.startswith('--asr-cache='):
+            path = arg.split('=', 1)[1]
+        elif arg.startswith('--asr-cache-mb='):
+            try:
+                max_bytes = max(0, int(arg.split('=', 1)[1])) * 1024 * 1024
+            except ValueError:
+                print("⚠️ 警告：无效的 --asr-cache-mb 参数格式。示例: --asr-cache-mb=512。将使用默认值。")
+        elif arg == '--no-asr-cache':
+            max_bytes = 0
+        else:
+            rest.append(arg)
+    return ASRCache(path, max_bytes), rest
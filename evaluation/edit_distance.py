@@ -0,0 +1,276 @@
+import itertools
+import re
+from typing import Iterable, List, Sequence
+
+import numpy as np
+
+# 中日韩文字 (汉字、假名、谚文) 逐字成词，其余文字按空白切分。
+# 这样英文的 WER 与按空格切分相同，中文转写 (如 qwen3-asr 的输出) 的 WER 也有意义 (等价于汉字部分的 CER)。
+_CJK = "぀-ヿ㐀-䶿一-鿿豈-﫿가-힯"
+_WORD_PATTERN = re.compile(f"[{_CJK}]|[^\\s{_CJK}]+")
+_SPACE_PATTERN = re.compile(r"\s+")
+# 批量编码时用来分隔各条文本的字符 (文本本身不应包含它)
+_SEP = "\x00"
+_BATCH_WORD_PATTERN = re.compile(f"[{_CJK}]|[^\\s\\x00{_CJK}]+|\\x00")
+_CJK_PATTERN = re.compile(f"[{_CJK}]")
+
+# 批量计算时每批 DP 矩阵一行的元素总数上限 (批大小 × (最长假设长度 + 1))
+_BATCH_ELEMENTS = 1 << 21
+
+
+class ErrorCounts:
+    """
+    一组 (或一条) 参考/假设文本对齐后的错误计数：替换 (S)、删除 (D)、插入 (I) 以及参考文本的长度 (N)。
+    多条结果可以用 + 相加得到语料级的计数，error_rate = (S + D + I) / N。
+    """
+
+    __slots__ = ("substitutions", "deletions", "insertions", "reference_length")
+
+    def __init__(self, substitutions=0, deletions=0, insertions=0, reference_length=0):
+        self.substitutions = substitutions
+        self.deletions = deletions
+        self.insertions = insertions
+        self.reference_length = reference_length
+
+    @property
+    def errors(self) -> int:
+        return self.substitutions + self.deletions + self.insertions
+
+    @property
+    def error_rate(self) -> float:
+        """错误率；参考文本为空时，假设也为空返回 0.0，否则返回 inf。"""
+        if self.reference_length == 0:
+            return 0.0 if self.errors == 0 else float("inf")
+        return self.errors / self.reference_length
+
+    def __add__(self, other):
+        return ErrorCounts(self.substitutions + other.substitutions, self.deletions + other.deletions,
+                           self.insertions + other.insertions, self.reference_length + other.reference_length)
+
+    def __eq__(self, other):
+        return isinstance(other, ErrorCounts) and self.as_dict() == other.as_dict()
+
+    def __repr__(self):
+        return (f"ErrorCounts(S={self.substitutions}, D={self.deletions}, I={self.insertions}, "
+                f"N={self.reference_length})")
+
+    def as_dict(self):
+        return {"substitutions": self.substitutions, "deletions": self.deletions,
+                "insertions": self.insertions, "reference_length": self.reference_length}
+
+
+def tokenize(text: str, unit: str = "word") -> List[str]:
+    """
+    把文本切分为词元。
+
+    参数:
+    text: 输入文本 (通常已经过 truth_eval.normalize_text 标准化)。
+    unit: "word" 按词切分 (中日韩文字逐字成词，其余按空白切分)；"char" 按字符切分 (忽略空白)，用于 CER。
+    """
+    if unit == "word":
+        return _WORD_PATTERN.findall(text)
+    if unit == "char":
+        return list(_SPACE_PATTERN.sub("", text))
+    raise ValueError(f"未知的切分单位 '{unit}'，可选: word, char")
+
+
+class _Encoded:
+    """一组已编码的序列：所有编码首尾相接存放在 ids 中，第 k 条为 ids[starts[k]:starts[k] + lengths[k]]。"""
+
+    __slots__ = ("ids", "starts", "lengths")
+
+    def __init__(self, ids, starts, lengths):
+        self.ids = ids
+        self.starts = starts
+        self.lengths = lengths
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def split(self, k):
+        """拆成前 k 条与其余部分 (共用同一个 ids)。"""
+        return (_Encoded(self.ids, self.starts[:k], self.lengths[:k]),
+                _Encoded(self.ids, self.starts[k:], self.lengths[k:]))
+
+    def padded(self, index, width, fill):
+        """取出 index 中的序列并填充为 (len(index), width) 的矩阵。"""
+        lengths = self.lengths[index]
+        positions = np.arange(width)
+        mask = positions < lengths[:, None]
+        out = np.full((len(index), width), fill, dtype=np.int64)
+        out[mask] = self.ids[(self.starts[index][:, None] + positions)[mask]]
+        return out
+
+
+def _encode(sequences: Sequence[Sequence]) -> _Encoded:
+    """把多个词元序列编码为整数，相同的词元编码相同 (词表的构建与查找都在 C 层完成)。"""
+    flat = list(itertools.chain.from_iterable(sequences))
+    vocab = dict(zip(dict.fromkeys(flat), itertools.count()))
+    ids = np.fromiter(map(vocab.__getitem__, flat), dtype=np.int64, count=len(flat))
+    lengths = np.array([len(tokens) for tokens in sequences], dtype=np.int64)
+    return _Encoded(ids, np.cumsum(lengths) - lengths, lengths)
+
+
+def _encode_texts(texts: Sequence[str], unit: str) -> _Encoded:
+    """
+    把多条文本一次性切分并编码 (效果与逐条 tokenize 后编码相同)：
+    所有文本用分隔符连成一个字符串，只调用一次正则；字符级直接取 UTF-32 码点作为编码，不需要词表。
+    """
+    if not texts:
+        return _encode([])
+    if unit == "word":
+        # 分隔符两侧加空格，使它总是单独成为一个词元
+        joined = f" {_SEP} ".join(texts) + f" {_SEP}"
+        # 不含中日韩文字时按空白切分与正则切分结果相同，但快得多
+        tokens = _BATCH_WORD_PATTERN.findall(joined) if _CJK_PATTERN.search(joined) else joined.split()
+        vocab = dict(zip(dict.fromkeys(tokens), itertools.count()))
+        ids = np.fromiter(map(vocab.__getitem__, tokens), dtype=np.int64, count=len(tokens))
+        sep = vocab[_SEP]
+    elif unit == "char":
+        joined = _SEP.join(texts) + _SEP
+        ids = np.frombuffer(_SPACE_PATTERN.sub("", joined).encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+        sep = ord(_SEP)
+    else:
+        raise ValueError(f"未知的切分单位 '{unit}'，可选: word, char")
+    ends = np.flatnonzero(ids == sep)
+    starts = np.concatenate([[0], ends[:-1] + 1]).astype(np.int64)
+    return _Encoded(ids, starts, ends - starts)
+
+
+def _align_batch(R, H, n, m):
+    """
+    对一批已填充的整数序列对同时做编辑距离 DP，返回每对的 (S, D, I, N) 四个数组。
+
+    参数:
+    R, H (np.ndarray): 形状为 (批大小, 最长长度) 的参考与假设编码，填充值互不相同且不与任何编码 (>= 0) 相等。
+    n, m (np.ndarray): 每对的参考与假设长度。
+
+    DP 只保留一行 (形状为 (批大小, 最长假设长度 + 1))，对参考序列的每个位置做一次向量化更新：
+    - 每个单元格存一个整数键 “距离 * W - 替换数”，取最小值即先最小化编辑距离、再在等距离的对齐中取替换最多的一个
+      (删除数与插入数随之确定：D + I = 距离 - S，D - I = 参考长度 - 假设长度)；
+    - 行内的插入依赖 row[j] = min(t[j], row[j - 1] + W) 用 cummin(t[j] - j * W) + j * W 一次求出，没有逐格的 Python 循环。
+    """
+    batch, n_max = R.shape
+    m_max = H.shape[1]
+    W = max(n_max, m_max) + 1
+    # 键的取值不超过 (n_max + m_max + 1) * W，短句用 int32 即可，内存带宽减半
+    dtype = np.int32 if (n_max + m_max + 1) * W < 2 ** 31 else np.int64
+
+    offsets = np.arange(m_max + 1, dtype=dtype) * W
+    row = np.broadcast_to(offsets, (batch, m_max + 1)).copy()
+    keys = row[np.arange(batch), m].astype(np.int64)
+    t = np.empty((batch, m_max), dtype=dtype)
+    for i in range(n_max):
+        # 匹配代价 0，替换代价 W - 1 (距离 +1、替换数 +1)，删除代价 W
+        cost = np.where(R[:, i:i + 1] == H, dtype(0), dtype(W - 1))
+        np.add(row[:, :-1], cost, out=t)
+        np.minimum(t, row[:, 1:] + W, out=t)
+        row[:, 0] = (i + 1) * W
+        row[:, 1:] = t
+        row -= offsets
+        np.minimum.accumulate(row, axis=1, out=row)
+        row += offsets
+        done = n == i + 1
+        if done.any():
+            keys[done] = row[done, m[done]]
+
+    distance = -(-keys // W)
+    substitutions = distance * W - keys
+    deletions = (distance - substitutions + (n - m)) // 2
+    insertions = (distance - substitutions - (n - m)) // 2
+    return substitutions, deletions, insertions, n
+
+
+def _batch_arrays(refs: _Encoded, hyps: _Encoded) -> np.ndarray:
+    """
+    按长度排序、分批对齐已编码的序列对。
+
+    返回:
+    np.ndarray: 形状为 (4, 序列对数) 的 (S, D, I, N) 计数，列顺序与输入相同。
+    """
+    counts = np.zeros((4, len(refs)), dtype=np.int64)
+    counts[3] = refs.lengths
+    order = np.lexsort((hyps.lengths, refs.lengths))
+    # 参考为空的序列对全部是插入
+    empty = refs.lengths[order] == 0
+    counts[2, order[empty]] = hyps.lengths[order[empty]]
+    order = order[~empty]
+
+    widths = (hyps.lengths[order] + 1).tolist()
+    start = 0
+    while start < len(order):
+        # 批内最长的假设决定 DP 行的宽度
+        end, widest = start + 1, widths[start]
+        while end < len(order) and (end - start + 1) * max(widest, widths[end]) <= _BATCH_ELEMENTS:
+            widest = max(widest, widths[end])
+            end += 1
+        chunk = order[start:end]
+        n, m = refs.lengths[chunk], hyps.lengths[chunk]
+        R = refs.padded(chunk, int(n.max()), -1)
+        H = hyps.padded(chunk, int(m.max()), -2)
+        counts[:, chunk] = _align_batch(R, H, n, m)
+        start = end
+    return counts
+
+
+def _to_counts(counts: np.ndarray) -> List[ErrorCounts]:
+    return [ErrorCounts(*column) for column in counts.T.tolist()]
+
+
+def edit_counts(reference: Sequence, hypothesis: Sequence) -> ErrorCounts:
+    """
+    对一对词元序列计算 S/D/I 计数。DP 只保留较短序列长度的一行，内存为 O(min(n, m))。
+
+    参数:
+    reference: 参考词元序列 (如 tokenize 的结果)。
+    hypothesis: 识别结果的词元序列。
+    """
+    if len(hypothesis) > len(reference):
+        # 交换参考与假设使 DP 行更短；交换后删除与插入互换
+        hyp, ref = _encode([hypothesis, reference]).split(1)
+        s, i, d, _ = _batch_arrays(hyp, ref)[:, 0].tolist()
+        return ErrorCounts(s, d, i, len(reference))
+    ref, hyp = _encode([reference, hypothesis]).split(1)
+    return _to_counts(_batch_arrays(ref, hyp))[0]
+
+
+def batch_edit_counts(references: Sequence[Sequence], hypotheses: Sequence[Sequence]) -> List[ErrorCounts]:
+    """
+    对多对词元序列批量计算 S/D/I 计数，结果顺序与输入相同。
+
+    序列对按长度排序后分批，每批在一个二维数组上同时做 DP，Python 层的循环次数只与每批的最长参考长度有关。
+    """
+    if len(references) != len(hypotheses):
+        raise ValueError("references 与 hypotheses 的数量必须相同")
+    refs, hyps = _encode(list(references) + list(hypotheses)).split(len(references))
+    return _to_counts(_batch_arrays(refs, hyps))
+
+
+def _encode_pairs(references: Sequence[str], hypotheses: Sequence[str], unit: str):
+    if len(references) != len(hypotheses):
+        raise ValueError("references 与 hypotheses 的数量必须相同")
+    return _encode_texts(list(references) + list(hypotheses), unit).split(len(references))
+
+
+def batch_error_counts(references: Sequence[str], hypotheses: Sequence[str], unit: str = "word") -> List[ErrorCounts]:
+    """
+    对多对文本按 unit 切分 (见 tokenize) 并批量计算 S/D/I 计数，结果顺序与输入相同。
+    切分与编码对所有文本一次完成，百万条短句级别的语料只需数秒。
+    """
+    return _to_counts(_batch_arrays(*_encode_pairs(references, hypotheses, unit)))
+
+
+def corpus_error_counts(references: Iterable[str], hypotheses: Iterable[str], unit: str = "word") -> ErrorCounts:
+    """语料级的错误计数 (各条计数之和)，其 error_rate 即语料级 WER / CER。"""
+    counts = _batch_arrays(*_encode_pairs(list(references), list(hypotheses), unit))
+    return ErrorCounts(*counts.sum(axis=1).tolist())
+
+
+def wer(reference: str, hypothesis: str) -> float:
+    """单条文本的词错误率 (WER)。"""
+    return edit_counts(tokenize(reference, "word"), tokenize(hypothesis, "word")).error_rate
+
+
+def cer(reference: str, hypothesis: str) -> float:
+    """单条文本的字符错误率 (CER)，忽略空白。"""
+    return edit_counts(tokenize(reference, "char"), tokenize(hypothesis, "char")).error_rate
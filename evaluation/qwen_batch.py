@@ -1,8 +1,14 @@
 import os
+import sys
 import dashscope
-import json
-from http import HTTPStatus
-import time
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from evaluation.asr_cache import content_hash, parse_cache_args
+from evaluation.qwen_client import (DEFAULT_MAX_RETRIES, DEFAULT_RATE, DEFAULT_WORKERS, QwenASRClient,
+                                    collect_directory_items, parse_client_args, transcribe_to_eval)
+from pipeline.sinks import SHARDS_DIRNAME, ShardReader, has_shards
 
 # --- 1. API 全局配置 ---
 
@@ -17,43 +23,19 @@ dashscope.base_http_api_url = 'https://dashscope.aliyuncs.com/api/v1'
 # dashscope.base_http_api_url = 'https://dashscope-intl.aliyuncs.com/api/v1'
 
 
-def recognize_audio_with_api(audio_file_path: str) -> str:
-    """
-    使用 Qwen3-ASR API 转录单个音频文件。
-    成功则返回识别的文本，失败则返回 None。
-    """
-    # 构造符合 API 要求的文件路径
-    local_file_path_for_api = f"file://{os.path.abspath(audio_file_path)}"
-
-    messages = [
-        {"role": "system", "content": [{"text": ""}]},
-        {"role": "user", "content": [{"audio": local_file_path_for_api}]}
-    ]
-
-    try:
-        response = dashscope.MultiModalConversation.call(
-            model="qwen3-asr-flash",
-            messages=messages,
-            api_key=API_KEY,
-            result_format="message",
-            asr_options={"enable_lid": True, "enable_itn": True}
-        )
-
-        if response.status_code == HTTPStatus.OK:
-            return response.output.choices[0].message.content[0]['text'].strip()
-        else:
-            print(f"[API_ERROR] 文件 '{audio_file_path}' 转录失败: "
-                  f"Code: {response.code}, Message: {response.message}")
-            return None
-
-    except Exception as e:
-        print(f"[EXCEPTION] 调用 API 时发生异常 for file '{audio_file_path}': {e}")
-        return None
-
-
-def process_directory(root_dir: str):
+def _report(sub_dir, eval_file_path, stats):
+    print(f"--- 任务 {sub_dir} 完成: 新增 {stats['done']} 条, 跳过已完成 {stats['skipped']} 条, "
+          f"失败 {stats['failed']} 条, 结果已保存至 {eval_file_path} ---")
+    if stats["failed"]:
+        print("  ⚠️ 警告: 失败的文件未写入结果，重新运行即可重试。")
+
+
+def process_directory(root_dir: str, rate: float = DEFAULT_RATE, workers: int = DEFAULT_WORKERS,
+                      max_retries: int = DEFAULT_MAX_RETRIES, cache=None):
     """
     遍历给定根目录，对每个二级子目录进行处理，使用 Qwen-ASR API 生成 eval.jsonl。
+    请求并发发出并受令牌桶限速 (rate 次/秒)，结果追加写入；已在 eval.jsonl 中的音频会跳过，中断后可续跑。
+    传入 cache (ASRCache) 时内容相同的音频直接使用缓存的识别结果。
     """
     print(f"开始批量处理目录: {root_dir}")
     print(f"使用API服务地址: {dashscope.base_http_api_url}")
@@ -61,65 +43,79 @@ def process_directory(root_dir: str):
         print("\n[警告] 未找到有效的 API Key，请设置 DASHSCOPE_API_KEY 环境变量或在代码中提供。")
         return
 
+    client = QwenASRClient(API_KEY, rate=rate, max_retries=max_retries, cache=cache)
     # 遍历每个二级文件夹（每个子文件夹即为一个任务）
     for sub_dir in os.listdir(root_dir):
         sub_dir_path = os.path.join(root_dir, sub_dir)
         if not os.path.isdir(sub_dir_path):
             continue
+        items = collect_directory_items(sub_dir_path)
+        if not items:
+            continue
 
         eval_file_path = os.path.join(sub_dir_path, 'eval.jsonl')
-        is_first_record_in_group = True # 用于判断是覆盖写入(w)还是追加(a)
-
-        print(f"\n--- 开始处理任务: {sub_dir} ---")
-        
-        # 遍历该二级文件夹下的所有三级子文件夹
-        for third_level_dir in os.listdir(sub_dir_path):
-            third_level_dir_path = os.path.join(sub_dir_path, third_level_dir)
-
-            if os.path.isdir(third_level_dir_path):
-                audio_files = [f for f in os.listdir(third_level_dir_path) if f.lower().endswith('.wav')]
-                if not audio_files:
-                    continue
-                
-                print(f"  正在处理子目录: {third_level_dir} ({len(audio_files)} 个文件)")
-
-                # 打开 eval.jsonl 文件以写入或追加
-                write_mode = 'w' if is_first_record_in_group else 'a'
-                with open(eval_file_path, write_mode, encoding='utf-8') as eval_file:
-                    for audio_file in audio_files:
-                        audio_file_path = os.path.join(third_level_dir_path, audio_file)
-                        
-                        # 使用 API 转录音频文件
-                        text = recognize_audio_with_api(audio_file_path)
-                        
-                        # 如果API调用失败，text会是None，我们将其置为空字符串
-                        if text is None:
-                            text = ""
-                        
-                        record = {
-                            "audio_path": audio_file_path,
-                            "response": text,
-                            "original_key": third_level_dir
-                        }
-
-                        eval_file.write(json.dumps(record, ensure_ascii=False) + "\n")
-                        
-                        # 成功写入第一个记录后，后续都应使用追加模式
-                        is_first_record_in_group = False
-                        
-                        # API 有调用频率限制，短暂休眠一下可以避免触发流控
-                        time.sleep(0.5)
-
-                print(f"  [OK] 完成处理: {third_level_dir_path}")
-
-        print(f"--- 任务 {sub_dir} 完成, 结果已保存至 {eval_file_path} ---")
+        print(f"\n--- 开始处理任务: {sub_dir} ({len(items)} 个文件) ---")
+        stats = transcribe_to_eval(items, eval_file_path, client.recognize, workers)
+        _report(sub_dir, eval_file_path, stats)
 
 
-if __name__ == "__main__":
-    # 设置要处理的根目录
-    root_dir = "data_output_composer/"
+def process_shards(root_dir: str, rate: float = DEFAULT_RATE, workers: int = DEFAULT_WORKERS,
+                   max_retries: int = DEFAULT_MAX_RETRIES, cache=None):
+    """
+    与 process_directory 相同，但音频来自批处理脚本 --shards 模式写出的 tar 分片 (root_dir/shards)。
+    eval.jsonl 仍写到 root_dir/场景/ 下，audio_path 记录为目录模式下对应的路径。
+    """
+    print(f"开始批量处理分片: {os.path.join(root_dir, SHARDS_DIRNAME)}")
+    if not API_KEY or "sk-xxx" in API_KEY:
+        print("\n[警告] 未找到有效的 API Key，请设置 DASHSCOPE_API_KEY 环境变量或在代码中提供。")
+        return
 
-    # 开始批量处理
-    process_directory(root_dir)
+    client = QwenASRClient(API_KEY, rate=rate, max_retries=max_retries, cache=cache)
+    reader = ShardReader(os.path.join(root_dir, SHARDS_DIRNAME))
+    # 各线程共用 reader 的文件句柄，读取时需要加锁
+    read_lock = threading.Lock()
+
+    def recognize_shard_member(name: str) -> str:
+        """API 只接受文件路径，因此先把分片成员写入一个临时文件再转录，完成后删除。"""
+        with read_lock:
+            data = reader.read(name)
+        fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(name)[1])
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            return client.recognize(tmp_path, digest=content_hash(data) if cache is not None else None)
+        finally:
+            os.remove(tmp_path)
+
+    groups = {}
+    for name in reader.names():
+        parts = name.split("/")
+        if len(parts) == 3:
+            groups.setdefault(parts[0], {}).setdefault(parts[1], []).append(name)
+
+    for sub_dir, inputs in groups.items():
+        sub_dir_path = os.path.join(root_dir, sub_dir)
+        os.makedirs(sub_dir_path, exist_ok=True)
+        eval_file_path = os.path.join(sub_dir_path, 'eval.jsonl')
+        items = [(os.path.join(root_dir, name), third_level_dir, name)
+                 for third_level_dir, names in inputs.items() for name in names]
+        print(f"\n--- 开始处理任务: {sub_dir} ({len(items)} 个文件) ---")
+        stats = transcribe_to_eval(items, eval_file_path, recognize_shard_member, workers)
+        _report(sub_dir, eval_file_path, stats)
+    reader.close()
 
-    print("\n所有任务处理完毕！")
\ No newline at end of file
+
+if __name__ == "__main__":
+    # 用法: python evaluation/qwen_batch.py [根目录] [--rate=每秒请求数] [--workers=并发数] [--retries=N] [--asr-cache=路径] [--asr-cache-mb=N] [--no-asr-cache]
+    cache, argv = parse_cache_args(sys.argv[1:])
+    root_dir, rate, workers, max_retries = parse_client_args(argv, "data_output_composer/")
+
+    # 开始批量处理 (输出写入了分片时直接从分片读取)
+    if has_shards(root_dir):
+        process_shards(root_dir, rate, workers, max_retries, cache)
+    else:
+        process_directory(root_dir, rate, workers, max_retries, cache)
+
+    print(cache.summary())
+    cache.close()
+    print("\n所有任务处理完毕！")
@@ -0,0 +1,199 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http import HTTPStatus
+
+import dashscope
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from evaluation.asr_cache import content_hash
+from evaluation.run_eval import load_done_paths, open_for_append
+
+# --- 默认并发与流控参数 (按账号的 QPS 配额调整) ---
+DEFAULT_RATE = float(os.getenv("QWEN_ASR_RPS", "5"))  # 每秒请求数
+DEFAULT_WORKERS = 8
+DEFAULT_MAX_RETRIES = 5
+# 指数退避: 第 n 次重试前等待 min(BASE * 2^n, MAX) 秒，再乘以 [0.5, 1) 的随机抖动
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+
+MODEL_NAME = "qwen3-asr-flash"
+ASR_OPTIONS = {"enable_lid": True, "enable_itn": True}
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶：每秒补充 rate 个令牌，最多积攒 burst 个。每个请求前取一个令牌，取不到时等待。
+    """
+
+    def __init__(self, rate: float, burst: int = None):
+        if rate <= 0:
+            raise ValueError(f"速率必须为正数，收到 {rate}")
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def _is_retryable(response) -> bool:
+    """限流 (429 / Throttling.*) 与服务端错误 (5xx) 可以重试；参数错误等其他失败重试也不会成功。"""
+    code = str(getattr(response, "code", "") or "")
+    return (response.status_code == HTTPStatus.TOO_MANY_REQUESTS
+            or code.startswith("Throttling")
+            or response.status_code >= 500)
+
+
+class QwenASRClient:
+    """
+    并发调用 Qwen3-ASR 的客户端：所有线程共用一个令牌桶限制请求速率，限流与临时错误按指数退避重试。
+
+    用法:
+    client = QwenASRClient(API_KEY, rate=10, cache=ASRCache())
+    text = client.recognize("a.wav")   # 失败时返回 None
+
+    传入 cache (evaluation.asr_cache.ASRCache) 时先按音频内容查缓存，命中的文件不发出请求，也不占用速率配额。
+    """
+
+    def __init__(self, api_key: str, rate: float = DEFAULT_RATE, max_retries: int = DEFAULT_MAX_RETRIES,
+                 model: str = MODEL_NAME, cache=None):
+        self.api_key = api_key
+        self.bucket = TokenBucket(rate)
+        self.max_retries = max_retries
+        self.model = model
+        self.cache = cache
+
+    def _call(self, audio_file_path: str):
+        messages = [
+            {"role": "system", "content": [{"text": ""}]},
+            {"role": "user", "content": [{"audio": f"file://{os.path.abspath(audio_file_path)}"}]}
+        ]
+        return dashscope.MultiModalConversation.call(
+            model=self.model,
+            messages=messages,
+            api_key=self.api_key,
+            result_format="message",
+            asr_options=ASR_OPTIONS
+        )
+
+    def recognize(self, audio_file_path: str, digest: str = None):
+        """
+        转录单个本地音频文件。成功则返回识别的文本，重试用尽或遇到不可重试的错误时返回 None。
+        digest 为音频内容哈希，省略时由文件计算 (仅在启用缓存时需要)。
+        """
+        if self.cache is None:
+            return self._recognize(audio_file_path)
+        return self.cache.lookup(lambda: self._recognize(audio_file_path),
+                                 digest or content_hash(audio_file_path), "qwen", self.model, ASR_OPTIONS)
+
+    def _recognize(self, audio_file_path: str):
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                response = self._call(audio_file_path)
+            except Exception as e:
+                # 网络异常等同于临时错误
+                error, retryable = f"{type(e).__name__}: {e}", True
+            else:
+                if response.status_code == HTTPStatus.OK:
+                    return response.output.choices[0].message.content[0]['text'].strip()
+                error, retryable = f"Code: {response.code}, Message: {response.message}", _is_retryable(response)
+
+            if not retryable or attempt == self.max_retries:
+                print(f"[API_ERROR] 文件 '{audio_file_path}' 转录失败: {error}")
+                return None
+            time.sleep(min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX) * random.uniform(0.5, 1.0))
+        return None
+
+
+def transcribe_to_eval(items: list, eval_file_path: str, recognize, workers: int = DEFAULT_WORKERS) -> dict:
+    """
+    并发转录 items 并以追加方式写入 eval_file_path，已在文件中的 audio_path 直接跳过。
+    每条结果完成后立即写入并 flush，中途崩溃只会丢失正在进行的请求；重新运行即可从断点继续。
+    转录失败的条目不写入文件，下次运行时会重试。
+
+    参数:
+    items (list): (audio_path, original_key, source) 的列表，source 为传给 recognize 的参数。
+    eval_file_path (str): 输出的 eval.jsonl 路径。
+    recognize (callable): recognize(source) -> 文本或 None，通常为 QwenASRClient.recognize。
+    workers (int): 并发请求的线程数 (实际速率仍受令牌桶限制)。
+
+    返回:
+    dict: {"done": 本次写入数, "skipped": 已存在而跳过数, "failed": 失败数}。
+    """
+    done_paths = load_done_paths(eval_file_path)
+    todo = [item for item in items if item[0] not in done_paths]
+    stats = {"done": 0, "skipped": len(items) - len(todo), "failed": 0}
+    if not todo:
+        return stats
+
+    with open_for_append(eval_file_path) as eval_file, ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(recognize, source): (audio_path, original_key)
+                   for audio_path, original_key, source in todo}
+        for future in as_completed(futures):
+            audio_path, original_key = futures[future]
+            try:
+                text = future.result()
+            except Exception as e:
+                print(f"[EXCEPTION] 转录 '{audio_path}' 时发生异常: {e}")
+                text = None
+            if text is None:
+                stats["failed"] += 1
+                continue
+            record = {
+                "audio_path": audio_path,
+                "response": text,
+                "original_key": original_key
+            }
+            eval_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            eval_file.flush()
+            stats["done"] += 1
+    return stats
+
+
+def collect_directory_items(sub_dir_path: str, extensions=('.wav', '.flac')) -> list:
+    """收集一个二级目录 (场景) 下各三级子文件夹中的音频，返回 (audio_path, original_key, audio_path) 列表。"""
+    items = []
+    for third_level_dir in sorted(os.listdir(sub_dir_path)):
+        third_level_dir_path = os.path.join(sub_dir_path, third_level_dir)
+        if not os.path.isdir(third_level_dir_path):
+            continue
+        for audio_file in sorted(os.listdir(third_level_dir_path)):
+            if audio_file.lower().endswith(extensions):
+                audio_file_path = os.path.join(third_level_dir_path, audio_file)
+                items.append((audio_file_path, third_level_dir, audio_file_path))
+    return items
+
+
+def parse_client_args(argv, root_dir: str):
+    """
+    解析脚本的公共参数: [根目录] [--rate=每秒请求数] [--workers=并发数] [--retries=最大重试次数]。
+    返回 (root_dir, rate, workers, max_retries)。
+    """
+    rate, workers, max_retries = DEFAULT_RATE, DEFAULT_WORKERS, DEFAULT_MAX_RETRIES
+    for arg in argv:
+        if arg.startswith('--rate='):
+            rate = float(arg.split('=', 1)[1])
+        elif arg.startswith('--workers='):
+            workers = max(1, int(arg.split('=', 1)[1]))
+        elif arg.startswith('--retries='):
+            max_retries = max(0, int(arg.split('=', 1)[1]))
+        else:
+            root_dir = arg
+    return root_dir, rate, workers, max_retries
@@ -0,0 +1,262 @@
+import json
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from evaluation.edit_distance import batch_error_counts
+from evaluation.truth_eval import normalize_text
+from pipeline.parallel import parse_workers_arg, run_jobs
+
+# --- 默认路径 ---
+DEFAULT_ROOT = "data_output_grid"
+DEFAULT_TRUTH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "truth.jsonl")
+EVAL_NAME = "eval.jsonl"
+
+# 网格输出文件名中的核心参数档位 (如 "room_size-low_cutoff_hz-high") 与倍速后缀 (如 "_speed_0.50x")
+_LEVEL_PATTERN = re.compile(r"([A-Za-z0-9_]+?)-(low|mid|high)(?:_|$)")
+_SPEED_PATTERN = re.compile(r"_speed_(\d+(?:\.\d+)?)x$")
+
+# 每个分组的统计: [替换, 删除, 插入, 参考词数, 参考字数, 字符级错误数, 条数]
+_FIELDS = ("substitutions", "deletions", "insertions", "words", "chars", "char_errors", "utterances")
+
+_truth_index = {}
+
+
+def load_truth_index(truth_file_path: str) -> dict:
+    """读取 truth.jsonl 为 {original_key: 标准化后的参考文本} 的内存索引。"""
+    index = {}
+    with open(truth_file_path, 'r', encoding='utf-8') as f_truth:
+        for line in f_truth:
+            if line.strip():
+                record = json.loads(line)
+                index[record["original_key"]] = normalize_text(record["response"])
+    return index
+
+
+def init_worker(truth_file_path: str) -> None:
+    """执行进程的初始化函数：每个进程加载一次参考文本索引。"""
+    global _truth_index
+    _truth_index = load_truth_index(truth_file_path)
+
+
+def load_done_paths(eval_file_path: str) -> set:
+    """读取已有 eval.jsonl 中记录过的 audio_path (供断点续跑跳过)。中断时写了一半的最后一行会被忽略。"""
+    done = set()
+    if not os.path.exists(eval_file_path):
+        return done
+    with open(eval_file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["audio_path"])
+            except (ValueError, KeyError):
+                continue
+    return done
+
+
+def open_for_append(eval_file_path: str):
+    """以追加模式打开 eval.jsonl；上次中断留下不完整的最后一行时先补一个换行，新记录不会接在它后面。"""
+    needs_newline = False
+    if os.path.exists(eval_file_path) and os.path.getsize(eval_file_path) > 0:
+        with open(eval_file_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+    eval_file = open(eval_file_path, 'a', encoding='utf-8')
+    if needs_newline:
+        eval_file.write("\n")
+    return eval_file
+
+
+def find_eval_files(root_dir: str) -> list:
+    """找出 root_dir 下所有的 eval.jsonl，按路径排序。"""
+    found = []
+    for directory, _, files in os.walk(root_dir):
+        if EVAL_NAME in files:
+            found.append(os.path.join(directory, EVAL_NAME))
+    return sorted(found)
+
+
+def parse_levels(audio_path: str, original_key: str):
+    """
+    从网格输出的文件名解析核心参数档位与倍速。
+
+    例如 "human_1_cutoff_hz-low_room_size-high_speed_0.50x.wav" (original_key 为 "human_1")
+    解析为 ([("cutoff_hz", "low"), ("room_size", "high")], "0.50")。没有倍速后缀时倍速为 None。
+    """
+    stem = os.path.splitext(os.path.basename(audio_path))[0]
+    if original_key and stem.startswith(original_key + "_"):
+        stem = stem[len(original_key) + 1:]
+    speed = None
+    match = _SPEED_PATTERN.search(stem)
+    if match:
+        speed = match.group(1)
+        stem = stem[:match.start()]
+    return _LEVEL_PATTERN.findall(stem), speed
+
+
+def _add(groups, key, values):
+    totals = groups.setdefault(key, [0] * len(_FIELDS))
+    for k, value in enumerate(values):
+        totals[k] += value
+
+
+class WERAggregator:
+    """
+    在线累计 WER / CER：每次加入一批 (参考, 识别结果)，按场景、核心参数档位与倍速累加错误数，不保留文本。
+
+    groups 的键为 "scene"、"scene|参数|档位" 与 "scene|speed|倍速"，值为 _FIELDS 各项的累计值；
+    多个聚合器 (例如各进程的结果) 可以用 merge 合并。
+    """
+
+    def __init__(self):
+        self.groups = {}
+        self.missing = 0
+
+    def add(self, scene: str, truths: list, responses: list, keys: list) -> None:
+        """
+        加入一批已标准化的文本 (见 truth_eval.normalize_text)。
+
+        参数:
+        truths / responses (list[str]): 参考文本与识别结果，一一对应。
+        keys (list[tuple[list, str | None]]): 每条的 ([(参数, 档位), ...], 倍速)，见 parse_levels。
+        """
+        word_counts = batch_error_counts(truths, responses, "word")
+        char_counts = batch_error_counts(truths, responses, "char")
+        for (levels, speed), words, chars in zip(keys, word_counts, char_counts):
+            values = (words.substitutions, words.deletions, words.insertions, words.reference_length,
+                      chars.reference_length, chars.errors, 1)
+            _add(self.groups, scene, values)
+            for param, level in levels:
+                _add(self.groups, f"{scene}|{param}|{level}", values)
+            if speed is not None:
+                _add(self.groups, f"{scene}|speed|{speed}", values)
+
+    def merge(self, groups: dict, missing: int = 0) -> None:
+        for key, totals in groups.items():
+            _add(self.groups, key, totals)
+        self.missing += missing
+
+    def summary(self) -> dict:
+        return summarize(self.groups)
+
+
+def score_eval_file(job: dict):
+    """
+    为一个 eval.jsonl 打分 (run_jobs 的任务函数)。参考文本按 original_key 从内存索引中查找，不改写文件。
+
+    返回:
+    dict: {"groups": WERAggregator.groups, "missing": 缺少参考或识别结果的记录数}。
+    """
+    truths, responses, keys = [], [], []
+    missing = 0
+    with open(job["eval_path"], 'r', encoding='utf-8') as f_eval:
+        for line in f_eval:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 中断的转录运行可能留下写了一半的行
+                missing += 1
+                continue
+            original_key = record.get("original_key", "")
+            truth = _truth_index.get(original_key)
+            if truth is None:
+                # 兼容已由 add_truth_to_eval 写入 truth 字段的旧文件
+                truth = normalize_text(record.get("truth", ""))
+            response = normalize_text(record.get("response", ""))
+            if not truth or not response:
+                missing += 1
+                continue
+            truths.append(truth)
+            responses.append(response)
+            keys.append(parse_levels(record.get("audio_path", ""), original_key))
+
+    aggregator = WERAggregator()
+    aggregator.add(job["scene"], truths, responses, keys)
+    return {"groups": aggregator.groups, "missing": missing}
+
+
+def _rates(totals):
+    stats = dict(zip(_FIELDS, totals))
+    errors = stats["substitutions"] + stats["deletions"] + stats["insertions"]
+    stats["wer"] = errors / stats["words"] if stats["words"] else 0.0
+    stats["cer"] = stats["char_errors"] / stats["chars"] if stats["chars"] else 0.0
+    return stats
+
+
+def summarize(groups: dict) -> dict:
+    """把分组统计整理为 {场景: {"overall": 指标, "levels": {参数: {档位: 指标}}}}，指标含语料级 WER / CER。"""
+    summary = {}
+    for key in sorted(groups):
+        parts = key.split("|")
+        scene = summary.setdefault(parts[0], {"overall": None, "levels": {}})
+        if len(parts) == 1:
+            scene["overall"] = _rates(groups[key])
+        else:
+            scene["levels"].setdefault(parts[1], {})[parts[2]] = _rates(groups[key])
+    return summary
+
+
+def print_summary(summary: dict) -> None:
+    level_order = {"low": 0, "mid": 1, "high": 2}
+    for scene, result in summary.items():
+        overall = result["overall"]
+        print(f"\n=== {scene}: WER {overall['wer']:.4f}  CER {overall['cer']:.4f}  "
+              f"({overall['utterances']} 条, S={overall['substitutions']} D={overall['deletions']} I={overall['insertions']}) ===")
+        for param, levels in result["levels"].items():
+            cells = "  ".join(f"{level}: {levels[level]['wer']:.4f}"
+                              for level in sorted(levels, key=lambda name: level_order.get(name, name)))
+            print(f"  {param:<24} {cells}")
+
+
+def run_evaluation(root_dir: str, truth_file_path: str = DEFAULT_TRUTH, workers: int = 1) -> dict:
+    """
+    找出 root_dir 下所有 eval.jsonl 并行打分，返回按场景与核心参数档位汇总的结果 (见 summarize)。
+    场景名取 eval.jsonl 所在目录相对于 root_dir 的路径。
+    """
+    jobs = [{"eval_path": path,
+             "scene": os.path.relpath(os.path.dirname(path), root_dir).replace(os.sep, "/"),
+             "label": path} for path in find_eval_files(root_dir)]
+    if not jobs:
+        print(f"错误：在 '{root_dir}' 下未找到任何 {EVAL_NAME}。")
+        return {}
+    print(f"找到 {len(jobs)} 个 {EVAL_NAME}。")
+
+    aggregator = WERAggregator()
+    run_jobs(score_eval_file, jobs, workers, initializer=init_worker, initargs=(truth_file_path,),
+             on_result=lambda job, result: aggregator.merge(result["groups"], result["missing"]))
+    print(f"[INFO] 缺少参考文本或识别结果的记录数: {aggregator.missing}")
+    return aggregator.summary()
+
+
+def main():
+    """
+    用法: python evaluation/run_eval.py [输出根目录] [--truth=truth.jsonl] [--workers=N] [--summary=summary.json]
+    """
+    root_dir = DEFAULT_ROOT
+    truth_file_path = DEFAULT_TRUTH
+    workers = 1
+    summary_path = None
+    for arg in sys.argv[1:]:
+        if arg.startswith('--truth='):
+            truth_file_path = arg.split('=', 1)[1]
+        elif arg.startswith('--workers='):
+            workers = parse_workers_arg(arg)
+        elif arg.startswith('--summary='):
+            summary_path = arg.split('=', 1)[1]
+        else:
+            root_dir = arg
+
+    summary = run_evaluation(root_dir, truth_file_path, workers)
+    if not summary:
+        return
+    print_summary(summary)
+    if summary_path:
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"\n汇总结果已保存至: {summary_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,17 @@
 import json
 import os
+import sys
 from typing import Dict
 import re
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from evaluation.edit_distance import ErrorCounts, batch_error_counts, wer
+
+# 中英文标点符号，这个正则表达式涵盖了大部分中英文标点 (模块加载时编译一次)
+PUNCTUATION = r"""!"#$%&'()*+,-./:;<=>?@[\]^_`{|}~，。！？；：（）—·《》“”‘’…"""
+_PUNCTUATION_PATTERN = re.compile(f"[{re.escape(PUNCTUATION)}]")
+_SPACE_PATTERN = re.compile(r'\s+')
+
 
 def normalize_text(text: str) -> str:
     """
@@ -15,37 +24,20 @@ def normalize_text(text: str) -> str:
     text = text.lower()
 
     # 移除中英文标点符号
-    # 这个正则表达式涵盖了大部分中英文标点
-    punctuation = r"""!"#$%&'()*+,-./:;<=>?@[\]^_`{|}~，。！？；：（）—·《》“”‘’…"""
-    text = re.sub(f"[{re.escape(punctuation)}]", "", text)
+    text = _PUNCTUATION_PATTERN.sub("", text)
 
     # 将多个连续空格替换为单个空格
-    text = re.sub(r'\s+', ' ', text).strip()
+    text = _SPACE_PATTERN.sub(' ', text).strip()
 
     return text
 
 # 计算WER（Word Error Rate）等评价指标的函数
 def calculate_wer(reference: str, hypothesis: str) -> float:
     """
-    计算 Word Error Rate (WER)
+    计算 Word Error Rate (WER)。
+    中日韩文字逐字计为一个词 (见 evaluation/edit_distance.py)，英文仍按空格分词。
     """
-    ref_words = reference.split()
-    hyp_words = hypothesis.split()
-    # 动态规划计算编辑距离
-    d = [[0] * (len(hyp_words) + 1) for _ in range(len(ref_words) + 1)]
-    
-    for i in range(len(ref_words) + 1):
-        for j in range(len(hyp_words) + 1):
-            if i == 0:
-                d[i][j] = j
-            elif j == 0:
-                d[i][j] = i
-            else:
-                cost = 0 if ref_words[i-1] == hyp_words[j-1] else 1
-                d[i][j] = min(d[i-1][j] + 1, d[i][j-1] + 1, d[i-1][j-1] + cost)
-
-    wer = d[len(ref_words)][len(hyp_words)] / len(ref_words)
-    return wer
+    return wer(reference, hypothesis)
 
 # 增加truth字段到eval.jsonl的函数
 def add_truth_to_eval(eval_file_path: str, truth_file_path: str) -> None:
@@ -93,9 +85,10 @@ def add_truth_to_eval(eval_file_path: str, truth_file_path: str) -> None:
 def evaluate_asr_metrics(eval_file_path: str) -> Dict[str, float]:
     """
     计算 eval.jsonl 中的 ASR 评估指标（WER 等）。
+    所有记录先读入再一次批量计算编辑距离，除逐条平均的 avg_wer 外还给出语料级的 WER / CER 与 S/D/I 计数。
     """
-    wer_total = 0
-    num_records = 0
+    truths = []
+    responses = []
     missing_wer_count = 0
 
     with open(eval_file_path, 'r', encoding='utf-8') as f_eval:
@@ -103,27 +96,30 @@ def evaluate_asr_metrics(eval_file_path: str) -> Dict[str, float]:
             eval_record = json.loads(line.strip())
 
             # 先进行标准化处理
-
-
-            response = eval_record.get("response", "")
-            truth = eval_record.get("truth", "")
-
-            response = normalize_text(response)
-            truth = normalize_text(truth)
+            response = normalize_text(eval_record.get("response", ""))
+            truth = normalize_text(eval_record.get("truth", ""))
 
             if truth and response:
-                wer = calculate_wer(truth, response)
-                wer_total += wer
-                num_records += 1
+                truths.append(truth)
+                responses.append(response)
             else:
                 missing_wer_count += 1
 
-    avg_wer = wer_total / num_records if num_records > 0 else 0.0
+    word_counts = batch_error_counts(truths, responses, "word")
+    char_counts = batch_error_counts(truths, responses, "char")
+    num_records = len(word_counts)
+    corpus = sum(word_counts, ErrorCounts())
+    corpus_chars = sum(char_counts, ErrorCounts())
 
     print(f"[INFO] 没有成功计算WER的记录数: {missing_wer_count}")
 
     return {
-        "avg_wer": avg_wer,
+        "avg_wer": sum(c.error_rate for c in word_counts) / num_records if num_records > 0 else 0.0,
+        "corpus_wer": corpus.error_rate,
+        "corpus_cer": corpus_chars.error_rate,
+        "substitutions": corpus.substitutions,
+        "deletions": corpus.deletions,
+        "insertions": corpus.insertions,
         "total_records": num_records
     }
 
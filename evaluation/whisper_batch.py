@@ -1,72 +1,297 @@
 import os
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import whisper
 import torch
 import json
+import librosa
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from evaluation.asr_cache import cache_key, content_hash, parse_cache_args
+from pipeline.sinks import SHARDS_DIRNAME, ShardReader, has_shards
+
+MODEL_NAME = "turbo"
+SAMPLE_RATE = whisper.audio.SAMPLE_RATE
+AUDIO_EXTENSIONS = ('.wav', '.flac')
+DEFAULT_BATCH_SIZE = 16
+DEFAULT_PREFETCH_WORKERS = 4
+# 解码线程最多领先模型推理的批数
+_PREFETCH_BATCHES = 2
+# 与 model.transcribe 的默认阈值相同：压缩比过高 (重复) 或平均对数概率过低时需要升温重解，
+# 无语音概率高且对数概率低的窗口视为静音
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+
+
+def load_audio(source):
+    """
+    用 soundfile 直接解码音频 (路径或文件对象)，混为单声道并重采样到 16 kHz。
+    与 whisper.load_audio 不同，不为每个文件启动 ffmpeg 子进程。
+    """
+    y, sr = sf.read(source, dtype='float32', always_2d=True)
+    y = y.mean(axis=1)
+    if sr != SAMPLE_RATE:
+        y = librosa.resample(y, orig_sr=sr, target_sr=SAMPLE_RATE)
+    return y
+
+
+def log_mel_batch(audio: torch.Tensor, n_mels: int) -> torch.Tensor:
+    """
+    一次计算一批 (batch, N_SAMPLES) 音频的 log-mel 频谱，与逐条调用 whisper.log_mel_spectrogram 的结果相同：
+    动态范围的截断 (最大值以下 8) 按每条音频各自的最大值计算，而不是整批的最大值。
+    """
+    window = torch.hann_window(whisper.audio.N_FFT, device=audio.device)
+    stft = torch.stft(audio, whisper.audio.N_FFT, whisper.audio.HOP_LENGTH, window=window, return_complex=True)
+    magnitudes = stft[..., :-1].abs() ** 2
+    mel_spec = whisper.audio.mel_filters(audio.device, n_mels) @ magnitudes
+    log_spec = torch.clamp(mel_spec, min=1e-10).log10()
+    log_spec = torch.maximum(log_spec, log_spec.amax(dim=(1, 2), keepdim=True) - 8.0)
+    return (log_spec + 4.0) / 4.0
+
+
+def cache_options(model: whisper.Whisper) -> dict:
+    """
+    transcribe_batch 结果的缓存选项 (计入缓存键)。"fallback" 区分加入升温重解之前缓存的批量解码结果，
+    这些旧条目不再被使用。
+    """
+    return {"decode": "batch", "fallback": True, "fp16": model.device.type == "cuda"}
 
-def process_directory(root_dir: str, model: whisper.Whisper):
+
+def transcribe_batch(model: whisper.Whisper, audios: list, language=None) -> list:
+    """
+    转录一批已解码的 16 kHz 音频，返回与 audios 对应的文本列表。
+    不超过 30 秒的音频补零后一起提取 log-mel 并由 whisper.decode 在温度 0 下成批解码 (每条各自检测语种)，
+    再按 model.transcribe 的规则逐条检查结果：
+    - 压缩比 > 2.4 或平均对数概率 < -1.0 (例如退化音频上的重复循环) 的音频交给 model.transcribe，
+      由它从温度 0 开始逐级升温重解，结果与 model.transcribe 相同；
+    - 无语音概率 > 0.6 且平均对数概率不高于 -1.0 的音频与 model.transcribe 一样视为静音，文本为空。
+    因此升温重解与静音判定都与逐条调用 model.transcribe 的基线相同，只有温度 0 即通过检查的音频采用批量解码的结果
+    (与 model.transcribe 的第一遍解码相同，只是不再按时间戳把 30 秒窗口切分为多段)。
+    更长的音频需要按窗口滑动，仍逐条交给 model.transcribe。fp16 只在 GPU 上启用，CPU 上以 fp32 运行。
+    """
+    fp16 = model.device.type == "cuda"
+    texts = [""] * len(audios)
+    short = [k for k, audio in enumerate(audios) if len(audio) <= whisper.audio.N_SAMPLES]
+    fallback = [k for k, audio in enumerate(audios) if len(audio) > whisper.audio.N_SAMPLES]
+    if short:
+        batch = np.stack([whisper.pad_or_trim(audios[k]) for k in short])
+        mel = log_mel_batch(torch.from_numpy(batch).to(model.device), model.dims.n_mels)
+        options = whisper.DecodingOptions(language=language, fp16=fp16, temperature=0.0)
+        for k, result in zip(short, whisper.decode(model, mel, options)):
+            if _needs_fallback(result):
+                fallback.append(k)
+            elif not _is_silence(result):
+                texts[k] = result.text.strip()
+    for k in sorted(fallback):
+        texts[k] = model.transcribe(audios[k], language=language, fp16=fp16).get('text', '').strip()
+    return texts
+
+
+def _needs_fallback(result) -> bool:
+    """model.transcribe 在温度 0 的这个结果上是否会升温重解 (静音窗口除外)。"""
+    if result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob < LOGPROB_THRESHOLD:
+        return False
+    return result.compression_ratio > COMPRESSION_RATIO_THRESHOLD or result.avg_logprob < LOGPROB_THRESHOLD
+
+
+def _is_silence(result) -> bool:
+    """model.transcribe 是否会把这个窗口当作静音跳过。"""
+    return result.no_speech_prob > NO_SPEECH_THRESHOLD and not result.avg_logprob > LOGPROB_THRESHOLD
+
+
+def transcribe_clips(model: whisper.Whisper, clips: list, batch_size: int = DEFAULT_BATCH_SIZE,
+                     prefetch_workers: int = DEFAULT_PREFETCH_WORKERS, cache=None, model_name: str = MODEL_NAME) -> list:
+    """
+    成批转录多个音频，返回与 clips 对应的文本列表 (失败的为空字符串)。
+
+    参数：
+        clips: (名称, 长度, 加载函数, 哈希函数) 的列表。长度只用于排序，可以是字节数等近似值；
+               加载函数无参数，返回 16 kHz 音频；哈希函数无参数，返回音频内容哈希 (仅在启用缓存时调用)。
+        batch_size: 每批送入模型的音频数。
+        prefetch_workers: 解码线程数。线程在模型推理当前批时预先解码后续的批。
+        cache: ASRCache，命中的音频不再解码和转录。
+        model_name: 模型名，计入缓存键。
+
+    音频按长度排序后分批 (分桶)，同一批内的音频长度相近：成批解码要等批内最长的一条结束，
+    长度相近时各条的解码步数也相近，浪费的计算最少。
+    """
+    texts = [""] * len(clips)
+    keys = [None] * len(clips)
+    todo = range(len(clips))
+    if cache is not None:
+        options = cache_options(model)
+        todo = []
+        for k, clip in enumerate(clips):
+            keys[k] = cache_key(clip[3](), "whisper", model_name, options)
+            text = cache.get(keys[k])
+            if text is None:
+                todo.append(k)
+            else:
+                texts[k] = text
+
+    order = sorted(todo, key=lambda k: clips[k][1])
+    batches = [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(1, prefetch_workers)) as pool:
+        pending = deque()
+        for batch in batches[:_PREFETCH_BATCHES]:
+            pending.append((batch, [pool.submit(clips[k][2]) for k in batch]))
+        next_batch = len(pending)
+        while pending:
+            batch, futures = pending.popleft()
+            if next_batch < len(batches):
+                pending.append((batches[next_batch], [pool.submit(clips[k][2]) for k in batches[next_batch]]))
+                next_batch += 1
+
+            ready, audios = [], []
+            for k, future in zip(batch, futures):
+                try:
+                    audios.append(future.result())
+                    ready.append(k)
+                except Exception as e:
+                    print(f"[ERROR] 解码失败: {clips[k][0]} -> {e}")
+            if not audios:
+                continue
+            try:
+                for k, text in zip(ready, transcribe_batch(model, audios)):
+                    texts[k] = text
+                    if cache is not None:
+                        cache.put(keys[k], text)
+            except Exception as e:
+                print(f"[ERROR] 转录失败: {', '.join(clips[k][0] for k in ready)} -> {e}")
+    return texts
+
+
+def write_eval_file(eval_file_path: str, records: list, texts: list) -> None:
+    """把 (audio_path, original_key) 与对应的转录文本写成 eval.jsonl。"""
+    with open(eval_file_path, 'w', encoding='utf-8') as eval_file:
+        for (audio_path, original_key), text in zip(records, texts):
+            record = {
+                "audio_path": audio_path,
+                "response": text,
+                "original_key": original_key
+            }
+            eval_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def process_directory(root_dir: str, model: whisper.Whisper, batch_size: int = DEFAULT_BATCH_SIZE,
+                      prefetch_workers: int = DEFAULT_PREFETCH_WORKERS, cache=None, model_name: str = MODEL_NAME):
     """
     遍历给定根目录（root_dir），对每个二级子目录（对应不同的音频组）进行处理，生成 eval.jsonl。
-    
+    每个二级子目录下的所有音频一起成批转录 (见 transcribe_clips)。
+
     参数：
         root_dir: 包含音频的根目录。
         model: Whisper 模型，用于音频转录。
+        batch_size: 每批送入模型的音频数。
+        prefetch_workers: 预先解码音频的线程数。
+        cache: ASRCache，内容相同的音频直接使用缓存的结果。
+        model_name: 模型名，计入缓存键。
     """
-    count_sub=0
     # 遍历每个二级文件夹（每个子文件夹即为一个任务）
     for sub_dir in os.listdir(root_dir):
         sub_dir_path = os.path.join(root_dir, sub_dir)
-        # 构建 eval.jsonl 文件路径，保存到二级文件夹下
-        eval_file_path = os.path.join(sub_dir_path, 'eval.jsonl')
-        count=0
-        # 确保这是一个文件夹
-        if os.path.isdir(sub_dir_path):
-            # 获取该二级文件夹下的所有三级子文件夹
-            for third_level_dir in os.listdir(sub_dir_path):
-                third_level_dir_path = os.path.join(sub_dir_path, third_level_dir)
-                
-                # 确保是三级子文件夹，且包含音频文件
-                if os.path.isdir(third_level_dir_path):
-                    audio_files = [f for f in os.listdir(third_level_dir_path) if f.lower().endswith('.wav')]
-                    if audio_files:
-
-                        # 打开 eval.jsonl 文件以写入
-                        write_mode = 'w' if count==0 else 'a'
-                        count+=1
-                        with open(eval_file_path, write_mode, encoding='utf-8') as eval_file:
-                            for audio_file in audio_files:
-                                audio_file_path = os.path.join(third_level_dir_path, audio_file)
-                                
-                                # 转录音频文件
-                                try:
-                                    result = model.transcribe(audio_file_path)
-                                    text = result.get('text', '').strip()
-                                except Exception as e:
-                                    print(f"[ERROR] 转录失败: {audio_file_path} -> {e}")
-                                    text = ""
-                                
-                                # 生成 JSON 记录
-                                record = {
-                                    "audio_path": audio_file_path,
-                                    "response": text,
-                                    "original_key": third_level_dir  # 这里的 original_key 就是三级文件夹名
-                                }
-
-                                # 写入一行 JSON 数据
-                                eval_file.write(json.dumps(record, ensure_ascii=False) + "\n")
-
-                        print(f"[OK] 处理完成: {third_level_dir_path}")
+        if not os.path.isdir(sub_dir_path):
+            continue
+        records, clips = [], []
+        # 三级子文件夹名即为 original_key
+        for third_level_dir in os.listdir(sub_dir_path):
+            third_level_dir_path = os.path.join(sub_dir_path, third_level_dir)
+            if not os.path.isdir(third_level_dir_path):
+                continue
+            for audio_file in os.listdir(third_level_dir_path):
+                if audio_file.lower().endswith(AUDIO_EXTENSIONS):
+                    audio_file_path = os.path.join(third_level_dir_path, audio_file)
+                    records.append((audio_file_path, third_level_dir))
+                    clips.append((audio_file_path, os.path.getsize(audio_file_path),
+                                  lambda path=audio_file_path: load_audio(path),
+                                  lambda path=audio_file_path: content_hash(path)))
+        if not clips:
+            continue
+
+        texts = transcribe_clips(model, clips, batch_size, prefetch_workers, cache, model_name)
+        write_eval_file(os.path.join(sub_dir_path, 'eval.jsonl'), records, texts)
+        print(f"[OK] 处理完成: {sub_dir_path} ({len(clips)} 个文件)")
+
+
+def group_shard_members(reader):
+    """把分片成员名 ("场景/输入/文件") 按 {场景: {输入: [成员名]}} 分组，与目录模式的二、三级文件夹对应。"""
+    groups = {}
+    for name in reader.names():
+        parts = name.split("/")
+        if len(parts) == 3:
+            groups.setdefault(parts[0], {}).setdefault(parts[1], []).append(name)
+    return groups
+
+
+def process_shards(root_dir: str, model: whisper.Whisper, batch_size: int = DEFAULT_BATCH_SIZE,
+                   prefetch_workers: int = DEFAULT_PREFETCH_WORKERS, cache=None, model_name: str = MODEL_NAME):
+    """
+    与 process_directory 相同，但音频来自批处理脚本 --shards 模式写出的 tar 分片 (root_dir/shards)。
+    成员按索引直接读取并在内存中解码，不解包到磁盘；eval.jsonl 仍写到 root_dir/场景/ 下，
+    audio_path 记录为目录模式下对应的路径。
+    """
+    reader = ShardReader(os.path.join(root_dir, SHARDS_DIRNAME))
+    # 解码线程共用 reader 的文件句柄，读取时需要加锁
+    read_lock = threading.Lock()
+
+    def load_member(name):
+        with read_lock:
+            member = reader.open(name)
+        return load_audio(member)
+
+    def hash_member(name):
+        with read_lock:
+            data = reader.read(name)
+        return content_hash(data)
+
+    for sub_dir, inputs in group_shard_members(reader).items():
+        sub_dir_path = os.path.join(root_dir, sub_dir)
+        os.makedirs(sub_dir_path, exist_ok=True)
+        records, clips = [], []
+        for third_level_dir, names in inputs.items():
+            for name in names:
+                records.append((os.path.join(root_dir, name), third_level_dir))
+                clips.append((name, reader.size(name), lambda name=name: load_member(name),
+                              lambda name=name: hash_member(name)))
+
+        texts = transcribe_clips(model, clips, batch_size, prefetch_workers, cache, model_name)
+        write_eval_file(os.path.join(sub_dir_path, 'eval.jsonl'), records, texts)
+        print(f"[OK] 处理完成: {sub_dir} ({len(clips)} 个文件)")
+    reader.close()
 
 
 if __name__ == "__main__":
+    # 用法: python evaluation/whisper_batch.py [根目录] [--batch-size=N] [--prefetch=N]
+    #       [--asr-cache=路径] [--asr-cache-mb=N] [--no-asr-cache]
+    root_dir = "data_output/"
+    batch_size = DEFAULT_BATCH_SIZE
+    prefetch_workers = DEFAULT_PREFETCH_WORKERS
+    cache, argv = parse_cache_args(sys.argv[1:])
+    for arg in argv:
+        if arg.startswith('--batch-size='):
+            batch_size = max(1, int(arg.split('=', 1)[1]))
+        elif arg.startswith('--prefetch='):
+            prefetch_workers = max(1, int(arg.split('=', 1)[1]))
+        else:
+            root_dir = arg
+
     # 自动选择设备：有 GPU 就用 GPU，否则用 CPU
     device = "cuda" if torch.cuda.is_available() else "cpu"
     print(f"Using device: {device}")
-    
-    # 加载 Whisper 模型
-    model = whisper.load_model("turbo", device=device)
 
-    # 根目录
-    root_dir = "data_output/"
+    # 加载 Whisper 模型 (只加载一次，所有批次共用)
+    model = whisper.load_model(MODEL_NAME, device=device)
 
-    # 批量处理
-    process_directory(root_dir, model)
+    # 批量处理 (输出写入了分片时直接从分片读取)
+    if has_shards(root_dir):
+        process_shards(root_dir, model, batch_size, prefetch_workers, cache)
+    else:
+        process_directory(root_dir, model, batch_size, prefetch_workers, cache)
+    print(cache.summary())
+    cache.close()
@@ -0,0 +1,147 @@
+import importlib
+import json
+import random
+from functools import partial
+
+import numpy as np
+
+from .fusion import FixedParams, apply_effect_chain, apply_effect_chain_batch
+
+EFFECTS_PACKAGE = "effects"
+
+
+def _build_sampler(key, spec):
+    """
+    把配置中的随机参数字典 ({"random_type": ..., ...}) 预编译为无参采样函数。
+    随机类型未知或缺少必要的键时打印警告并返回 None，参数将保持原样 (与旧的逐文件解析行为一致)。
+    """
+    rand_type = spec.get("random_type")
+    try:
+        if rand_type == "uniform":
+            return partial(random.uniform, spec["min"], spec["max"])
+        elif rand_type == "randint":
+            return partial(random.randint, spec["min"], spec["max"])
+        elif rand_type == "choice":
+            return partial(random.choice, list(spec["options"]))
+        print(f"  ⚠️ 未知的随机类型 '{rand_type}'，参数 '{key}' 将保持原样。")
+    except KeyError as e:
+        print(f"  ⚠️ 随机参数 '{key}' 缺少必要的键: {e}，将保持原样。")
+    return None
+
+
+class CompiledStep:
+    """效果链中的一步：已解析的效果模块、固定参数和随机参数采样器。"""
+
+    __slots__ = ("name", "module", "static_params", "samplers")
+
+    def __init__(self, name, module, static_params, samplers):
+        self.name = name
+        self.module = module
+        self.static_params = static_params
+        self.samplers = samplers
+
+    def sample_params(self, skip=()):
+        """
+        为一次渲染生成具体参数。采样顺序与配置中参数的书写顺序一致。
+        skip 中的参数不采样 (由调用方另行提供具体值，例如前缀树中的核心参数)。
+        没有需要采样的参数时返回 FixedParams，效果链据此复用该步骤的 pedalboard 插件。
+        """
+        if all(key in skip for key, _ in self.samplers):
+            return FixedParams(self.static_params)
+        params = dict(self.static_params)
+        for key, sampler in self.samplers:
+            if key not in skip:
+                params[key] = sampler()
+        return params
+
+
+class CompiledChain:
+    """
+    编译后的场景效果链。
+
+    编译时完成效果模块的导入、随机参数采样器的构建以及资源 (如 add_noise 的 noise_dir) 的绑定，
+    之后对每个输入只需采样参数并调用效果函数。
+    """
+
+    __slots__ = ("steps",)
+
+    def __init__(self, steps):
+        self.steps = tuple(steps)
+
+    @property
+    def names(self):
+        return [step.name for step in self.steps]
+
+    def sample_steps(self):
+        """返回 [(效果名, 效果模块, 参数)] 列表，供 apply_effect_chain 使用。"""
+        return [(step.name, step.module, step.sample_params()) for step in self.steps]
+
+    def run(self, y, sr):
+        """对一段音频采样参数并执行整条效果链。任一效果出错时返回 None。"""
+        return apply_effect_chain(y, sr, self.sample_steps())
+
+    def run_batch(self, y, sr, n_rows, row_steps=None):
+        """
+        为同一段输入一次渲染 n_rows 个副本，每个副本独立采样参数 (或使用调用方传入的 row_steps)。
+
+        返回:
+        list[np.ndarray] | None: 每个副本的处理结果；任一效果出错时返回 None。
+        """
+        if row_steps is None:
+            row_steps = [self.sample_steps() for _ in range(n_rows)]
+        return apply_effect_chain_batch(np.broadcast_to(y, (n_rows, len(y))), sr, row_steps)
+
+
+def compile_chain(effect_chain, overrides=None, resources=None, effects_package=EFFECTS_PACKAGE):
+    """
+    把 SCENE_CONFIG["effects"] 编译为 CompiledChain。
+
+    参数:
+    effect_chain (list[dict]): 场景配置中的效果链。
+    overrides (dict, optional): {效果名: {参数名: 值}}，覆盖配置中的参数 (例如网格搜索的核心参数组合)。
+                                被覆盖的参数不再随机采样。
+    resources (dict, optional): {效果名: {参数名: 值}}，编译时注入的资源参数，例如 {"add_noise": {"noise_dir": "noises"}}。
+    effects_package (str): 效果模块所在的包名。
+
+    返回:
+    CompiledChain: 编译后的效果链。效果模块无法导入时抛出 ImportError。
+    """
+    overrides = overrides or {}
+    resources = resources or {}
+    steps = []
+    for effect_config in effect_chain:
+        effect_name = effect_config.get("name")
+        module = importlib.import_module(f"{effects_package}.{effect_name}")
+
+        params = dict(effect_config.get("params", {}))
+        params.update(overrides.get(effect_name, {}))
+
+        static_params = {}
+        samplers = []
+        for key, value in params.items():
+            if isinstance(value, dict) and "random_type" in value:
+                sampler = _build_sampler(key, value)
+                if sampler is not None:
+                    samplers.append((key, sampler))
+                    continue
+            static_params[key] = value
+        static_params.update(resources.get(effect_name, {}))
+
+        steps.append(CompiledStep(effect_name, module, static_params, tuple(samplers)))
+    return CompiledChain(steps)
+
+
+_compiled_chains = {}
+
+
+def get_compiled_chain(effect_chain, overrides=None, resources=None):
+    """
+    返回效果链的编译结果，同一进程中相同的 (效果链, 覆盖参数, 资源) 只编译一次。
+    任务字典只需携带原始配置即可跨进程传递，每个子进程在首次遇到某个场景时编译它。
+    """
+    key = json.dumps([effect_chain, overrides, resources], sort_keys=True, default=str)
+    chain = _compiled_chains.get(key)
+    if chain is None:
+        chain = compile_chain(effect_chain, overrides, resources)
+        _compiled_chains[key] = chain
+    return chain
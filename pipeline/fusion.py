@@ -0,0 +1,269 @@
+import inspect
+from functools import lru_cache
+
+import numpy as np
+from pedalboard import Pedalboard
+
+from effects._spectral import apply_spectral
+
+
+class FixedParams(dict):
+    """
+    编译时就已确定 (不含随机采样) 的效果参数，由 CompiledStep.sample_params 返回。
+    只有这样的步骤才会复用缓存的 pedalboard 插件：随机参数每次取值都不同，缓存几乎不会命中。
+    """
+
+
+@lru_cache(maxsize=64)
+def _cached_plugins(effect_module, sr, frozen_params):
+    """参数固定的步骤的插件实例。Pedalboard 每次调用前都会重置插件状态，因此可以安全复用。"""
+    return effect_module.to_plugins(sr, **dict(frozen_params))
+
+
+def _plugins_for(effect_module, sr, params):
+    """
+    效果模块提供 to_plugins 且当前参数可以用 pedalboard 插件表达时返回插件列表，否则返回 None。
+    参数为 FixedParams 时返回按 (模块, 采样率, 参数) 缓存的实例，否则每次新建。
+    """
+    to_plugins = getattr(effect_module, "to_plugins", None)
+    if to_plugins is None:
+        return None
+    if isinstance(params, FixedParams):
+        try:
+            return _cached_plugins(effect_module, sr, tuple(sorted(params.items())))
+        except TypeError:
+            # 参数中含有不可哈希的值 (如列表)
+            pass
+    return to_plugins(sr, **params)
+
+
+def _spectral_for(effect_module, sr, params):
+    """效果模块提供 to_spectral 且当前参数可以用频谱变换表达时返回 SpectralTransform，否则返回 None。"""
+    to_spectral = getattr(effect_module, "to_spectral", None)
+    if to_spectral is None:
+        return None
+    return to_spectral(sr, **params)
+
+
+@lru_cache(maxsize=None)
+def _accepts(process_fn, name):
+    """效果的 process 是否接受名为 name 的参数 (如 out，见 effects/_buffers.py)。"""
+    return name in inspect.signature(process_fn).parameters
+
+
+class _PingPong:
+    """
+    效果链的工作缓冲区：接受 out 的效果轮流写入两块 float32 缓冲区，而不是每个效果各分配一块输出。
+    缓冲区只属于一次 apply_effect_chain 调用，返回给调用方的结果不会再被改写。
+    """
+
+    def __init__(self):
+        self._buffers = []
+
+    def take(self, current):
+        """返回一块与 current 同形状、且不与 current 重叠的缓冲区。"""
+        # 长度改变 (如 adjust_speed) 后旧缓冲区不再可用
+        self._buffers = [buf for buf in self._buffers if buf.shape == current.shape]
+        for buf in self._buffers:
+            if not np.may_share_memory(buf, current):
+                return buf
+        buf = np.empty(current.shape, dtype=np.float32)
+        self._buffers.append(buf)
+        return buf
+
+
+def _as_float32(y):
+    """保证效果之间传递的都是 float32 (不符合约定的效果输出在此转换一次)。"""
+    if isinstance(y, np.ndarray) and y.dtype != np.float32:
+        return y.astype(np.float32)
+    return y
+
+
+def apply_effect_chain(y, sr, steps):
+    """
+    依次应用一条参数已确定的效果链。
+
+    相邻的、能用 pedalboard 插件表达的效果 (混响、回声、wet=1 的滤波器等) 会被合并进同一个
+    Pedalboard，音频只需穿过一次 Python/C++ 边界，中间也不再为每个效果复制缓冲区。
+    同样地，相邻的、帧参数相同的频谱效果 (如 add_spectrogram_blur) 合并为一个频谱阶段，
+    只做一次 STFT 和一次 ISTFT (见 effects/_spectral.py)。
+    其余效果照常调用各自模块的 process 函数；接受 out 参数的效果在两块工作缓冲区之间来回写，
+    效果之间传递的数据始终是 float32。
+
+    效果链还会跟踪当前音频的综合响度：提供 output_loudness 的效果 (如 change_volume) 给出其输出的响度，
+    原样返回输入的效果保持响度不变，其余效果使它变为未知。响度已知时，接受 input_loudness 的效果
+    直接使用它，不再重新测量 (例如连续两次响度归一化只需测量一次)。
+
+    参数:
+    y (np.ndarray): 输入的音频数据。
+    sr (int): 采样率 (Hz)。
+    steps (list[tuple[str, module, dict]]): (效果名, 效果模块, 已解析的参数) 列表，通常由 CompiledChain.sample_steps 生成。
+
+    返回:
+    np.ndarray | None: 处理后的 float32 音频；任一效果出错时打印错误并返回 None。
+    """
+    processed_y = np.asarray(y, dtype=np.float32)
+    buffers = _PingPong()
+    loudness = None  # 当前音频的综合响度 (LUFS)，None 表示未知
+    pending_plugins = []
+    pending_names = []
+    pending_spectral = []
+    spectral_names = []
+
+    for effect_name, effect_module, params in steps:
+        try:
+            plugins = _plugins_for(effect_module, sr, params)
+            spectral = _spectral_for(effect_module, sr, params) if plugins is None else None
+        except Exception as e:
+            print(f"  ❌ 应用效果 '{effect_name}' 时出错: {e}")
+            return None
+
+        if pending_spectral and (spectral is None or not pending_spectral[0].compatible(spectral)):
+            processed_y = _run_spectral(processed_y, pending_spectral, spectral_names)
+            if processed_y is None:
+                return None
+            pending_spectral, spectral_names = [], []
+
+        if spectral is not None:
+            if pending_plugins:
+                processed_y = _run_board(processed_y, sr, pending_plugins, pending_names)
+                if processed_y is None:
+                    return None
+                pending_plugins, pending_names = [], []
+            pending_spectral.append(spectral)
+            spectral_names.append(effect_name)
+            loudness = None
+            continue
+
+        if plugins is not None:
+            # 缓存的插件实例在同一个 Pedalboard 中只能出现一次 (例如两个参数相同的相邻混响)，
+            # 遇到重复实例时先执行已合并的部分
+            if pending_plugins and any(p is q for p in plugins for q in pending_plugins):
+                processed_y = _run_board(processed_y, sr, pending_plugins, pending_names)
+                if processed_y is None:
+                    return None
+                pending_plugins, pending_names = [], []
+            pending_plugins.extend(plugins)
+            pending_names.append(effect_name)
+            loudness = None
+            continue
+
+        if pending_plugins:
+            processed_y = _run_board(processed_y, sr, pending_plugins, pending_names)
+            if processed_y is None:
+                return None
+            pending_plugins, pending_names = [], []
+
+        process_fn = effect_module.process
+        kwargs = dict(params)
+        if loudness is not None and _accepts(process_fn, "input_loudness"):
+            kwargs.setdefault("input_loudness", loudness)
+        if _accepts(process_fn, "out"):
+            kwargs["out"] = buffers.take(processed_y)
+        try:
+            result = process_fn(processed_y, sr, **kwargs)
+        except Exception as e:
+            print(f"  ❌ 应用效果 '{effect_name}' 时出错: {e}")
+            return None
+        loudness = _output_loudness(effect_module, params, loudness, result is processed_y)
+        processed_y = _as_float32(result)
+
+    if pending_plugins:
+        processed_y = _run_board(processed_y, sr, pending_plugins, pending_names)
+    elif pending_spectral:
+        processed_y = _run_spectral(processed_y, pending_spectral, spectral_names)
+
+    return processed_y
+
+
+def _output_loudness(effect_module, params, loudness, unchanged):
+    """一个效果执行后音频的综合响度；无法确定时返回 None。"""
+    if unchanged:
+        # 效果原样返回了输入 (例如被跳过的效果)
+        return loudness
+    output_loudness = getattr(effect_module, "output_loudness", None)
+    if output_loudness is None:
+        return None
+    return output_loudness(loudness, **params)
+
+
+def _run_board(y, sr, plugins, effect_names):
+    """用一个 Pedalboard 一次性执行多个效果的插件。"""
+    try:
+        return Pedalboard(plugins)(y, sr)
+    except Exception as e:
+        print(f"  ❌ 应用效果 {effect_names} 时出错: {e}")
+        return None
+
+
+def _run_spectral(y, transforms, effect_names):
+    """用一次 STFT/ISTFT 执行多个频谱效果的变换。"""
+    try:
+        return apply_spectral(y, transforms)
+    except Exception as e:
+        print(f"  ❌ 应用效果 {effect_names} 时出错: {e}")
+        return None
+
+
+def _param_columns(params_list):
+    """把每行一个的参数字典合并为 process_batch 的参数：所有行取值相同的参数传标量，否则传列表。"""
+    columns = {}
+    for key in params_list[0]:
+        values = [params[key] for params in params_list]
+        first = values[0]
+        columns[key] = first if all(value == first for value in values) else values
+    return columns
+
+
+def apply_effect_chain_batch(ys, sr, row_steps):
+    """
+    以二维数组的形式对同一输入的多个副本执行效果链。
+
+    声明了 process_batch 的效果 (例如 change_volume、add_noise、apply_filter、add_stutter_replace)
+    一次性处理整个 (n_rows, samples) 数组，每行使用各自的参数；其余效果逐行执行
+    (逐行执行时仍会合并相邻的 pedalboard 效果)。若某个效果改变了各行的长度 (如 adjust_speed)，
+    之后的效果都改为逐行执行。
+
+    参数:
+    ys (np.ndarray): 形状为 (n_rows, samples) 的输入。效果不得原地修改它。
+    sr (int): 采样率 (Hz)。
+    row_steps (list[list[tuple[str, module, dict]]]): 每行一份由 CompiledChain.sample_steps 生成的步骤列表。
+
+    返回:
+    list[np.ndarray] | None: 每行的处理结果；任一效果出错时打印错误并返回 None。
+    """
+    n_rows = len(row_steps)
+    n_steps = len(row_steps[0]) if n_rows else 0
+    current = ys
+    k = 0
+    while k < n_steps:
+        effect_name, effect_module, _ = row_steps[0][k]
+        batch_fn = getattr(effect_module, "process_batch", None)
+
+        if batch_fn is not None and isinstance(current, np.ndarray):
+            params = _param_columns([steps[k][2] for steps in row_steps])
+            try:
+                current = _as_float32(batch_fn(current, sr, **params))
+            except Exception as e:
+                print(f"  ❌ 批量应用效果 '{effect_name}' 时出错: {e}")
+                return None
+            k += 1
+            continue
+
+        # 一直逐行执行到下一个可以批处理的效果为止
+        end = k + 1
+        while end < n_steps and getattr(row_steps[0][end][1], "process_batch", None) is None:
+            end += 1
+        rows = []
+        for row, steps in zip(current, row_steps):
+            row = apply_effect_chain(row, sr, steps[k:end])
+            if row is None:
+                return None
+            rows.append(row)
+        if len({len(row) for row in rows}) == 1:
+            current = np.stack(rows)
+        else:
+            current = rows
+        k = end
+
+    return list(current)
@@ -0,0 +1,94 @@
+import os
+import threading
+from collections import OrderedDict
+
+import librosa
+
+# 默认缓存预算: 1 GiB 的 float32 样本
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+class InputCache:
+    """
+    已解码输入音频的 LRU 缓存。
+
+    每个输入文件在一次运行中只解码一次 (float32, 保持原始采样率)，之后所有场景、副本和
+    网格组合都直接复用同一块缓冲区。返回的数组被设置为只读，效果链必须生成新数组而不是原地修改。
+    缓存按 (绝对路径, 修改时间) 区分条目，占用字节数超过 `max_bytes` 时淘汰最久未使用的条目。
+    可以被多个线程同时使用 (流水线模式的预读线程)：解码在锁外进行，只有缓存表的读写持有锁。
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def load(self, filepath):
+        """
+        读取音频，命中缓存时不再解码。
+
+        返回:
+        tuple[np.ndarray, int]: 只读的 float32 单声道样本与采样率。
+        """
+        key = (os.path.abspath(filepath), os.path.getmtime(filepath))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        y, sr = librosa.load(filepath, sr=None)
+        y.flags.writeable = False
+        entry = (y, sr)
+
+        # 单个文件超过整个预算时不缓存，直接返回
+        if y.nbytes > self.max_bytes:
+            return entry
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = entry
+                self._bytes += y.nbytes
+            while self._bytes > self.max_bytes:
+                _, (old_y, _) = self._entries.popitem(last=False)
+                self._bytes -= old_y.nbytes
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+_cache = InputCache()
+
+
+def configure_input_cache(max_bytes):
+    """设置当前进程的缓存预算。作为进程池的 initializer 使用时，每个子进程各自持有一份缓存。"""
+    global _cache
+    _cache = InputCache(max_bytes)
+
+
+def get_input_cache():
+    """返回当前进程共享的输入缓存。"""
+    return _cache
+
+
+def parse_cache_mb_arg(arg):
+    """
+    解析 `--cache-mb=N` 命令行参数，返回字节数。
+    无效值会打印警告并回退为默认预算。
+    """
+    try:
+        cache_mb = int(arg.split('=')[1])
+        if cache_mb < 0:
+            raise ValueError
+    except (ValueError, IndexError):
+        print("⚠️ 警告：无效的 --cache-mb 参数格式。示例: --cache-mb=2048。将使用默认值。")
+        return DEFAULT_MAX_BYTES
+    return cache_mb * 1024 * 1024
@@ -0,0 +1,164 @@
+import hashlib
+import importlib
+import inspect
+import json
+import os
+from functools import lru_cache
+
+MANIFEST_NAME = "manifest.jsonl"
+
+
+@lru_cache(maxsize=None)
+def _file_digest(path, size, mtime_ns):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def input_hash(path):
+    """输入文件内容的 sha256。同一进程中按 (路径, 大小, 修改时间) 缓存，每个文件只读取一次。"""
+    st = os.stat(path)
+    return _file_digest(os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+
+def _effect_source_files(effect_name, effects_package="effects"):
+    """效果模块自身及其直接引用的同包模块 (如 _stream、noise_bank) 的源文件。"""
+    module = importlib.import_module(f"{effects_package}.{effect_name}")
+    names = {module.__name__}
+    for value in vars(module).values():
+        if inspect.ismodule(value):
+            names.add(value.__name__)
+        elif callable(value):
+            names.add(getattr(value, "__module__", None) or "")
+    return sorted(importlib.import_module(name).__file__
+                  for name in names if name.startswith(effects_package + "."))
+
+
+def scene_hash(effect_chain, overrides=None, resources=None, mode=None, encoding=None, speeds=None):
+    """
+    编译后场景的哈希：效果链配置、覆盖参数、资源参数、渲染模式、输出编码、倍速版本，以及所用效果模块的源码。
+    修改配置或效果实现后哈希随之改变，相关输出会在下次运行时重新生成。
+    噪音库等外部素材的内容不计入哈希，替换素材后请使用 --force。
+    """
+    payload = [effect_chain, overrides, resources, mode, encoding]
+    if speeds:
+        # 不生成倍速版本时哈希与之前相同，已有的清单仍然有效
+        payload.append(speeds)
+    h = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8"))
+    sources = set()
+    for effect_config in effect_chain:
+        sources.update(_effect_source_files(effect_config.get("name")))
+    if speeds:
+        sources.update(_effect_source_files("adjust_speed"))
+    for path in sorted(sources):
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def output_key(input_digest, scene_digest, seed, output_path):
+    """一个输出的内容键：输入、场景、种子或输出路径任一改变时都会改变。"""
+    key = "\x1f".join([input_digest, scene_digest, str(seed), os.path.normpath(output_path)])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def describe_steps(steps):
+    """把 [(效果名, 效果模块, 参数)] 转换为可写入清单的 [{"effect": 效果名, "params": 参数}]。"""
+    return [{"effect": effect_name, "params": params} for effect_name, _, params in steps]
+
+
+def make_row(job, output_path, steps):
+    """由任务字典 (需带有 input_hash / scene_hash / keys) 生成一个输出的清单行。"""
+    return {
+        "output": output_path,
+        "key": job["keys"][output_path],
+        "input": job["input_path"],
+        "input_hash": job["input_hash"],
+        "scene_hash": job["scene_hash"],
+        "seed": job.get("seed"),
+        "params": describe_steps(steps),
+    }
+
+
+class Manifest:
+    """
+    渲染清单：每个输出一行 JSON，记录输入哈希、场景哈希、种子和实际采样的参数。
+
+    运行期间每完成一个任务就追加并刷新对应的行，因此被中断的运行重新启动后，已经完成的输出会被跳过。
+    同一输出出现多次时以最后一行为准；打开清单时会先把它压缩为每个输出一行 (临时文件 + os.replace)。
+    exists 用于判断输出是否仍然存在，写入分片时应传入输出目标的 exists (见 pipeline.sinks)。
+    """
+
+    def __init__(self, path, exists=os.path.exists):
+        self.path = path
+        self.exists = exists
+        self._rows = {}
+        self._file = None
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 被中断时可能留下不完整的最后一行
+                        continue
+                    self._rows[row["output"]] = row
+
+    def __len__(self):
+        return len(self._rows)
+
+    def is_current(self, output_path, key):
+        """输出已存在且清单中记录的键与 key 相同时返回 True。"""
+        row = self._rows.get(output_path)
+        return row is not None and row["key"] == key and self.exists(output_path)
+
+    def open(self):
+        """压缩已有清单并打开以便追加。"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding="utf-8") as f:
+            for row in self._rows.values():
+                f.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, 'a', encoding="utf-8")
+
+    def record(self, rows):
+        """追加若干清单行并立即刷新到磁盘。"""
+        for row in rows:
+            self._rows[row["output"]] = row
+            self._file.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def attach_keys(job, output_paths, scene_digest):
+    """为任务补充清单所需的字段 (input_hash / scene_hash / 每个输出的键)，返回任务本身。"""
+    job["input_hash"] = input_hash(job["input_path"])
+    job["scene_hash"] = scene_digest
+    job["keys"] = {path: output_key(job["input_hash"], scene_digest, job.get("seed"), path) for path in output_paths}
+    return job
+
+
+def pending_jobs(jobs, manifest, force=False):
+    """
+    过滤掉所有输出都已是最新的任务。
+
+    返回:
+    tuple[list[dict], int]: (仍需执行的任务, 被跳过的输出数)。
+    """
+    if force:
+        return list(jobs), 0
+    pending = []
+    skipped = 0
+    for job in jobs:
+        if all(manifest.is_current(path, key) for path, key in job["keys"].items()):
+            skipped += len(job["keys"])
+        else:
+            pending.append(job)
+    return pending, skipped
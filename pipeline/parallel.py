@@ -0,0 +1,128 @@
+import hashlib
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+
+def derive_seed(*parts):
+    """
+    根据任务标识 (例如 场景名、输入文件名、副本编号) 派生一个确定性的随机种子。
+
+    同一组标识无论在串行还是并行模式下、无论被哪个进程执行，得到的种子都相同，
+    从而保证两种模式的输出逐位一致。
+
+    返回:
+    int: 范围在 [0, 2**32) 内的整数种子 (兼容 np.random.seed)。
+    """
+    key = "\x1f".join(str(p) for p in parts).encode("utf-8")
+    return int.from_bytes(hashlib.sha256(key).digest()[:4], "little")
+
+
+def seed_everything(seed):
+    """同时重置 `random` 与 `np.random` 的全局状态，效果模块内部的随机调用均受其控制。"""
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def parse_workers_arg(arg):
+    """
+    解析 `--workers=N` 命令行参数。
+    无效值会打印警告并回退为 1 (串行)。
+    """
+    try:
+        workers = int(arg.split('=')[1])
+    except (ValueError, IndexError):
+        print("⚠️ 警告：无效的 --workers 参数格式。示例: --workers=8。将使用串行模式。")
+        return 1
+    if workers < 1:
+        print("⚠️ 警告：--workers 必须是大于0的整数。将使用串行模式。")
+        return 1
+    return workers
+
+
+def _run_chunk(job_fn, jobs, pipeline):
+    """在子进程中用流水线执行器依次处理一组任务，返回与 jobs 一一对应的结果列表。"""
+    results = []
+    pipeline.run(job_fn, jobs, lambda job, result: results.append(result))
+    return results
+
+
+def _chunk_by_input(jobs, n_chunks):
+    """把任务划分为约 n_chunks 组，同一输入的相邻任务尽量留在同一组 (以便复用输入缓存)。"""
+    size = max(1, -(-len(jobs) // n_chunks))
+    chunks, current = [], []
+    for job in jobs:
+        if len(current) >= size and job["input_path"] != current[-1]["input_path"]:
+            chunks.append(current)
+            current = []
+        current.append(job)
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def run_jobs(job_fn, jobs, workers=1, initializer=None, initargs=(), on_result=None, pipeline=None):
+    """
+    执行任务列表，并在主进程中打印进度。
+
+    参数:
+    job_fn (callable): 处理单个任务的函数，必须定义在模块顶层以便跨进程传递。
+                       它接收一个任务字典，返回任意非 None 的结果 (例如输出路径或清单行)，失败时返回 None。
+    jobs (list[dict]): 任务列表。每个任务应自带 `seed`，由 job_fn 负责在处理前调用 seed_everything。
+    workers (int): 进程数。1 表示在当前进程中串行执行。
+    initializer (callable, optional): 在每个执行进程中、处理任务前调用一次 (串行模式下在当前进程调用)。
+    initargs (tuple): 传给 initializer 的参数。
+    on_result (callable, optional): 每个任务成功完成后在主进程中以 (任务, 结果) 调用，例如把清单行写入磁盘。
+    pipeline (PipelinedExecutor, optional): 流水线执行器。设置后每个进程内的输入预读、效果链与输出写出并发进行；
+                                            并行模式下任务按输入分组交给各进程，每组完成后统一报告进度。
+
+    返回:
+    int: 成功完成的任务数。
+    """
+    total = len(jobs)
+    if total == 0:
+        return 0
+
+    succeeded = 0
+    done = 0
+
+    def report(job, result):
+        nonlocal succeeded, done
+        done += 1
+        if result is not None:
+            succeeded += 1
+            if on_result is not None:
+                on_result(job, result)
+        print(f"  [{done}/{total}] {'✅' if result is not None else '❌'} {job.get('label', '')}")
+
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        if pipeline is not None:
+            pipeline.run(job_fn, jobs, report)
+            return succeeded
+        for job in jobs:
+            report(job, job_fn(job))
+        return succeeded
+
+    print(f"使用 {workers} 个进程并行处理 {total} 个任务...")
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        if pipeline is not None:
+            # 每个进程分到几组任务，组内由流水线执行器预读与写出
+            futures = {executor.submit(_run_chunk, job_fn, chunk, pipeline): chunk
+                       for chunk in _chunk_by_input(jobs, workers * 4)}
+        else:
+            futures = {executor.submit(job_fn, job): [job] for job in jobs}
+        for future in as_completed(futures):
+            chunk = futures[future]
+            try:
+                results = future.result()
+                if pipeline is None:
+                    results = [results]
+            except Exception as e:
+                print(f"  ❌ 任务 {', '.join(job.get('label', '') for job in chunk)} 在子进程中失败: {e}")
+                results = [None] * len(chunk)
+            for job, result in zip(chunk, results):
+                report(job, result)
+    return succeeded
@@ -0,0 +1,117 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .input_cache import get_input_cache
+from .render import set_deferred_writer, write_output_now
+
+DEFAULT_READERS = 2
+DEFAULT_WRITERS = 4
+# 每个阶段之间最多积压的任务数 (预读的输入、等待写出的结果)
+DEFAULT_DEPTH = 8
+
+
+def _prefetch(filepath):
+    """在预读线程中解码输入并放入输入缓存。失败时忽略，由任务自己在读取时报告错误。"""
+    try:
+        get_input_cache().load(filepath)
+    except Exception:
+        pass
+
+
+class PipelinedExecutor:
+    """
+    把 “解码 → 效果链 → 编码写出” 拆成三个并发阶段的执行器。
+
+    - 预读线程池提前解码后续任务的输入 (经由输入缓存)，最多领先 depth 个任务；
+    - 效果链在调用 run 的线程中按顺序执行，任务内的 write_output 只把结果交给写线程池；
+    - 写线程池负责编码和落盘，等待写出的结果超过 depth 个时 write_output 阻塞，形成反压。
+
+    任务的所有输出都写完后才算完成 (例如之后才写入清单)。
+    解码与写出 (libsndfile) 期间会释放 GIL，因此 DSP 线程不必等待文件系统。
+    """
+
+    def __init__(self, readers=DEFAULT_READERS, writers=DEFAULT_WRITERS, depth=DEFAULT_DEPTH):
+        self.readers = readers
+        self.writers = writers
+        self.depth = depth
+
+    def run(self, job_fn, jobs, on_done):
+        """
+        依次执行 job_fn(job)。每个任务的结果与其全部输出都完成后调用 on_done(job, result)，
+        任一输出写出失败时 result 为 None。
+        """
+        slots = threading.BoundedSemaphore(self.depth)
+        with ThreadPoolExecutor(self.readers) as read_pool, ThreadPoolExecutor(self.writers) as write_pool:
+            job_writes = []
+
+            def submit_write(output_path, y, sr):
+                slots.acquire()
+                future = write_pool.submit(write_output_now, output_path, y, sr)
+                future.add_done_callback(lambda _: slots.release())
+                job_writes.append(future)
+
+            lookahead = deque()
+            upcoming = iter(jobs)
+            last_input = None
+
+            def fill():
+                nonlocal last_input
+                while len(lookahead) < self.depth:
+                    job = next(upcoming, None)
+                    if job is None:
+                        return
+                    # 任务按输入排序，同一输入只预读一次
+                    future = None
+                    if job["input_path"] != last_input:
+                        future = read_pool.submit(_prefetch, job["input_path"])
+                        last_input = job["input_path"]
+                    lookahead.append((job, future))
+
+            in_flight = deque()
+            previous_writer = set_deferred_writer(submit_write)
+            try:
+                fill()
+                while lookahead:
+                    job, prefetched = lookahead.popleft()
+                    if prefetched is not None:
+                        prefetched.result()
+                    fill()
+
+                    job_writes = []
+                    result = job_fn(job)
+                    in_flight.append((job, result, job_writes))
+                    while in_flight and all(f.done() for f in in_flight[0][2]):
+                        self._finish(*in_flight.popleft(), on_done)
+            finally:
+                set_deferred_writer(previous_writer)
+
+            while in_flight:
+                self._finish(*in_flight.popleft(), on_done)
+
+    @staticmethod
+    def _finish(job, result, writes, on_done):
+        for future in writes:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"  ❌ 写出 {job.get('label', '')} 的结果时出错: {e}")
+                result = None
+        on_done(job, result)
+
+
+def parse_pipelined_arg(arg):
+    """
+    解析 `--pipelined` 或 `--pipelined=N` (N 为写线程数) 命令行参数，返回 PipelinedExecutor。
+    无效值会打印警告并使用默认线程数。
+    """
+    if '=' not in arg:
+        return PipelinedExecutor()
+    try:
+        writers = int(arg.split('=')[1])
+        if writers < 1:
+            raise ValueError
+    except (ValueError, IndexError):
+        print("⚠️ 警告：无效的 --pipelined 参数格式。示例: --pipelined=8。将使用默认线程数。")
+        return PipelinedExecutor()
+    return PipelinedExecutor(writers=writers)
@@ -0,0 +1,166 @@
+import itertools
+
+from .fusion import apply_effect_chain
+from .input_cache import get_input_cache
+from .parallel import derive_seed, seed_everything
+from .render import speed_steps, write_output, write_speed_variants
+
+
+def core_dims(effect_chain):
+    """
+    找出效果链配置中标记为 is_core 的参数，每个参数取 low / mid / high 三个水平。
+
+    返回:
+    list[list[tuple[str, str, str, float]]]: 每个核心参数的 (效果名, 参数名, 水平名, 取值) 列表；没有核心参数时为空列表。
+    各组合为这些列表的笛卡尔积 (itertools.product(*dims))。
+    """
+    # 同一效果在链中出现多次时，其核心参数合并到第一次出现的位置
+    core_params_map = {}
+    for effect in effect_chain:
+        for param_name, param_config in effect.get("params", {}).items():
+            if isinstance(param_config, dict) and param_config.get("is_core"):
+                min_val, max_val = param_config["min"], param_config["max"]
+                core_params_map.setdefault(effect["name"], {})[param_name] = {
+                    'low': min_val,
+                    'mid': (min_val + max_val) / 2,
+                    'high': max_val
+                }
+    return [[(effect_name, param_name, level_name, level_value) for level_name, level_value in levels.items()]
+            for effect_name, params in core_params_map.items() for param_name, levels in params.items()]
+
+
+def combination_params(combo):
+    """把一个核心参数组合转换为 get_compiled_chain 的覆盖参数 {效果名: {参数名: 取值}}。"""
+    params = {}
+    for effect_name, param_name, _, level_value in combo:
+        params.setdefault(effect_name, {})[param_name] = level_value
+    return params
+
+
+def combination_suffix(combo):
+    """由核心参数组合生成文件名后缀，例如 "room_size-low_cutoff_hz-mid" (与逐组合渲染的命名一致)。"""
+    return "_".join(f"{param_name}-{level_name}" for _, param_name, level_name, _ in combo)
+
+
+def _plan_segments(chain, dims):
+    """
+    把效果链切分为前缀树的各层。
+
+    每个效果在链中第一次出现的位置展开该效果的所有核心参数 (各水平的笛卡尔积)，
+    从该位置到下一个展开点之间的效果不再分叉，作为同一层一起执行 (相邻的 pedalboard 效果仍可合并)。
+
+    返回:
+    list[tuple[int, int, list[int]]]: (起始步, 结束步, 本层展开的核心参数在 dims 中的下标) 列表。
+    """
+    dims_by_effect = {}
+    for i, levels in enumerate(dims):
+        dims_by_effect.setdefault(levels[0][0], []).append(i)
+
+    branch_points = []
+    seen = set()
+    for k, step in enumerate(chain.steps):
+        if step.name in dims_by_effect and step.name not in seen:
+            seen.add(step.name)
+            branch_points.append((k, dims_by_effect[step.name]))
+    if not branch_points or branch_points[0][0] != 0:
+        branch_points.insert(0, (0, []))
+
+    segments = []
+    for (start, dim_indices), (end, _) in zip(branch_points, branch_points[1:] + [(len(chain.steps), None)]):
+        segments.append((start, end, dim_indices))
+    return segments
+
+
+def render_prefix_tree(filepath, chain, dims, output_path_for, seed_parts, freeze_random=False, speeds=None):
+    """
+    以前缀树的方式渲染一个输入的全部核心参数组合。
+
+    共享同一段核心参数前缀的组合在该前缀上的效果只执行一次，中间结果在其子树渲染期间保留在内存中
+    (深度优先，同时只保留从根到当前节点的一条路径)。例如 4 个核心参数、81 种组合的 strong_echo 场景中，
+    混响每个输入只执行 3 次而不是 81 次。
+
+    随机性:
+    - 默认每个树节点用由 (seed_parts, 节点路径) 派生的种子采样自己的非核心随机参数，
+      因此同一节点下的所有组合共享该节点之前的全部处理结果。
+    - freeze_random=True 时非核心随机参数每个输入只采样一次，同一层的所有节点还使用相同的种子
+      (例如 add_noise 选中同一个噪音文件)，各组合之间只有核心参数不同。
+
+    参数:
+    filepath (str): 输入音频路径。
+    chain (CompiledChain): 未覆盖核心参数的编译效果链。
+    dims (list[list[tuple[str, str, str, float]]]): 每个核心参数的 (效果名, 参数名, 水平名, 取值) 列表，
+                                                   顺序决定输出文件名中各部分的顺序。
+    output_path_for (callable): 接收组合后缀 (见 combination_suffix)，返回该组合的输出路径。
+    seed_parts (tuple): 派生种子用的任务标识，例如 (场景名, 输入文件名)。
+    freeze_random (bool): 是否为每个输入冻结非核心随机参数。
+    speeds (list[float], optional): 每个组合额外写出的倍速版本，直接由内存中的叶节点结果生成。
+
+    返回:
+    list[tuple[str, list]] | None: 成功时返回每个输出 (组合及其倍速版本) 的 (输出路径, 从根到叶实际使用的步骤)，
+                                   任一效果出错时返回 None。
+    """
+    try:
+        y, sr = get_input_cache().load(filepath)
+    except Exception as e:
+        print(f"  ❌ 读取文件 {filepath} 失败: {e}")
+        return None
+
+    segments = _plan_segments(chain, dims)
+    core_keys = {}
+    for levels in dims:
+        effect_name, param_name = levels[0][:2]
+        core_keys.setdefault(effect_name, set()).add(param_name)
+
+    frozen_params = None
+    if freeze_random:
+        seed_everything(derive_seed(*seed_parts, "frozen"))
+        frozen_params = [step.sample_params(skip=core_keys.get(step.name, ())) for step in chain.steps]
+
+    order = {(levels[0][0], levels[0][1]): i for i, levels in enumerate(dims)}
+    written = []
+
+    def visit(depth, y_prefix, combo, path_steps):
+        if depth == len(segments):
+            # 组合内核心参数按 dims 的顺序命名
+            ordered = sorted(combo, key=lambda entry: order[(entry[0], entry[1])])
+            output_path = output_path_for(combination_suffix(ordered))
+            write_output(output_path, y_prefix, sr)
+            written.append((output_path, path_steps))
+            if speeds:
+                speed_paths = write_speed_variants(output_path, y_prefix, sr, speeds)
+                if speed_paths is None:
+                    return False
+                written.extend((path, speed_steps(path_steps, speed)) for path, speed in zip(speed_paths, speeds))
+            return True
+
+        start, end, dim_indices = segments[depth]
+        for choice in itertools.product(*[dims[i] for i in dim_indices]):
+            node_combo = combo + list(choice)
+            overrides = {}
+            for effect_name, param_name, _, value in node_combo:
+                overrides.setdefault(effect_name, {})[param_name] = value
+
+            if freeze_random:
+                seed_everything(derive_seed(*seed_parts, "frozen", depth))
+            else:
+                seed_everything(derive_seed(*seed_parts, "prefix", depth, combination_suffix(node_combo)))
+
+            steps = []
+            for k in range(start, end):
+                step = chain.steps[k]
+                step_overrides = overrides.get(step.name, {})
+                if frozen_params is not None:
+                    params = dict(frozen_params[k])
+                else:
+                    params = step.sample_params(skip=step_overrides)
+                params.update(step_overrides)
+                steps.append((step.name, step.module, params))
+
+            y_node = apply_effect_chain(y_prefix, sr, steps)
+            if y_node is None or not visit(depth + 1, y_node, node_combo, path_steps + steps):
+                return False
+        return True
+
+    if not visit(0, y, [], []):
+        return None
+    return written
@@ -0,0 +1,162 @@
+import os
+
+from effects import adjust_speed
+
+from .fusion import apply_effect_chain
+from .input_cache import configure_input_cache, get_input_cache
+from .sinks import configure_output_sink, get_output_sink
+
+
+# 流水线模式 (pipeline.pipelined) 下设置为提交写出任务的函数，write_output 不再同步写盘
+_deferred_writer = None
+
+
+def set_deferred_writer(writer):
+    """设置 (或以 None 取消) write_output 的延迟写出函数，返回之前的设置。"""
+    global _deferred_writer
+    previous, _deferred_writer = _deferred_writer, writer
+    return previous
+
+
+def configure_worker(cache_bytes, output_config):
+    """执行进程的初始化函数：设置输入缓存上限与输出目标 (output_config 为 configure_output_sink 的关键字参数)。"""
+    configure_input_cache(cache_bytes)
+    configure_output_sink(**output_config)
+
+
+def write_output_now(output_path, y, sr):
+    """同步写出一个处理结果 (写成独立文件或追加到分片，见 pipeline.sinks)。"""
+    get_output_sink().write(output_path, y, sr)
+
+
+def write_output(output_path, y, sr):
+    """写出一个处理结果。流水线模式下只提交给写线程池，调用方不得再修改 y。"""
+    if _deferred_writer is not None:
+        _deferred_writer(output_path, y, sr)
+        return
+    write_output_now(output_path, y, sr)
+
+
+def speed_output_path(output_path, speed):
+    """倍速版本的输出路径，与 batch_adjust_speed.py 的命名相同，例如 "a.wav" -> "a_speed_0.50x.wav"。"""
+    base, ext = os.path.splitext(output_path)
+    return f"{base}_speed_{speed:.2f}x{ext}"
+
+
+def speed_steps(steps, speed):
+    """
+    倍速版本实际经过的步骤 (供写入清单)：原步骤之后再以固定速率执行 adjust_speed。
+    速率记录为 speed_min = speed_max = speed，按清单以 adjust_speed.process 重放得到同一结果。
+    """
+    return list(steps) + [("adjust_speed", adjust_speed, {"speed_min": speed, "speed_max": speed})]
+
+
+def write_speed_variants(output_path, y, sr, speeds):
+    """
+    直接由内存中的处理结果生成各倍速版本并写出 (STFT 只计算一次，见 adjust_speed.time_stretch_multi)，
+    不需要先写盘再重新读取。
+
+    返回:
+    list[str] | None: 写出的倍速版本路径；时间拉伸出错时返回 None。
+    """
+    try:
+        variants = adjust_speed.time_stretch_multi(y, speeds)
+    except Exception as e:
+        print(f"  ❌ 生成 {output_path} 的倍速版本时出错: {e}")
+        return None
+    paths = []
+    for speed, y_speed in zip(speeds, variants):
+        path = speed_output_path(output_path, speed)
+        write_output(path, y_speed, sr)
+        paths.append(path)
+    return paths
+
+
+def parse_speeds_arg(arg):
+    """
+    解析 `--speeds=0.5,1.25,2.0` 命令行参数，返回速度倍率列表。
+    无效值会打印警告并返回 None (不生成倍速版本)。
+    """
+    try:
+        speeds = [float(value) for value in arg.split('=', 1)[1].split(',')]
+        if any(speed <= 0 for speed in speeds):
+            raise ValueError
+    except (ValueError, IndexError):
+        print("⚠️ 警告：无效的 --speeds 参数格式。示例: --speeds=0.5,1.25,2.0。将不生成倍速版本。")
+        return None
+    return speeds
+
+
+def render_audio(filepath, chain, steps=None):
+    """
+    对单个音频文件应用一条编译后的效果链，只在内存中返回结果，不写出。
+
+    返回:
+    tuple[np.ndarray, int] | None: 处理后的音频与采样率，失败时返回 None。
+    """
+    try:
+        # 同一输入在本次运行中只解码一次，y 是缓存中的只读缓冲区
+        y, sr = get_input_cache().load(filepath)
+    except Exception as e:
+        print(f"  ❌ 读取文件 {filepath} 失败: {e}")
+        return None
+
+    if steps is None:
+        steps = chain.sample_steps()
+    processed_y = apply_effect_chain(y, sr, steps)
+    if processed_y is None:
+        return None
+    return processed_y, sr
+
+
+def process_audio_file(filepath, output_path, chain, steps=None, speeds=None):
+    """
+    对单个音频文件应用一条编译后的效果链并写出结果。
+
+    参数:
+    filepath (str): 输入音频路径。
+    output_path (str): 输出音频路径。
+    chain (CompiledChain): 由 compile_chain / get_compiled_chain 得到的效果链。
+    steps (list, optional): 已由 chain.sample_steps() 采样的步骤 (例如需要把参数写入清单时)。默认在此处采样。
+    speeds (list[float], optional): 额外写出的倍速版本 (路径见 speed_output_path)。
+
+    返回:
+    str | None: 成功时返回输出路径，失败时返回 None。
+    """
+    rendered = render_audio(filepath, chain, steps)
+    if rendered is None:
+        return None
+    processed_y, sr = rendered
+
+    write_output(output_path, processed_y, sr)
+    if speeds and write_speed_variants(output_path, processed_y, sr, speeds) is None:
+        return None
+    return output_path
+
+
+def process_audio_file_batch(filepath, output_paths, chain, row_steps=None):
+    """
+    对单个音频文件一次渲染 len(output_paths) 个副本并分别写出。
+
+    参数:
+    filepath (str): 输入音频路径。
+    output_paths (list[str]): 每个副本的输出路径。
+    chain (CompiledChain): 编译后的效果链。
+    row_steps (list, optional): 每个副本已采样的步骤，默认在此处采样。
+
+    返回:
+    list[str] | None: 成功时返回输出路径列表，失败时返回 None。
+    """
+    try:
+        y, sr = get_input_cache().load(filepath)
+    except Exception as e:
+        print(f"  ❌ 读取文件 {filepath} 失败: {e}")
+        return None
+
+    rows = chain.run_batch(y, sr, len(output_paths), row_steps)
+    if rows is None:
+        return None
+
+    for output_path, processed_y in zip(output_paths, rows):
+        write_output(output_path, processed_y, sr)
+    return output_paths
@@ -0,0 +1,316 @@
+import contextlib
+import glob
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+
+import soundfile as sf
+
+# 输出编码: 名称 -> (扩展名, soundfile 格式, soundfile 子类型)
+# pcm16 与之前 sf.write 写 WAV 时的默认子类型相同；flac 为无损压缩的 16 位 PCM，通常只有 WAV 的一半左右大小。
+ENCODINGS = {
+    "pcm16": (".wav", "WAV", "PCM_16"),
+    "float": (".wav", "WAV", "FLOAT"),
+    "flac": (".flac", "FLAC", "PCM_16"),
+}
+DEFAULT_ENCODING = "pcm16"
+
+SHARDS_DIRNAME = "shards"
+DEFAULT_SHARD_BYTES = 1024 * 1024 * 1024
+# tar 归档末尾的两个全零块
+_TAR_END = tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+
+
+def output_extension(encoding):
+    """输出编码对应的文件扩展名 (含点号)。"""
+    return ENCODINGS[encoding][0]
+
+
+def encode_audio(y, sr, encoding=DEFAULT_ENCODING):
+    """
+    把音频编码为与输出文件完全相同的字节 (例如 pcm16 为 16 位 WAV，超出 [-1, 1] 的样本被截断)。
+    与 sf.write 写盘的结果逐字节相同，可直接作为内容哈希或写入分片。
+    """
+    _, file_format, subtype = ENCODINGS[encoding]
+    buffer = io.BytesIO()
+    sf.write(buffer, y, sr, format=file_format, subtype=subtype)
+    return buffer.getvalue()
+
+
+@contextlib.contextmanager
+def atomic_output(output_path):
+    """
+    提供一个与 output_path 同目录、同扩展名的临时路径，写完后再 os.replace 到 output_path。
+    被中断的运行不会留下写了一半的输出文件；出错时删除临时文件。
+    """
+    directory, filename = os.path.split(output_path)
+    os.makedirs(directory, exist_ok=True)
+    base, ext = os.path.splitext(filename)
+    tmp_path = os.path.join(directory, f".{base}.{os.getpid()}.tmp{ext}")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class DirectorySink:
+    """每个输出写成一个独立文件 (默认行为)。"""
+
+    def __init__(self, encoding=DEFAULT_ENCODING):
+        self.encoding = encoding
+        _, self.format, self.subtype = ENCODINGS[encoding]
+
+    def write(self, output_path, y, sr):
+        """以原子方式写出一个处理结果，必要时创建输出目录。"""
+        with atomic_output(output_path) as tmp_path:
+            sf.write(tmp_path, y, sr, format=self.format, subtype=self.subtype)
+
+    @contextlib.contextmanager
+    def open_stream(self, output_path, sr):
+        """返回可逐块 write 的单声道 SoundFile，退出时原子地落盘 (供流式模式使用)。"""
+        with atomic_output(output_path) as tmp_path:
+            with sf.SoundFile(tmp_path, 'w', samplerate=sr, channels=1,
+                              format=self.format, subtype=self.subtype) as out_file:
+                yield out_file
+
+    def exists(self, output_path):
+        return os.path.exists(output_path)
+
+    def close(self):
+        pass
+
+
+def _load_index(shard_dir):
+    """读取 shard_dir 下所有分片的索引，返回 {成员名: 索引行}。同名成员以最后写入的为准。"""
+    entries = {}
+    for index_path in sorted(glob.glob(os.path.join(shard_dir, "*.index.jsonl"))):
+        shard_path = index_path[:-len(".index.jsonl")] + ".tar"
+        with open(index_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    # 被中断时可能留下不完整的最后一行
+                    continue
+                row["shard"] = shard_path
+                old = entries.get(row["name"])
+                if old is None or row["written"] >= old["written"]:
+                    entries[row["name"]] = row
+    return entries
+
+
+class ShardSink:
+    """
+    把输出写入 tar 分片 (WebDataset 风格)，而不是为每个输出创建一个文件。
+
+    成员名是输出相对于 root 的路径 (例如 "scene/input/input_variant_1.wav")，分片写满 shard_bytes 后换新分片。
+    每个分片旁有一个 `.index.jsonl` 索引，记录每个成员的数据偏移与长度，读取时可以直接 seek，无需扫描 tar。
+    每写入一个成员都会补上 tar 结尾块并刷新，因此被中断的分片仍是完整可读的 tar 文件。
+
+    每个进程写入自己的分片 (文件名含进程号)，同一进程内的多个写线程共用一个锁。
+    重新生成的输出会追加为新成员，旧成员留在原分片中，读取时以索引中最后写入的为准。
+    """
+
+    def __init__(self, root, shard_dir=None, shard_bytes=DEFAULT_SHARD_BYTES, encoding=DEFAULT_ENCODING):
+        self.root = root
+        self.shard_dir = shard_dir or os.path.join(root, SHARDS_DIRNAME)
+        self.shard_bytes = shard_bytes
+        self.encoding = encoding
+        _, self.format, self.subtype = ENCODINGS[encoding]
+        self._lock = threading.Lock()
+        self._tar = None
+        self._index = None
+        self._seq = 0
+        self._written = None
+
+    def _member_name(self, output_path):
+        return os.path.relpath(output_path, self.root).replace(os.sep, "/")
+
+    def _open_next_shard(self):
+        os.makedirs(self.shard_dir, exist_ok=True)
+        while True:
+            path = os.path.join(self.shard_dir, f"shard-{os.getpid()}-{self._seq:06d}.tar")
+            self._seq += 1
+            try:
+                # 'x' 模式：不会覆盖之前运行 (可能恰好是同一进程号) 留下的分片
+                self._tar = open(path, 'xb')
+            except FileExistsError:
+                continue
+            self._index = open(path[:-len(".tar")] + ".index.jsonl", 'w', encoding="utf-8")
+            return
+
+    def _close_shard(self):
+        if self._tar is not None:
+            self._tar.close()
+            self._index.close()
+            self._tar = self._index = None
+
+    def _append(self, name, fileobj, size):
+        """在锁内把一个成员追加到当前分片，写完后补上结尾块并记录索引。"""
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(time.time())
+        header = info.tobuf(format=tarfile.PAX_FORMAT, encoding="utf-8")
+        with self._lock:
+            if self._tar is None or (self._tar.tell() > 0 and
+                                     self._tar.tell() + len(header) + size > self.shard_bytes):
+                self._close_shard()
+                self._open_next_shard()
+            start = self._tar.tell()
+            self._tar.write(header)
+            shutil.copyfileobj(fileobj, self._tar, 1 << 20)
+            remainder = size % tarfile.BLOCKSIZE
+            if remainder:
+                self._tar.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+            end = self._tar.tell()
+            # 先写结尾块使分片随时可读，下一个成员从结尾块处开始覆盖
+            self._tar.write(_TAR_END)
+            self._tar.flush()
+            self._tar.seek(end)
+            self._index.write(json.dumps({"name": name, "offset": start + len(header), "size": size,
+                                          "written": time.time_ns()}, ensure_ascii=False) + "\n")
+            self._index.flush()
+            if self._written is not None:
+                self._written.add(name)
+
+    def write(self, output_path, y, sr):
+        """编码一个处理结果 (在锁外) 并追加到当前分片。"""
+        data = encode_audio(y, sr, self.encoding)
+        self._append(self._member_name(output_path), io.BytesIO(data), len(data))
+
+    @contextlib.contextmanager
+    def open_stream(self, output_path, sr):
+        """流式输出先写入分片目录下的临时文件，完成后整体追加到分片并删除临时文件。"""
+        os.makedirs(self.shard_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix=output_extension(self.encoding), dir=self.shard_dir)
+        os.close(fd)
+        try:
+            with sf.SoundFile(tmp_path, 'w', samplerate=sr, channels=1,
+                              format=self.format, subtype=self.subtype) as out_file:
+                yield out_file
+            with open(tmp_path, 'rb') as f:
+                self._append(self._member_name(output_path), f, os.path.getsize(tmp_path))
+        finally:
+            os.remove(tmp_path)
+
+    def exists(self, output_path):
+        """output_path 是否已写入某个分片 (首次调用时读取已有索引)。"""
+        if self._written is None:
+            self._written = set(_load_index(self.shard_dir)) if os.path.isdir(self.shard_dir) else set()
+        return self._member_name(output_path) in self._written
+
+    def close(self):
+        with self._lock:
+            self._close_shard()
+
+
+class ShardReader:
+    """
+    按 ShardSink 写出的索引读取分片中的成员，不必解包 tar。
+
+    用法:
+    reader = ShardReader("data_output/shards")
+    for name in reader.names():
+        y, sr = sf.read(reader.open(name))
+    """
+
+    def __init__(self, shard_dir):
+        self.shard_dir = shard_dir
+        self._entries = _load_index(shard_dir)
+        self._files = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def names(self):
+        """所有成员名，按名称排序。"""
+        return sorted(self._entries)
+
+    def size(self, name):
+        """成员的字节数 (不读取数据)。"""
+        return self._entries[name]["size"]
+
+    def read(self, name):
+        """返回成员的原始字节 (已编码的 WAV/FLAC)。"""
+        entry = self._entries[name]
+        f = self._files.get(entry["shard"])
+        if f is None:
+            f = self._files[entry["shard"]] = open(entry["shard"], 'rb')
+        f.seek(entry["offset"])
+        return f.read(entry["size"])
+
+    def open(self, name):
+        """返回成员内容的内存文件对象，可直接传给 soundfile / librosa。"""
+        return io.BytesIO(self.read(name))
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+
+def has_shards(root):
+    """root (输出目录) 下是否有 ShardSink 写出的分片。"""
+    return bool(glob.glob(os.path.join(root, SHARDS_DIRNAME, "*.index.jsonl")))
+
+
+_sink = DirectorySink()
+
+
+def get_output_sink():
+    """返回当前进程的输出目标。"""
+    return _sink
+
+
+def configure_output_sink(encoding=DEFAULT_ENCODING, shard_root=None, shard_bytes=DEFAULT_SHARD_BYTES):
+    """
+    设置当前进程的输出目标：shard_root 为 None 时每个输出写成独立文件，否则写入 shard_root 下的分片。
+    在并行模式下作为进程初始化函数的一部分调用。返回新的输出目标。
+    """
+    global _sink
+    _sink.close()
+    if shard_root is None:
+        _sink = DirectorySink(encoding)
+    else:
+        _sink = ShardSink(shard_root, shard_bytes=shard_bytes, encoding=encoding)
+    return _sink
+
+
+def parse_encoding_arg(arg):
+    """
+    解析 `--encoding=pcm16|float|flac` 命令行参数。
+    无效值会打印警告并回退为默认编码。
+    """
+    encoding = arg.split('=', 1)[1] if '=' in arg else ""
+    if encoding not in ENCODINGS:
+        print(f"⚠️ 警告：无效的 --encoding 参数。可选: {', '.join(ENCODINGS)}。将使用 {DEFAULT_ENCODING}。")
+        return DEFAULT_ENCODING
+    return encoding
+
+
+def parse_shards_arg(arg):
+    """
+    解析 `--shards` 或 `--shards=MB` (每个分片的目标大小) 命令行参数，返回字节数。
+    无效值会打印警告并使用默认大小。
+    """
+    if '=' not in arg:
+        return DEFAULT_SHARD_BYTES
+    try:
+        mb = float(arg.split('=')[1])
+        if mb <= 0:
+            raise ValueError
+    except (ValueError, IndexError):
+        print("⚠️ 警告：无效的 --shards 参数格式。示例: --shards=512。将使用默认大小 1024 MB。")
+        return DEFAULT_SHARD_BYTES
+    return int(mb * 1024 * 1024)
@@ -0,0 +1,123 @@
+import random
+
+import numpy as np
+import soundfile as sf
+
+from effects._stream import EMPTY, PluginStream, StftStream
+
+from .fusion import _accepts
+from .sinks import get_output_sink
+
+# 每次读入的音频长度 (秒)。峰值内存只与块长有关，与文件总长度无关。
+DEFAULT_BLOCK_SECONDS = 10.0
+
+
+def _read_blocks(filepath, blocksize):
+    """按块读取音频并混合为单声道 float32，解码结果与 librosa.load(sr=None) 相同。"""
+    for block in sf.blocks(filepath, blocksize=blocksize, dtype='float32', always_2d=True):
+        yield block.mean(axis=1) if block.shape[1] > 1 else block[:, 0]
+
+
+def _build_streams(steps, sr, stats, verbose=True):
+    """
+    为效果链的每一步创建流对象。相邻的 pedalboard 流合并为一个 Pedalboard，相邻且帧参数相同的 STFT 流合并为一个频谱阶段
+    (与 apply_effect_chain 的合并方式相同)。
+    stats[k] 是第 k 步 stream_stats 的测量结果，会作为 make_stream 的第二个参数传入。
+    verbose=False 时传给接受 verbose 参数的 make_stream，效果不打印提示信息。
+    """
+    streams = []
+    for k, (effect_name, effect_module, params) in enumerate(steps):
+        make_stream = getattr(effect_module, "make_stream", None)
+        if make_stream is None:
+            raise ValueError(f"效果 '{effect_name}' 不支持流式处理")
+        kwargs = dict(params)
+        if not verbose and _accepts(make_stream, "verbose"):
+            kwargs["verbose"] = False
+        if k in stats:
+            stream = make_stream(sr, stats[k], **kwargs)
+        else:
+            stream = make_stream(sr, **kwargs)
+
+        merged = None
+        if streams and type(stream) is type(streams[-1]) and isinstance(stream, (PluginStream, StftStream)):
+            merged = streams[-1].merged(stream)
+        if merged is not None:
+            streams[-1] = merged
+        else:
+            streams.append(stream)
+    return streams
+
+
+def _run_pass(filepath, blocksize, streams, consume):
+    """把输入逐块送过所有流，并把每块输出交给 consume。输入结束后依次冲刷各个流。"""
+    for block in _read_blocks(filepath, blocksize):
+        for stream in streams:
+            if len(block) == 0:
+                break
+            block = stream.process(block)
+        if len(block):
+            consume(block)
+
+    tail = EMPTY
+    for stream in streams:
+        head = stream.process(tail) if len(tail) else EMPTY
+        tail = np.concatenate([head, stream.flush()])
+    if len(tail):
+        consume(tail)
+
+
+def process_audio_file_streaming(filepath, output_path, chain, block_seconds=DEFAULT_BLOCK_SECONDS, steps=None):
+    """
+    以固定大小的块流式处理单个音频文件，边处理边写出，峰值内存与文件长度无关。
+
+    效果链中的每个效果都必须提供 make_stream (见 effects/_stream.py)。
+    需要整段统计量的效果 (change_volume 的输入响度、add_noise 的信号 RMS) 先对其之前的效果链做一遍
+    只测量不写出的流式处理；每一遍开始前都会恢复同一个随机状态，因此各遍中的随机选择 (噪音文件、卡顿位置等) 完全相同。
+
+    参数:
+    filepath (str): 输入音频路径。
+    output_path (str): 输出音频路径。
+    chain (CompiledChain): 编译后的效果链。
+    block_seconds (float): 每块的长度 (秒)。
+    steps (list, optional): 已由 chain.sample_steps() 采样的步骤，默认在此处采样。
+
+    返回:
+    str | None: 成功时返回输出路径，失败时返回 None。
+    """
+    try:
+        sr = sf.info(filepath).samplerate
+    except Exception as e:
+        print(f"  ❌ 读取文件 {filepath} 失败: {e}")
+        return None
+    blocksize = max(int(block_seconds * sr), 1)
+
+    if steps is None:
+        steps = chain.sample_steps()
+    py_state, np_state = random.getstate(), np.random.get_state()
+
+    def restore_random_state():
+        random.setstate(py_state)
+        np.random.set_state(np_state)
+
+    try:
+        stats = {}
+        for k, (effect_name, effect_module, params) in enumerate(steps):
+            stream_stats = getattr(effect_module, "stream_stats", None)
+            if stream_stats is None:
+                continue
+            restore_random_state()
+            accumulator = stream_stats(sr, **params)
+            # 测量遍中的提示信息会在最终一遍中再次出现，这里不重复打印
+            _run_pass(filepath, blocksize, _build_streams(steps[:k], sr, stats, verbose=False), accumulator.update)
+            stats[k] = accumulator.result()
+
+        restore_random_state()
+        streams = _build_streams(steps, sr, stats)
+        # 先写入临时文件，完成后再重命名 (或追加到分片)，不留下写了一半的输出
+        with get_output_sink().open_stream(output_path, sr) as out_file:
+            _run_pass(filepath, blocksize, streams, out_file.write)
+    except Exception as e:
+        print(f"  ❌ 流式处理 {filepath} 时出错: {e}")
+        return None
+
+    return output_path
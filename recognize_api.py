@@ -2,6 +2,9 @@ import os
 import dashscope
 from http import HTTPStatus
 
+from evaluation.asr_cache import ASRCache, cache_key, content_hash
+from evaluation.qwen_client import ASR_OPTIONS, MODEL_NAME
+
 # --- 新增部分：明确指定API服务区域 ---
 # 这是官方示例中的配置，用于指定新加坡区的服务。
 # 如果您的API Key是在北京区等中国内地创建的，请将其替换为: 'https://dashscope.aliyuncs.com/api/v1'
@@ -24,6 +27,15 @@ def recognize_local_audio(file_path):
     print(f"正在识别文件: {local_file_path}")
     print(f"使用API服务地址: {dashscope.base_http_api_url}")
 
+    # 内容相同的音频已识别过时直接使用缓存的结果 (与 qwen_batch 等脚本共用缓存)
+    cache = ASRCache()
+    key = cache_key(content_hash(file_path), "qwen", MODEL_NAME, ASR_OPTIONS)
+    cached_text = cache.get(key)
+    if cached_text is not None:
+        print("\n识别结果 (来自缓存):", cached_text)
+        cache.close()
+        return
+
     # 3. 构造请求消息
     messages = [
         {
@@ -41,14 +53,11 @@ def recognize_local_audio(file_path):
     # 4. 调用 API 并进行健壮的错误处理
     try:
         response = dashscope.MultiModalConversation.call(
-            model="qwen3-asr-flash",
+            model=MODEL_NAME,
             messages=messages,
             api_key=api_key,
             result_format="message",
-            asr_options={
-                "enable_lid": True,
-                "enable_itn": True
-            }
+            asr_options=ASR_OPTIONS
         )
 
         # 5. 清晰地处理和打印结果
@@ -57,6 +66,7 @@ def recognize_local_audio(file_path):
             # 直接提取并显示识别出的文本
             recognized_text = response.output.choices[0].message.content[0]['text']
             print("识别结果:", recognized_text)
+            cache.put(key, recognized_text.strip())
         else:
             print(f"\n识别失败，请求ID: {response.request_id}")
             print(f"状态码: {response.status_code}")
@@ -20,8 +20,12 @@
 import os
 import whisper
 
+from evaluation.asr_cache import ASRCache, content_hash
+
 # 加载模型到 CPU
 model = whisper.load_model("turbo", device="cpu")
+# 识别结果缓存 (与 evaluation/whisper_batch.py 等脚本共用)，重复运行时已识别过的音频不再转录
+cache = ASRCache()
 
 # 输入目录
 input_dir = "data_evalued/music_background_ambient"
@@ -35,12 +39,16 @@ for filename in os.listdir(input_dir):
 
     try:
         # 转录音频
-        result = model.transcribe(filepath, fp16=False)  # CPU 推理要加 fp16=False
+        text = cache.lookup(lambda: model.transcribe(filepath, fp16=False)['text'],  # CPU 推理要加 fp16=False
+                            content_hash(filepath), "whisper", "turbo", {"decode": "transcribe", "fp16": False})
         # 打印结果
-        print(f"{filename}: {result['text']}")
+        print(f"{filename}: {text}")
     except Exception as e:
         print(f"处理 {filename} 出错: {e}")
 
+print(cache.summary())
+cache.close()
+
 
 # import os
 # import whisper